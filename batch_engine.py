@@ -0,0 +1,432 @@
+# batch_engine.py
+#
+# In-process execution engine for the image task queue.
+# Queue lines use the same grammar as run_image_generation.py and are executed by calling the
+# generation engine (image_engine.py, with the model profiles of model_profiles.json) directly,
+# in one long-lived process, instead of spawning `python run_image_generation.py` per task.
+# run_queue() checks the tasks first (preflight.py), runs them with one worker thread per WebUI
+# server (task_dispatch.py), appends successful tasks to the done file and writes failed tasks
+# back to the queue file; per-task output is captured to task_logs/ (task_output.py).
+# Compatible tasks are merged into one txt2img request (batch_size/n_iter) and split back into
+# the tasks' own files, fixed-seed tasks generated before are served from the result cache
+# (result_cache.py), and sweep lines are expanded into one task per combination (sweep.py).
+# For a durable SQLite queue, see store_runner.py.
+#
+# Usage:
+#   import batch_engine
+#   batch_engine.run_queue("image_tasks_new_20250621.txt", "image_tasks_done_20250621.txt")
+#   batch_engine.run_queue(queue, done, backends=["http://gpu1:7860", "http://gpu2:7860"])
+
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import traceback
+
+import image_engine
+import image_io
+import model_profiles
+import postprocess
+import preflight
+import result_cache
+import run_image_generation
+import sweep
+import task_cost
+import task_dispatch
+import task_output
+import task_timing
+import webui_client
+
+# Directory of the scripts; relative output directories are resolved against it
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Maximum number of tasks merged into one txt2img request, and images per GPU batch
+MAX_BATCH_TASKS = 4
+MAX_BATCH_SIZE = 4
+
+# Result cache used by the engine (result_cache.ResultCache), or None to always generate
+cache = None
+
+def read_queue_lines(queue_file):
+    """Read the non-empty, non-comment lines of the queue file as (line, tasks of the line) pairs (see sweep.py)."""
+    with open(queue_file, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+    return [(line, sweep.expand_tasks([line])) for line in lines]
+
+def read_queue(queue_file):
+    """Read all non-empty, non-comment lines from the queue file, with sweep lines expanded (see sweep.py)."""
+    return [task for _, tasks in read_queue_lines(queue_file) for task in tasks]
+
+def resolve_output_dir(args):
+    """Return the task's output directory; relative paths are resolved against the script directory."""
+    return args.output if os.path.isabs(args.output) else os.path.join(BASE_DIR, args.output)
+
+def generate_from_args(args, skip_setup=False, client=None):
+    """
+    Run one generation described by parsed run_image_generation arguments, in this process.
+    Raises on any error (missing model files, HTTP errors, ...).
+    """
+    profile, payload, filepath, info = image_engine.generate_from_args(args, resolve_output_dir(args), skip_setup, client)
+    cache_result(payload, profile.checkpoint_title, filepath, info)
+
+def cache_result(payload, checkpoint, filepath, info):
+    """Add a generated image to the result cache once it has been written (fixed-seed payloads only)."""
+    if cache is None or not result_cache.is_cacheable(payload):
+        return
+    key = result_cache.cache_key(payload, checkpoint)
+    image_io.get_writer().when_written(lambda: cache.store(key, filepath, info))
+
+def restore_from_cache(args):
+    """
+    Place the cached image of a task (fixed seed only) in its output directory, with its metadata.
+    Returns True on a cache hit, False if the task has to be generated.
+    """
+    if cache is None or args.seed == -1:
+        return False
+    profile = model_profiles.get_profile(args.script)
+    payload = profile.build_payload(args.prompt, args.negative, args.seed, args.width, args.height, args.steps, args.cfg)
+    key = result_cache.cache_key(payload, profile.checkpoint_title)
+    filepath = image_io.reserve_path(resolve_output_dir(args), image_engine.image_stem(profile, args.seed))
+    try:
+        info = cache.restore(key, filepath)
+    finally:
+        image_io.release_path(filepath)
+    if info is None:
+        return False
+    print(f"Image restored from cache: {filepath} (key {key})")
+    if image_engine.postprocessor is not None:
+        with open(filepath, "rb") as f:
+            image_engine.postprocessor.submit(filepath, f.read())
+    # The cached image already has its metadata embedded
+    meta_filepath = image_engine.save_metadata(profile, filepath, args.prompt, args.negative, args.seed, args.width,
+                                               args.height, args.steps, info, args.cfg, embed=False)
+    print(f"Metadata saved to: {meta_filepath}")
+    return True
+
+def run_sweep(args_list, client=None):
+    """
+    Run the expanded tasks of a sweep (parsed arguments, see sweep.py) in this process, printing
+    their output: one model setup per model, compatible tasks batched, then the contact sheet.
+    Returns the number of tasks that failed.
+    """
+    groups = []
+    for args in args_list:
+        # Like a single run on the command line, relative paths are relative to the current directory
+        args.output = os.path.abspath(args.output)
+        args.sweep_root = args.sweep_root and os.path.abspath(args.sweep_root)
+        if groups and len(groups[-1]) < MAX_BATCH_TASKS and task_dispatch.can_join_batch(groups[-1], args):
+            groups[-1].append(args)
+        else:
+            groups.append([args])
+    loaded = None
+    failed = 0
+    for group in groups:
+        model = task_dispatch.task_model(group[0].script)
+        try:
+            if len(group) > 1:
+                generate_batch(group, skip_setup=(model == loaded), client=client)
+            else:
+                generate_from_args(group[0], skip_setup=(model == loaded), client=client)
+            loaded = model
+        except Exception:
+            traceback.print_exc()
+            failed += len(group)
+            loaded = None  # The server state is unknown after a failure
+    try:
+        image_io.get_writer().flush()
+    except OSError as e:
+        print(f"Failed to write an image: {e}")
+        failed = failed or 1
+    for root in {args.sweep_root for args in args_list if args.sweep_root}:
+        path = sweep.write_contact_sheet(root)
+        if path:
+            print(f"Contact sheet: {path}")
+    return failed
+
+def split_batch(count, max_batch_size=MAX_BATCH_SIZE):
+    """Return (batch_size, n_iter) with batch_size * n_iter == count and batch_size <= max_batch_size."""
+    batch_size = max(size for size in range(1, min(count, max_batch_size) + 1) if count % size == 0)
+    return batch_size, count // batch_size
+
+def image_info(info, index):
+    """Return the API info (dict) of one image of a batch, as a JSON string."""
+    single = dict(info)
+    for key in ("all_prompts", "all_negative_prompts", "all_seeds", "all_subseeds", "infotexts"):
+        values = info.get(key)
+        if isinstance(values, list) and index < len(values):
+            single[key] = [values[index]]
+    if single.get("all_seeds"):
+        single["seed"] = single["all_seeds"][0]
+    if single.get("all_subseeds"):
+        single["subseed"] = single["all_subseeds"][0]
+    single["index_of_first_image"] = 0
+    return json.dumps(single)
+
+def generate_batch(args_list, skip_setup=False, client=None):
+    """
+    Generate the images of several compatible tasks (see task_dispatch.can_join_batch) with one txt2img request
+    and save each image, with its own metadata, in the output directory of its task.
+    Raises on any error; the images of a failed batch are discarded, none of them is published.
+    """
+    first = args_list[0]
+    profile = model_profiles.get_profile(first.script)
+    if skip_setup or first.skip_setup:
+        print("Skipping model setup (model already loaded).")
+    else:
+        with task_timing.phase("setup"):
+            image_engine.setup_model(profile, client)
+    client = client or webui_client.get_client()
+
+    count = len(args_list)
+    batch_size, n_iter = split_batch(count)
+    model_profiles.check_required_files(profile)
+    payload = profile.build_payload(first.prompt, first.negative, first.seed, first.width, first.height, first.steps,
+                                    first.cfg)
+    payload["batch_size"] = batch_size
+    payload["n_iter"] = n_iter
+    # Do not return the grid image, so the images map one-to-one onto the tasks
+    payload.setdefault("override_settings", {})["return_grid"] = False
+    print(f"\nGenerating {count} images in one request (batch_size={batch_size}, n_iter={n_iter})...")
+    print(f"Payload: {json.dumps(payload, indent=2)}")
+
+    with task_timing.phase("generate"):
+        response = client.post("/sdapi/v1/txt2img", json=payload, retry_unavailable=True, stream=True)
+        response.raise_for_status()
+    writer = image_io.get_writer()
+    on_image, submit_images = image_engine.postprocess_hook()
+    with task_timing.phase("decode"):
+        result, saved = image_io.save_txt2img_response(
+            response, lambda index: image_io.reserve_path(
+                resolve_output_dir(args_list[index]),
+                image_engine.image_stem(profile, args_list[index].seed, index + 1)) if index < count else None,
+            publish=False, on_image=on_image)
+    filepaths = [path for _, path in saved]
+    meta_filepaths = []
+
+    def remove_metadata():
+        for meta_filepath in meta_filepaths:
+            try:
+                os.remove(meta_filepath)
+            except OSError:
+                pass
+
+    try:
+        if len(result.get("images") or []) != count:
+            raise RuntimeError(f"Expected {count} images, got {len(result.get('images') or [])}")
+        info = result.get("info")
+        if isinstance(info, str):
+            info = json.loads(info)
+        info = info or {}
+        seeds = info.get("all_seeds") or [first.seed + i if first.seed != -1 else -1 for i in range(count)]
+        for index, (args, filepath) in enumerate(zip(args_list, filepaths)):
+            print(f"Image saved to disk: {filepath} (seed {seeds[index]})")
+            meta_filepath = image_engine.save_metadata(profile, filepath, args.prompt, args.negative, seeds[index],
+                                                       args.width, args.height, args.steps, image_info(info, index),
+                                                       args.cfg)
+            meta_filepaths.append(meta_filepath)
+            print(f"Metadata saved to: {meta_filepath}")
+    except BaseException:
+        # Publish nothing of a failed batch: drop its staged images and the metadata written so far
+        writer.discard_staged(filepaths)
+        writer.when_written(remove_metadata)
+        raise
+    # Rename the images into place once their metadata is embedded, then derive copies of them
+    writer.publish(filepaths)
+    submit_images(filepaths)
+    for index, (args, filepath) in enumerate(zip(args_list, filepaths)):
+        single_info = image_info(info, index)
+        # Cache each image under the payload that would generate it on its own
+        single_payload = profile.build_payload(args.prompt, args.negative, seeds[index], args.width, args.height,
+                                               args.steps, args.cfg)
+        cache_result(single_payload, profile.checkpoint_title, filepath, single_info)
+
+def run_task_in_process(task, skip_setup=False, client=None):
+    """
+    Parse and run one queue line in this process, capturing its output.
+    Returns (success, stdout_text, stderr_text).
+    """
+    return task_output.run_captured(lambda: generate_from_args(run_image_generation.parse_task(task), skip_setup, client))
+
+def run_batch_in_process(tasks, skip_setup=False, client=None):
+    """
+    Run several compatible queue lines as one batched request in this process, capturing its output.
+    Returns (success, stdout_text, stderr_text) for the whole batch.
+    """
+    return task_output.run_captured(lambda: generate_batch([run_image_generation.parse_task(task) for task in tasks],
+                                                           skip_setup, client))
+
+def run_task_subprocess(task, skip_setup=False, client=None):
+    """
+    Run one queue line through `python run_image_generation.py` in a subprocess (the previous behaviour).
+    Returns (success, stdout_text, stderr_text).
+    """
+    command = f"python run_image_generation.py {task}"
+    if skip_setup:
+        command += " --skip-setup"
+    env = dict(os.environ)
+    if client is not None:
+        env["WEBUI_URL"] = client.base_url
+    # The model script reports its phase timings (including process startup) through this file
+    timing_file = os.path.join(tempfile.gettempdir(), f"task_timing_{os.getpid()}_{threading.get_ident()}.json")
+    task_timing.subprocess_env(env, timing_file)
+    result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=BASE_DIR, env=env)
+    task_timing.merge_subprocess_phases(timing_file)
+    return result.returncode == 0, result.stdout, result.stderr
+
+def setup_run(in_process, backends, result_cache_dir, result_cache_max_bytes, transforms=None,
+              postprocess_workers=None):
+    """
+    Set up the result cache and the post-processing stage (transforms, see postprocess.py; in-process
+    only) for a run and return the clients of its backends.
+    """
+    global cache
+    cache = result_cache.ResultCache(result_cache_dir, result_cache_max_bytes) if result_cache_dir and in_process else None
+    if image_engine.postprocessor is not None:
+        image_engine.postprocessor.close()
+    image_engine.postprocessor = (postprocess.PostProcessor(transforms, postprocess_workers)
+                                  if transforms and in_process else None)
+    return [webui_client.WebUIClient(url) for url in dict.fromkeys(backends)] if backends else [webui_client.get_client()]
+
+def wait_for_postprocessing():
+    """Wait until the post-processing stage (if any) has processed every image submitted so far."""
+    if image_engine.postprocessor is not None:
+        image_engine.postprocessor.wait()
+
+def close_postprocessing():
+    """Wait for the post-processing stage (if any) and stop its worker processes."""
+    if image_engine.postprocessor is not None:
+        image_engine.postprocessor.close()
+        image_engine.postprocessor = None
+
+def make_workers(clients, dispatcher, in_process, log_dir, on_done):
+    """
+    Return a worker thread (not started) per client, taking its tasks from the dispatcher and running
+    them in this process (batched and served from the result cache when possible) or in subprocesses.
+    """
+    if not in_process:
+        return [task_dispatch.BackendWorker(client, dispatcher, run_task_subprocess, log_dir, on_done)
+                for client in clients]
+    restore = restore_from_cache if cache is not None else None
+    return [task_dispatch.BackendWorker(client, dispatcher, run_task_in_process, log_dir, on_done, run_batch_in_process,
+                                        restore) for client in clients]
+
+def run_workers(tasks, clients, in_process, max_batch, log_dir, on_done, order="priority", capable=None,
+                enqueued=None, on_interrupt=None):
+    """
+    Run tasks with one worker per backend (dispatched with model affinity and to the backends that
+    can run them, durations estimated from the timings in log_dir) and wait until their files are written.
+    enqueued lists the times the tasks were queued, for priority aging (default: now). If the wait
+    is interrupted (Ctrl+C), no further task is started and on_interrupt(positions) is called with
+    the positions of the tasks that never started before the exception is raised again.
+    """
+    costs = task_cost.CostModel.from_file(os.path.join(log_dir, task_timing.TIMINGS_FILE))
+    dispatcher = task_dispatch.TaskDispatcher(tasks, max_batch if in_process else 1, enqueued, costs=costs, order=order,
+                                              capable=capable)
+    workers = make_workers(clients, dispatcher, in_process, log_dir, on_done)
+    if tasks:
+        seconds = dispatcher.remaining_seconds()
+        task_output.report(f"{len(tasks)} task(s), estimated {task_cost.format_duration(seconds * len(workers))} of GPU time "
+                f"on {len(workers)} backend(s); ETA {task_cost.format_eta(seconds)}")
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    except BaseException:
+        left = dispatcher.close()
+        if on_interrupt is not None:
+            on_interrupt([position for position, _ in left])
+        raise
+    # Wait until the files of the last tasks are written (write errors were already reported per task)
+    try:
+        image_io.get_writer().flush()
+    except OSError:
+        pass
+    wait_for_postprocessing()
+
+def run_queue(queue_file, done_file, in_process=True, backends=None, max_batch=MAX_BATCH_TASKS, result_cache_dir=None,
+              result_cache_max_bytes=result_cache.DEFAULT_MAX_BYTES, check=True, postprocess=None,
+              postprocess_workers=None, order="priority"):
+    """
+    Run every task of a queue file, grouped by model.
+    Successful tasks are appended to the done file as they finish; failed tasks are written
+    back to the queue file in their original order, or the queue file is removed when all succeed.
+    Args:
+        queue_file (str): Path to the queue file (tasks to run).
+        done_file (str): Path to the done file (completed tasks).
+        in_process (bool): Run tasks in this process (default) or via run_image_generation.py subprocesses.
+        backends (list): WebUI base URLs to spread the tasks over (default: the WEBUI_URL server).
+        max_batch (int): Maximum number of compatible tasks merged into one request (1 disables batching;
+            batching is only done in-process).
+        result_cache_dir (str): Directory of the result cache, or None to disable it (in-process only).
+        result_cache_max_bytes (int): Size limit of the result cache.
+        check (bool): Check all tasks with preflight.preflight() first; tasks no backend can run are not run and
+            stay in the queue, the others only run on the backends that can run them.
+        postprocess (list): Post-processing transforms run on every image (see postprocess.py; in-process only).
+        postprocess_workers (int): Post-processing worker processes (default: all cores but one).
+        order (str): Order of the tasks of a model and priority level: "priority" (queue order) or
+            "sjf" (shortest estimated duration first, see task_cost.py).
+    Returns:
+        list: Tasks left in the queue.
+    """
+    # Exit if the queue file does not exist
+    if not os.path.exists(queue_file):
+        print(f"No queue file found: {queue_file}")
+        return []
+
+    lines = read_queue_lines(queue_file)
+    tasks = [task for _, line_tasks in lines for task in line_tasks]
+    if not tasks:
+        print("No tasks to process.")
+        return []
+
+    # Create a directory for per-task logs
+    log_dir = os.path.join(os.path.dirname(done_file), "task_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    clients = setup_run(in_process, backends, result_cache_dir, result_cache_max_bytes, postprocess, postprocess_workers)
+    capable = {}
+    rejected = preflight.preflight(tasks, clients, capable=capable) if check else {}
+    preflight.report_rejected(tasks, rejected)
+    positions = [position for position in range(len(tasks)) if position not in rejected]
+
+    done_positions = set()  # Tasks that did not succeed (or never ran) are kept in the queue for the next run
+    done_lock = threading.Lock()
+
+    def on_done(index, task, success):
+        if not success:
+            return
+        with done_lock:
+            # Append the successful task to the done file
+            with open(done_file, 'a', encoding='utf-8') as df:
+                df.write(task + '\n')
+            done_positions.add(positions[index])
+
+    try:
+        run_workers([tasks[position] for position in positions], clients, in_process, max_batch, log_dir, on_done,
+                    order, capable)
+    finally:
+        close_postprocessing()
+
+    # Keep failed tasks in their original queue order. A sweep line none of whose tasks succeeded goes
+    # back as written; once some succeeded, only its other tasks are written back (one line each),
+    # as a sweep line cannot name a subset of its combinations
+    remaining_tasks = []
+    position = 0
+    for line, line_tasks in lines:
+        left = [task for offset, task in enumerate(line_tasks) if position + offset not in done_positions]
+        remaining_tasks += [line] if len(left) == len(line_tasks) else left
+        position += len(line_tasks)
+
+    # Rewrite the queue file with any failed tasks for the next run
+    if remaining_tasks:
+        with open(queue_file, 'w', encoding='utf-8') as f:
+            for t in remaining_tasks:
+                f.write(t + '\n')
+        print(f"{len(remaining_tasks)} task(s) left in queue for next run.")
+    else:
+        # If all tasks succeeded, remove the queue file
+        os.remove(queue_file)
+        print("All tasks completed and queue file removed.")
+    return remaining_tasks
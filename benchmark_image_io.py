@@ -0,0 +1,107 @@
+# benchmark_image_io.py
+#
+# Memory/latency benchmark of txt2img response handling against a local stub server process
+# returning large payloads (noise PNGs, which do not compress).
+# Compares the previous approach (response.json(), base64 decode of the whole string, write on
+# the calling thread) with image_io's streaming decode and background writer.
+#
+# Usage:
+#   python benchmark_image_io.py [--width 2048 --height 2048 --batch-size 2 --runs 5]
+
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import image_io
+import webui_client
+
+def start_stub_server(extra_args=()):
+    """
+    Start stub_forge_server.py in its own process (so its memory is not measured); return (process, url).
+    extra_args are passed to the stub (e.g. ["--latency", "0.1"]).
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_forge_server.py")
+    process = subprocess.Popen([sys.executable, script, "--port", str(port), *extra_args], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Stub server did not start")
+
+def handle_buffered(client, payload, output_dir, run):
+    """Previous approach: whole JSON body, whole base64 strings and decoded bytes in memory."""
+    response = client.post("/sdapi/v1/txt2img", json=payload)
+    response.raise_for_status()
+    result = response.json()
+    for index, image in enumerate(result["images"]):
+        with open(os.path.join(output_dir, f"buffered_{run}_{index}.png"), "wb") as f:
+            f.write(base64.b64decode(image))
+    return None
+
+def handle_streaming(client, payload, output_dir, run):
+    """image_io approach: incremental decode, writes on the background writer thread."""
+    response = client.post("/sdapi/v1/txt2img", json=payload, stream=True)
+    response.raise_for_status()
+    image_io.save_txt2img_response(response, lambda index: os.path.join(output_dir, f"streaming_{run}_{index}.png"))
+    return image_io.get_writer()
+
+def measure(name, handler, client, payload, runs, output_dir):
+    """Run a handler several times and print its latency and peak traced memory."""
+    handler(client, payload, output_dir, "warmup")
+    image_io.get_writer().flush()
+
+    returned, completed = [], []
+    for run in range(runs):
+        start = time.perf_counter()
+        writer = handler(client, payload, output_dir, run)
+        returned.append(time.perf_counter() - start)
+        if writer:
+            writer.flush()
+        completed.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    writer = handler(client, payload, output_dir, "memory")
+    if writer:
+        writer.flush()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<10} returns to caller: {sum(returned) / runs * 1000:8.1f} ms   "
+          f"files written: {sum(completed) / runs * 1000:8.1f} ms   peak memory: {peak / 2 ** 20:7.1f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark buffered vs. streaming txt2img response handling.")
+    parser.add_argument('--width', type=int, default=2048, help="Image width (default: 2048)")
+    parser.add_argument('--height', type=int, default=2048, help="Image height (default: 2048)")
+    parser.add_argument('--batch-size', type=int, default=2, help="Images per response (default: 2)")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per approach (default: 5)")
+    args = parser.parse_args()
+
+    payload = {"prompt": "benchmark", "seed": 1, "width": args.width, "height": args.height,
+               "batch_size": args.batch_size}
+    process, url = start_stub_server()
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            client = webui_client.WebUIClient(url)
+            size = args.batch_size * args.width * args.height * 3
+            print(f"Response: {args.batch_size} x {args.width}x{args.height} noise PNG "
+                  f"(about {size / 2 ** 20:.1f} MiB of images, {size * 4 / 3 / 2 ** 20:.1f} MiB of base64)")
+            measure("buffered", handle_buffered, client, payload, args.runs, output_dir)
+            measure("streaming", handle_streaming, client, payload, args.runs, output_dir)
+            client.close()
+    finally:
+        process.terminate()
+        process.wait()
@@ -0,0 +1,174 @@
+# benchmark_suite.py
+#
+# End-to-end benchmark of the client side of this project, against stub_forge_server.py
+# (no GPU needed). Each scenario starts a fresh stub server process with the configured
+# generation latency, model-switch cost and image size, then drives image_task_batch_runner.py
+# or the model scripts' generate_image() through a representative queue in a child process.
+# Reports wall time, throughput, per-image overhead beyond the simulated generation time and
+# the child's peak RSS, so regressions in queueing, batching or I/O show up as numbers.
+#
+# Scenarios:
+#   runner-mixed       tasks for three models in round-robin order (model grouping, switches)
+#   runner-batchable   one prompt with consecutive seeds (batched requests)
+#   runner-no-batch    the same queue with --max-batch 1
+#   runner-subprocess  the mixed queue with one process per task (--subprocess)
+#   generate-image     flux.generate_image() called in a loop in one process
+#
+# Usage:
+#   python benchmark_suite.py [--tasks 24 --latency 0.05 --switch-latency 0.5 --image-size 1024x1024]
+#   python benchmark_suite.py --scenario runner-mixed --json results.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_image_io import start_stub_server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Model files the model scripts check for (created empty in a temporary MODELS_DIR)
+FAKE_MODEL_FILES = [
+    os.path.join("Stable-diffusion", "flux1-schnell-bnb-nf4.safetensors"),
+    os.path.join("Stable-diffusion", "juggernautXL_v8Rundiffusion.safetensors"),
+    os.path.join("VAE", "ae.safetensors"),
+    os.path.join("text_encoder", "clip_l.safetensors"),
+    os.path.join("text_encoder", "t5xxl_fp16.safetensors"),
+]
+
+def make_models_dir(root):
+    """Create a MODELS_DIR with empty model files and return its path."""
+    models_dir = os.path.join(root, "models")
+    for name in FAKE_MODEL_FILES:
+        path = os.path.join(models_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+    return models_dir
+
+def make_queue(kind, count, output_dir, size):
+    """Return queue lines: 'mixed' (three models, round-robin) or 'batchable' (consecutive seeds)."""
+    width, height = size
+    # One output directory per task, so images saved within the same second do not share a name
+    common = [f'--width {width} --height {height} --steps 20 --output "{os.path.join(output_dir, str(i))}"'
+              for i in range(count)]
+    if kind == "batchable":
+        return [f'flux --prompt "benchmark batch" --seed {1000 + i} {common[i]}' for i in range(count)]
+    models = ["flux", "jugger", "realistic"]
+    return [f'{models[i % len(models)]} --prompt "benchmark task {i}" {common[i]}' for i in range(count)]
+
+def run_child(command, env):
+    """Run a command and return (seconds, peak RSS in MiB or None where unavailable, return code)."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        # wait4 reports the resource usage of this child only (ru_maxrss is in KiB on Linux)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+        rss = usage.ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+        stderr = process.stderr.read()
+        process.stderr.close()
+    else:
+        _, stderr = process.communicate()
+        rss = None
+    if process.returncode != 0:
+        print(stderr.decode("utf-8", "replace")[-2000:], file=sys.stderr)
+    return time.perf_counter() - start, rss, process.returncode
+
+def count_images(output_dir):
+    """Count the PNG files below a directory."""
+    return sum(1 for _, _, names in os.walk(output_dir) for name in names if name.endswith(".png"))
+
+def scenario_command(name, work_dir, args):
+    """Return the child command of a scenario (writing a queue file for the runner scenarios)."""
+    output_dir = os.path.join(work_dir, "out")
+    if name == "generate-image":
+        return [sys.executable, os.path.abspath(__file__), "--child-generate", str(args.tasks),
+                "--image-size", f"{args.size[0]}x{args.size[1]}", "--output", output_dir]
+    kind = "batchable" if name in ("runner-batchable", "runner-no-batch") else "mixed"
+    queue_file = os.path.join(work_dir, "queue.txt")
+    with open(queue_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(make_queue(kind, args.tasks, output_dir, args.size)) + "\n")
+    command = [sys.executable, os.path.join(BASE_DIR, "image_task_batch_runner.py"), "--queue", queue_file,
+               "--done", os.path.join(work_dir, "done.txt"), "--no-cache"]
+    if name == "runner-no-batch":
+        command += ["--max-batch", "1"]
+    elif name == "runner-subprocess":
+        command += ["--subprocess"]
+    return command
+
+SCENARIOS = ["runner-mixed", "runner-batchable", "runner-no-batch", "runner-subprocess", "generate-image"]
+
+def run_scenario(name, args):
+    """Run one scenario against a fresh stub server and return its result dict."""
+    stub_args = ["--latency", str(args.latency), "--switch-latency", str(args.switch_latency)]
+    if args.stub_image_size:
+        stub_args += ["--image-size", args.stub_image_size]
+    process, url = start_stub_server(stub_args)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            env = dict(os.environ, WEBUI_URL=url, MODELS_DIR=make_models_dir(work_dir))
+            seconds, rss, code = run_child(scenario_command(name, work_dir, args), env)
+            images = count_images(os.path.join(work_dir, "out"))
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "scenario": name,
+        "images": images,
+        "seconds": round(seconds, 3),
+        "images_per_hour": round(images * 3600 / seconds, 1) if seconds else 0.0,
+        # Wall time per image beyond the stub's simulated generation time (includes model switches)
+        "overhead_ms": round((seconds / images - args.latency) * 1000, 1) if images else None,
+        "peak_rss_mib": round(rss, 1) if rss is not None else None,
+        "ok": code == 0 and images == args.tasks,
+    }
+
+def child_generate(count, size, output_dir):
+    """Child process of the generate-image scenario: set up Flux once and generate count images."""
+    import flux
+    import image_io
+    flux.setup_flux_model()
+    for i in range(count):
+        flux.generate_image(f"benchmark image {i}", -1, size[0], size[1], os.path.join(output_dir, str(i)), 20)
+    image_io.get_writer().flush()
+
+def print_results(results):
+    print(f"{'scenario':<18} {'images':>6} {'seconds':>8} {'images/h':>10} {'overhead ms/img':>16} {'peak RSS MiB':>13}  ok")
+    for r in results:
+        rss = f"{r['peak_rss_mib']:.1f}" if r["peak_rss_mib"] is not None else "n/a"
+        overhead = f"{r['overhead_ms']:.1f}" if r["overhead_ms"] is not None else "n/a"
+        print(f"{r['scenario']:<18} {r['images']:>6} {r['seconds']:>8.2f} {r['images_per_hour']:>10.0f} "
+              f"{overhead:>16} {rss:>13}  {'yes' if r['ok'] else 'NO'}")
+
+def parse_size(text):
+    width, height = (int(value) for value in text.lower().split("x"))
+    return width, height
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the batch runner and generate_image() against a stub Forge server.")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Scenario to run; repeatable (default: all)")
+    parser.add_argument('--tasks', type=int, default=24, help="Tasks (images) per scenario (default: 24)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Stub seconds per image (default: 0.05)")
+    parser.add_argument('--switch-latency', type=float, default=0.5, help="Stub seconds per model switch (default: 0.5)")
+    parser.add_argument('--image-size', default="512x512", help="Requested image size WIDTHxHEIGHT (default: 512x512)")
+    parser.add_argument('--stub-image-size', help="Size of the images the stub returns, to control the payload size (default: as requested)")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    parser.add_argument('--child-generate', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.size = parse_size(args.image_size)
+
+    if args.child_generate is not None:
+        child_generate(args.child_generate, args.size, args.output)
+        sys.exit(0)
+
+    results = [run_scenario(name, args) for name in (args.scenario or SCENARIOS)]
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": {"tasks": args.tasks, "latency": args.latency, "switch_latency": args.switch_latency,
+                                    "image_size": args.image_size, "stub_image_size": args.stub_image_size},
+                       "results": results}, f, indent=2)
@@ -1,15 +1,17 @@
-import requests
 import json
+import webui_client
+import webui_ready
 import time
 from datetime import datetime
 
 # === CONFIG ===
-url = "http://127.0.0.1:7860"
+# The WebUI base URL comes from WEBUI_URL (default http://127.0.0.1:7860)
+client = webui_client.get_client()
 
 def get_current_options():
     """Get all current WebUI options"""
     try:
-        response = requests.get(f"{url}/sdapi/v1/options")
+        response = client.get("/sdapi/v1/options")
         response.raise_for_status()
         options = response.json()
         return options
@@ -20,7 +22,7 @@ def get_current_options():
 def get_txt2img_default_params():
     """Get the default parameters for txt2img"""
     try:
-        response = requests.get(f"{url}/sdapi/v1/txt2img")
+        response = client.get("/sdapi/v1/txt2img")
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -29,14 +31,7 @@ def get_txt2img_default_params():
 
 def monitor_progress():
     """Monitor progress of current generation"""
-    try:
-        response = requests.get(f"{url}/sdapi/v1/progress")
-        response.raise_for_status()
-        progress = response.json()
-        return progress
-    except Exception as e:
-        print(f"Error getting progress: {str(e)}")
-        return {}
+    return webui_ready.monitor_progress(client)
 
 def save_config_to_file(config, filename):
     """Save configuration to a JSON file"""
@@ -0,0 +1,221 @@
+# draft_refine.py
+#
+# Draft-then-refine runs: instead of rendering every queued prompt at full quality (or sweeping
+# 10/25/50/100 steps to find out which prompts are worth it), every task is first rendered as a
+# cheap draft, with few steps and at a reduced size, and only the approved drafts are rendered
+# again at full quality, with the exact seed the draft was generated with (taken from the API
+# info embedded in the draft image, so random-seed tasks are reproduced too).
+#
+# Drafts go to a grid of directories below the draft directory (row-NNN/col-N, DRAFT_COLUMNS
+# drafts per row) with an index.html contact sheet (see sweep.py), and drafts.jsonl lists each
+# draft's number, task, image and seed. Drafts are approved with a list file (one draft per line:
+# its number, its cell or image path as linked from the contact sheet, e.g. row-000/col-3, or an
+# image path or file name) and/or a scoring hook: a function
+# score(image_path, entry) -> number in an importable module; drafts scoring at least the minimum
+# score are approved.
+# Note that at a reduced size the same seed gives a different composition; drafts at full size
+# (scale 1, fewer steps only) preview the final image much more closely.
+#
+# Usage (see image_task_batch_runner.py --draft / --refine):
+#   python image_task_batch_runner.py --queue image_tasks_new.txt --draft drafts/new
+#   python image_task_batch_runner.py --refine drafts/new --approve approved.txt --done image_tasks_done.txt
+#
+#   import draft_refine
+#   entries = draft_refine.run_drafts("image_tasks_new.txt", "drafts/new")
+#   draft_refine.run_refine("drafts/new", "image_tasks_done.txt", approve_file="approved.txt")
+
+import glob
+import importlib
+import json
+import os
+import shlex
+
+import batch_engine
+import output_index
+import run_image_generation
+import sweep
+
+# Default draft quality: at most this many steps, and this fraction of the width and height
+DRAFT_STEPS = 8
+DRAFT_SCALE = 0.5
+
+# Drafts are at least this large, in multiples of this many pixels
+DRAFT_MIN_SIZE = 256
+SIZE_MULTIPLE = 64
+
+# Drafts per row of the contact sheet
+DRAFT_COLUMNS = 8
+
+# Default minimum score of a draft approved by a scoring hook
+DEFAULT_MIN_SCORE = 0.5
+
+# Files in the draft directory
+MANIFEST = "drafts.jsonl"
+DRAFT_QUEUE = "draft_queue.txt"
+DRAFT_DONE = "draft_done.txt"
+REFINE_QUEUE = "refine_queue.txt"
+
+def _set_option(argv, option, value):
+    """Set an option of an argument list (replacing its last occurrence, or appending it)."""
+    argv = list(argv)
+    if option in argv[:-1]:
+        argv[len(argv) - 1 - argv[::-1].index(option) + 1] = str(value)
+    else:
+        argv += [option, str(value)]
+    return argv
+
+def _drop_option(argv, option):
+    """Remove every occurrence of an option and its value from an argument list."""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        else:
+            result.append(arg)
+    return result
+
+def _line(argv):
+    return " ".join(sweep.quote(arg) for arg in argv)
+
+def draft_size(size, scale=DRAFT_SCALE):
+    """Return a width or height scaled for a draft (rounded to SIZE_MULTIPLE, at least DRAFT_MIN_SIZE)."""
+    if scale >= 1:
+        return size
+    return min(size, max(DRAFT_MIN_SIZE, int(round(size * scale / SIZE_MULTIPLE)) * SIZE_MULTIPLE))
+
+def draft_dir(root, number):
+    """Return the output directory of draft number `number` (a cell of the contact sheet grid)."""
+    return os.path.join(root, f"row-{number // DRAFT_COLUMNS:03d}", f"col-{number % DRAFT_COLUMNS}")
+
+def draft_task(task, output, root, steps=DRAFT_STEPS, scale=DRAFT_SCALE):
+    """
+    Return the draft of a queue line (without sweep values): the same task with at most `steps`
+    steps, its size scaled by `scale`, written to `output` as part of the contact sheet of `root`.
+    Raises ValueError if the line is not valid.
+    """
+    args = run_image_generation.parse_task(task)
+    argv = _drop_option(shlex.split(task), "--sweep-root")
+    argv = _set_option(argv, "--steps", min(args.steps, steps))
+    argv = _set_option(argv, "--width", draft_size(args.width, scale))
+    argv = _set_option(argv, "--height", draft_size(args.height, scale))
+    argv = _set_option(argv, "--output", output)
+    return _line(argv + ["--sweep-root", root])
+
+def refined_task(task, seed):
+    """Return the full-quality task of a draft: the original queue line with the draft's seed."""
+    return _line(_set_option(shlex.split(task), "--seed", seed))
+
+def draft_image(directory):
+    """Return the newest image in a draft's directory, or None."""
+    images = glob.glob(os.path.join(glob.escape(directory), "*.png"))
+    return max(images, key=os.path.getmtime) if images else None
+
+def read_manifest(root):
+    """Return the entries of a draft directory's manifest (dicts: number, task, draft, image, seed)."""
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        raise ValueError(f"No drafts in {root} (missing {MANIFEST})")
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _write_manifest(root, entries):
+    path = os.path.join(root, MANIFEST)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(tmp_path, path)
+
+def run_drafts(queue_file, root, steps=DRAFT_STEPS, scale=DRAFT_SCALE, **options):
+    """
+    Render a draft of every task of a queue file (sweep lines expanded) into the draft directory
+    root and write its manifest; the queue file is not changed. Drafts already rendered by an
+    earlier call with the same root are kept. Other keyword arguments are passed to
+    batch_engine.run_queue (backends, result cache, ...).
+    Returns:
+        list: The manifest entries (drafts that failed have no image).
+    """
+    root = os.path.abspath(root)
+    tasks = batch_engine.read_queue(queue_file)
+    entries = []
+    for number, task in enumerate(tasks):
+        output = draft_dir(root, number)
+        try:
+            draft = draft_task(task, output, root, steps, scale)
+        except ValueError as e:
+            print(f"Skipping invalid task: {e}")
+            continue
+        entries.append({"number": number, "task": task, "draft": draft, "image": draft_image(output), "seed": None})
+    os.makedirs(root, exist_ok=True)
+    pending = [entry["draft"] for entry in entries if entry["image"] is None]
+    if pending:
+        draft_queue = os.path.join(root, DRAFT_QUEUE)
+        with open(draft_queue, "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in pending))
+        print(f"Rendering {len(pending)} draft(s) in {root}")
+        batch_engine.run_queue(draft_queue, os.path.join(root, DRAFT_DONE), **options)
+    for entry in entries:
+        entry["image"] = draft_image(draft_dir(root, entry["number"]))
+        if entry["image"]:
+            entry["seed"] = output_index.read_metadata(entry["image"])[1].get("seed")
+    _write_manifest(root, entries)
+    rendered = sum(1 for entry in entries if entry["image"])
+    print(f"{rendered} of {len(entries)} draft(s) rendered; contact sheet: {os.path.join(root, sweep.CONTACT_SHEET)}")
+    return entries
+
+def load_approvals(path):
+    """Read an approval list: one draft per line (see the top of this file; # comments)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return {os.path.normpath(line.strip()) for line in f if line.strip() and not line.strip().startswith("#")}
+
+def load_hook(spec):
+    """Return the scoring function of a MODULE:FUNCTION spec; raises ValueError."""
+    module_name, _, function_name = spec.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"Scoring hook must be MODULE:FUNCTION: {spec}")
+    try:
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load scoring hook {spec}: {e}")
+
+def approved_entries(entries, root, approve_file=None, score=None, min_score=DEFAULT_MIN_SCORE):
+    """
+    Return the rendered drafts of the draft directory root approved by the list file and/or the
+    scoring hook (a function score(image_path, entry) or a MODULE:FUNCTION spec).
+    """
+    approvals = load_approvals(approve_file) if approve_file else set()
+    if isinstance(score, str):
+        score = load_hook(score)
+    approved = []
+    for entry in entries:
+        image = entry.get("image")
+        if not image or entry.get("seed") is None:
+            continue
+        relative = os.path.relpath(image, root)
+        names = {str(entry["number"]), os.path.dirname(relative), relative, os.path.basename(image), image}
+        if approvals & names:
+            approved.append(entry)
+        elif score is not None and score(image, entry) >= min_score:
+            approved.append(entry)
+    return approved
+
+def run_refine(root, done_file, approve_file=None, score=None, min_score=DEFAULT_MIN_SCORE, **options):
+    """
+    Render the approved drafts of a draft directory at full quality with their drafts' seeds (see
+    approved_entries). The refined tasks are written to the draft directory's refine queue and run
+    with batch_engine.run_queue (other keyword arguments are passed to it); successful tasks go
+    to done_file. Returns the refined tasks left in the queue (failed).
+    """
+    root = os.path.abspath(root)
+    approved = approved_entries(read_manifest(root), root, approve_file, score, min_score)
+    if not approved:
+        print("No drafts approved.")
+        return []
+    refine_queue = os.path.join(root, REFINE_QUEUE)
+    with open(refine_queue, "w", encoding="utf-8") as f:
+        f.write("".join(refined_task(entry["task"], entry["seed"]) + "\n" for entry in approved))
+    print(f"Refining {len(approved)} approved draft(s)")
+    return batch_engine.run_queue(refine_queue, done_file, **options)
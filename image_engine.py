@@ -0,0 +1,233 @@
+# image_engine.py
+#
+# Generation engine shared by all model profiles (see model_profiles.py): model setup through
+# /sdapi/v1/options, txt2img generation with the image streamed to disk, and the metadata file
+# saved alongside each image (a _meta.txt file, plus a structured record embedded in the PNG that
+# output_index.py indexes). flux.py, jugger.py and realistic_photo.py are thin wrappers around
+# it, and run_image_generation.py / the batch engine call it directly.
+# When a post-processing stage is set (see postprocess.py), every saved image is also handed to
+# it from memory, for web-sized copies and thumbnails encoded on a process pool.
+#
+# Usage:
+#   import image_engine, model_profiles
+#   profile = model_profiles.get_profile("jugger")
+#   image_engine.setup_model(profile)
+#   payload, filepath, info = image_engine.generate_image(profile, "a cat", "blurry", 42, 1024, 1024, "output_images")
+
+import io
+import json
+import os
+from datetime import datetime
+
+import image_io
+import model_profiles
+import task_timing
+import webui_client
+import webui_ready
+
+# Post-processing stage (postprocess.PostProcessor) fed with every generated image, or None
+postprocessor = None
+
+def postprocess_hook():
+    """
+    Return (on_image, submit) for the post-processing stage: on_image is the
+    image_io.save_txt2img_response callback keeping the decoded images, and submit(paths) hands the
+    kept images of the given paths to the stage. Call submit only once the images are published, so
+    images that are discarded never get derived copies. on_image is None without a stage.
+    """
+    if postprocessor is None:
+        return None, lambda paths: None
+    images = {}
+
+    def submit(paths):
+        for path in paths:
+            if path in images:
+                postprocessor.submit(path, images.pop(path))
+
+    return images.__setitem__, submit
+
+def setup_model(profile, client=None):
+    """
+    Configure the Forge WebUI to use the profile's model and components.
+    Sends a POST request to the /sdapi/v1/options endpoint (skipped if the model is already
+    loaded) and waits until the server reports the model as loaded.
+    Args:
+        profile (model_profiles.ModelProfile): Model to load.
+        client (webui_client.WebUIClient): Server to configure (default: the shared client).
+    """
+    model_profiles.check_required_files(profile)
+    print(f"\nSetting up the {profile.description} model via API...")
+    webui_ready.ensure_model_options(client or webui_client.get_client(), profile.options())
+    print(f"Model set to: {profile.checkpoint_title}")
+
+def format_metadata(profile, prompt, negative_prompt, seed, width, height, steps, info=None, cfg_scale=None):
+    """
+    Return the text of the metadata file saved alongside an image (info: API info/metadata, if any;
+    cfg_scale: the CFG scale if it overrides the profile's).
+    """
+    payload = profile.build_payload(prompt, negative_prompt, seed, width, height, steps, cfg_scale)
+    with io.StringIO() as meta_file:
+        meta_file.write(f"Prompt: {prompt}\n")
+        meta_file.write(f"Negative Prompt: {payload.get('negative_prompt', '')}\n")
+        meta_file.write(f"Seed: {seed}\n")
+        meta_file.write(f"Width: {width}\n")
+        meta_file.write(f"Height: {height}\n")
+        meta_file.write(f"Steps: {steps}\n")
+        if "scheduler" in payload:
+            meta_file.write(f"Scheduler: {payload['scheduler']}\n")
+        meta_file.write(f"Sampler: {payload.get('sampler_name', '')}\n")
+        if cfg_scale is not None:
+            meta_file.write(f"CFG Scale: {cfg_scale}\n")
+        if profile.vae:
+            meta_file.write(f"VAE: {profile.vae_path()}\n")
+        meta_file.write(f"Model: {profile.checkpoint_title}\n")
+        meta_file.write(f"Date: {datetime.now().isoformat()}\n")
+        if info is not None:
+            meta_file.write("\n[API Info/Metadata]\n")
+            try:
+                if isinstance(info, str):
+                    meta_file.write(info + "\n")
+                else:
+                    meta_file.write(str(info) + "\n")
+            except Exception as e:
+                meta_file.write(f"Failed to parse infotext: {str(e)}\n")
+        return meta_file.getvalue()
+
+def metadata_record(profile, prompt, negative_prompt, seed, width, height, steps, info=None, cfg_scale=None):
+    """
+    Return the structured metadata record of an image (a dict, embedded in the PNG as JSON).
+    The seed is taken from the API info when it reports one (the actual seed of a random-seed image).
+    """
+    payload = profile.build_payload(prompt, negative_prompt, seed, width, height, steps, cfg_scale)
+    parsed = info
+    if isinstance(info, str):
+        try:
+            parsed = json.loads(info)
+        except ValueError:
+            parsed = None
+    if isinstance(parsed, dict) and isinstance(parsed.get("seed"), int):
+        seed = parsed["seed"]
+    return {
+        "prompt": prompt,
+        "negative_prompt": payload.get("negative_prompt", ""),
+        "seed": seed,
+        "width": width,
+        "height": height,
+        "steps": steps,
+        "cfg_scale": payload.get("cfg_scale"),
+        "sampler": payload.get("sampler_name", ""),
+        "scheduler": payload.get("scheduler"),
+        "model": profile.checkpoint_title,
+        "profile": profile.name,
+        "vae": profile.vae_path() if profile.vae else None,
+        "date": datetime.now().isoformat(),
+        "info": info if info is None or isinstance(info, str) else json.dumps(info),
+    }
+
+def save_metadata(profile, filepath, prompt, negative_prompt, seed, width, height, steps, info=None, cfg_scale=None,
+                  embed=True):
+    """
+    Queue the metadata of an image queued for writing: the _meta.txt file alongside it and, with
+    embed, the structured record as a PNG text chunk (image_io.METADATA_KEYWORD).
+    Returns the path of the _meta.txt file.
+    """
+    writer = image_io.get_writer()
+    meta_filepath = os.path.splitext(filepath)[0] + "_meta.txt"
+    writer.write_file(meta_filepath, format_metadata(profile, prompt, negative_prompt, seed, width, height, steps,
+                                                     info, cfg_scale))
+    if embed:
+        record = metadata_record(profile, prompt, negative_prompt, seed, width, height, steps, info, cfg_scale)
+        writer.add_png_text(filepath, image_io.METADATA_KEYWORD, json.dumps(record))
+    return meta_filepath
+
+def image_stem(profile, seed=-1, index=None):
+    """
+    Return the file name (without extension) of a new image: the profile's prefix, the date and
+    time, and the seed (fixed seeds) or the image's index in its batch (random seeds).
+    image_io.reserve_path() makes it unique.
+    """
+    stem = datetime.now().strftime(f"{profile.image_prefix}_%Y%m%d_%H%M%S")
+    if seed != -1:
+        return f"{stem}_seed{seed}"
+    return stem if index is None else f"{stem}_{index}"
+
+def generate_image(profile, prompt, negative_prompt=None, seed=-1, width=1024, height=1024, output_dir=".", steps=20,
+                   client=None, cfg_scale=None):
+    """
+    Generate an image with a model profile.
+    Args:
+        profile (model_profiles.ModelProfile): Model to generate with (must be loaded, see setup_model).
+        prompt (str): The text prompt for image generation.
+        negative_prompt (str or None): Negative prompt to avoid certain features.
+        seed (int): Random seed for reproducibility (-1 for random).
+        width (int): Image width.
+        height (int): Image height.
+        output_dir (str): Directory to save the output image.
+        steps (int): Number of inference steps.
+        client (webui_client.WebUIClient): Server to generate on (default: the shared client).
+        cfg_scale (float or None): CFG scale (default: the profile's).
+    Returns:
+        tuple: (payload sent, path of the saved image, API info returned with it)
+    """
+    model_profiles.check_required_files(profile)
+    print("\nGenerating image...")
+    if "scheduler" in profile.payload:
+        print(f"Using Scheduler: {profile.payload['scheduler']} (casing matters!)")
+    payload = profile.build_payload(prompt, negative_prompt, seed, width, height, steps, cfg_scale)
+    print(f"Payload: {json.dumps(payload, indent=2)}")
+    client = client or webui_client.get_client()
+    # Only retried when the server did not start generating: a repeat after a read timeout would
+    # queue a second generation behind the first
+    with task_timing.phase("generate"):
+        response = client.post("/sdapi/v1/txt2img", json=payload, retry_unavailable=True, stream=True)
+        response.raise_for_status()
+    # Decode the base64 image data while it streams in and write it on the background writer
+    on_image, submit_images = postprocess_hook()
+    with task_timing.phase("decode"):
+        result, saved = image_io.save_txt2img_response(
+            response, lambda index: image_io.reserve_path(output_dir, image_stem(profile, seed)) if index == 0 else None,
+            publish=False, on_image=on_image)
+    if not saved:
+        raise RuntimeError("The response contains no image")
+    filepath = saved[0][1]
+    print(f"Image saved to disk: {filepath}")
+    # Save prompt and metadata to a text file alongside the image, and embed them in the image
+    # before it is renamed into place
+    try:
+        meta_filepath = save_metadata(profile, filepath, prompt, negative_prompt, seed, width, height, steps,
+                                      result.get("info"), cfg_scale)
+    finally:
+        image_io.get_writer().publish([filepath])
+    submit_images([filepath])
+    print(f"Metadata saved to: {meta_filepath}")
+    # Display infotext metadata returned from the API
+    if "info" in result:
+        try:
+            info = result["info"]
+            print("\nGeneration Info (raw):")
+            print(info)
+            if isinstance(info, str):
+                metadata = json.loads(info)
+                print("\nParsed Metadata:")
+                for key, value in metadata.items():
+                    print(f"- {key}: {value}")
+            else:
+                print("Info object was not a string.")
+        except Exception as e:
+            print(f"Failed to parse infotext: {str(e)}")
+    return payload, filepath, result.get("info")
+
+def generate_from_args(args, output_dir=None, skip_setup=False, client=None):
+    """
+    Run one generation described by parsed run_image_generation arguments.
+    Returns (profile, payload, filepath, info). Raises on any error.
+    """
+    profile = model_profiles.get_profile(args.script)
+    if skip_setup or args.skip_setup:
+        print("Skipping model setup (model already loaded).")
+    else:
+        with task_timing.phase("setup"):
+            setup_model(profile, client)
+    payload, filepath, info = generate_image(profile, args.prompt, args.negative, args.seed, args.width, args.height,
+                                             output_dir or args.output, args.steps, client, args.cfg)
+    return profile, payload, filepath, info
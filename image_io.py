@@ -0,0 +1,510 @@
+# image_io.py
+#
+# Memory-friendly handling of txt2img responses.
+# The response body is read in chunks and the base64 strings of the "images" array are decoded
+# and written incrementally, so the JSON body, the base64 string and the decoded bytes of a large
+# image are never all held in memory at once. Disk writes are handed to a background writer
+# thread with a bounded queue, so the caller can submit the next request while files are written.
+# Structured metadata is embedded in the saved PNGs as a compressed iTXt chunk (METADATA_KEYWORD),
+# added just before the IEND chunk once the image is written (see add_png_text).
+# Files are written under a temporary name (PART_SUFFIX) and renamed into place once complete,
+# and reserve_path() picks image names that are unique across threads and processes.
+#
+# Usage:
+#   response = client.post("/sdapi/v1/txt2img", json=payload, stream=True)
+#   response.raise_for_status()
+#   result, saved = image_io.save_txt2img_response(response, lambda index: f"image_{index}.png")
+#   image_io.get_writer().flush()  # wait for the files to be written (raises on write errors)
+
+import base64
+import binascii
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+# Size of the chunks read from the HTTP response
+CHUNK_SIZE = 256 * 1024
+
+# Maximum number of pending write operations (bounds the memory used by queued data)
+WRITER_QUEUE_SIZE = 64
+
+# Suffix of the temporary file a file is written to before it is renamed into place
+PART_SUFFIX = ".part"
+
+# Maximum number of completed files flushed to disk (fsync) and renamed together
+FSYNC_BATCH = 16
+
+# Keyword of the iTXt chunk holding the JSON metadata record of an image
+METADATA_KEYWORD = "generation-metadata"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_IEND_CHUNK = struct.pack(">I", 0) + b"IEND" + struct.pack(">I", zlib.crc32(b"IEND"))
+
+class Txt2ImgStreamDecoder:
+    """
+    Incremental decoder for a txt2img JSON response.
+    Feed it the raw body in chunks; the base64 strings of the top-level "images" array are
+    decoded on the fly and passed to on_image_start(index), on_image_data(index, bytes) and
+    on_image_end(index). Everything else is kept (with the images replaced by empty strings)
+    and returned as a dict by finish().
+    """
+
+    def __init__(self, on_image_start, on_image_data, on_image_end):
+        self.on_image_start = on_image_start
+        self.on_image_data = on_image_data
+        self.on_image_end = on_image_end
+        self.rest = bytearray()   # The JSON body without the image data
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0     # Position in self.rest where the current string started
+        self.last_string = None   # Last complete string at depth 1 (a candidate key)
+        self.key = None           # Current key at depth 1
+        self.in_images = False    # Inside the top-level "images" array
+        self.in_image = False     # Inside an image string (fast path)
+        self.image_index = -1
+        self.carry = b""          # Base64 characters not yet decoded (not a multiple of 4)
+
+    def feed(self, chunk):
+        """Process the next chunk of the response body."""
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            if self.in_image:
+                pos = self._feed_image(chunk, pos)
+                continue
+            byte = chunk[pos]
+            self.rest.append(byte)
+            pos += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif byte == 0x5c:  # backslash
+                    self.escape = True
+                elif byte == 0x22:  # end of string
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = bytes(self.rest[self.string_start:-1])
+                continue
+            if byte == 0x22:  # start of string
+                if self.in_images and self.depth == 2:
+                    self._start_image()
+                else:
+                    self.in_string = True
+                    self.string_start = len(self.rest)
+            elif byte in (0x7b, 0x5b):  # { [
+                self.depth += 1
+                if byte == 0x5b and self.depth == 2 and self.key == b"images":
+                    self.in_images = True
+            elif byte in (0x7d, 0x5d):  # } ]
+                if self.depth == 2 and self.in_images:
+                    self.in_images = False
+                self.depth -= 1
+            elif byte == 0x3a and self.depth == 1:  # key/value separator
+                self.key = self.last_string
+            elif byte == 0x2c and self.depth == 1:  # next key
+                self.key = None
+
+    def _start_image(self):
+        self.in_image = True
+        self.image_index += 1
+        self.carry = b""
+        self.on_image_start(self.image_index)
+
+    def _feed_image(self, chunk, pos):
+        """Decode image data from chunk[pos:] up to the closing quote; return the new position."""
+        quote = chunk.find(b'"', pos)
+        data = chunk[pos:] if quote == -1 else chunk[pos:quote]
+        # JSON may escape "/" as "\/"; drop the backslashes (a trailing one escapes the next chunk's "/")
+        if b"\\" in data:
+            data = data.replace(b"\\", b"")
+        data = self.carry + data
+        usable = len(data) - len(data) % 4
+        if quote == -1:
+            self.carry = data[usable:]
+            data = data[:usable]
+        else:
+            self.carry = b""
+        if data:
+            try:
+                self.on_image_data(self.image_index, base64.b64decode(data))
+            except binascii.Error as e:
+                raise ValueError(f"Invalid base64 data in image {self.image_index}: {e}")
+        if quote == -1:
+            return len(chunk)
+        # Keep an empty string in place of the image so the rest still parses as JSON
+        self.rest.append(0x22)
+        self.in_image = False
+        self.on_image_end(self.image_index)
+        return quote + 1
+
+    def finish(self):
+        """Return the parsed response without image data (images are replaced by empty strings)."""
+        if self.in_image or self.in_string or self.depth:
+            raise ValueError("Incomplete txt2img response")
+        return json.loads(bytes(self.rest).decode("utf-8"))
+
+class _PendingFile:
+    """
+    A file being written by the background writer, to a temporary path (see part_path) that is
+    renamed to its path once complete; error is set if writing failed.
+    """
+
+    def __init__(self, writer, path, deferred=False):
+        self.writer = writer
+        self.path = path
+        self.temp_path = part_path(path)
+        self.deferred = deferred  # Renamed only after BackgroundWriter.publish()
+        self.handle = None
+        self.error = None
+
+    def write(self, data):
+        self.writer._put(("write", self, data))
+
+    def close(self):
+        self.writer._put(("close", self, None))
+
+class BackgroundWriter:
+    """
+    Writes files on a background thread. Operations are queued in a bounded queue, so a slow
+    disk slows down the producer instead of letting memory grow without bound.
+    Each file is written to a temporary file and renamed into place once complete, so a crash
+    never leaves a truncated file under the final name. Completed files are flushed to disk
+    (with fsync) and renamed in batches of up to fsync_batch files, or as soon as the writer is idle.
+    Args:
+        max_queue (int): Maximum number of pending write operations.
+        fsync (bool): Flush the data of each file to disk before renaming it.
+        fsync_batch (int): Maximum number of completed files flushed and renamed together.
+    """
+
+    def __init__(self, max_queue=WRITER_QUEUE_SIZE, fsync=True, fsync_batch=FSYNC_BATCH):
+        self.queue = queue.Queue(max_queue)
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.errors = []
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Files opened by each thread since take_opened_files()
+        self.staged = {}  # Writer thread only: path -> closed deferred file waiting for publish()
+        self.ready = {}  # Writer thread only: path -> closed file waiting to be flushed and renamed
+        self.thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+        self.thread.start()
+
+    def _put(self, op):
+        self.queue.put(op)
+
+    def _track(self, pending):
+        if not hasattr(self.local, "opened"):
+            self.local.opened = []
+        self.local.opened.append(pending)
+        return pending
+
+    def open(self, path, deferred=False):
+        """
+        Start writing a new file and return a handle with write() and close().
+        With deferred, the complete file keeps its temporary name until publish() is called for it
+        (so chunks can still be added to it with add_png_text()).
+        """
+        pending = self._track(_PendingFile(self, path, deferred))
+        self._put(("open", pending, None))
+        return pending
+
+    def take_opened_files(self):
+        """Return (and forget) the files opened by the calling thread, to check their error later."""
+        opened = getattr(self.local, "opened", [])
+        self.local.opened = []
+        return opened
+
+    def write_file(self, path, data):
+        """Queue a whole file (bytes, or str written as UTF-8)."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        pending = self.open(path)
+        pending.write(data)
+        pending.close()
+        return pending
+
+    def add_png_text(self, path, keyword, text):
+        """
+        Queue adding a text chunk to a PNG queued earlier (see add_png_text()); returns its pending
+        handle. The chunk is added before the file is renamed if it is not published yet.
+        """
+        pending = self._track(_PendingFile(self, path))
+        self._put(("png_text", pending, (keyword, text)))
+        return pending
+
+    def publish(self, paths):
+        """Queue renaming deferred files (see open()) into place."""
+        self._put(("publish", None, list(paths)))
+
+    def discard(self, pending):
+        """Queue abandoning a file: it is closed and its temporary file removed, if not renamed yet."""
+        self._put(("discard", pending, None))
+
+    def discard_staged(self, paths):
+        """Queue abandoning deferred files (see open()) instead of publishing them."""
+        self._put(("discard_staged", None, list(paths)))
+
+    def when_written(self, callback):
+        """Call callback() on the writer thread once everything queued so far has been written."""
+        self._put(("call", callback, None))
+
+    def flush(self):
+        """Wait until all queued writes are done; raise OSError if any of them failed."""
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise OSError("Failed to write: " + "; ".join(f"{path}: {error}" for path, error in errors))
+
+    def _fail(self, target, error, abandon=True):
+        target.error = error
+        with self.lock:
+            self.errors.append((target.path, error))
+        if abandon:
+            self._abandon(target)
+
+    def _abandon(self, target):
+        """Close a file and remove its temporary file (writer thread)."""
+        if target.handle is not None:
+            target.handle.close()
+            target.handle = None
+        self.staged.pop(target.path, None)
+        self.ready.pop(target.path, None)
+        try:
+            os.remove(target.temp_path)
+        except OSError:
+            pass
+
+    def _publish(self):
+        """Flush the ready files to disk and rename them into place (writer thread)."""
+        ready = list(self.ready.values())
+        self.ready.clear()
+        if self.fsync:
+            for target in ready:
+                try:
+                    _fsync_path(target.temp_path)
+                except OSError as e:
+                    self._fail(target, e)
+        directories = set()
+        for target in ready:
+            if target.error is None:
+                try:
+                    os.replace(target.temp_path, target.path)
+                    directories.add(os.path.dirname(os.path.abspath(target.path)))
+                except OSError as e:
+                    self._fail(target, e)
+        if self.fsync:
+            for directory in directories:
+                try:
+                    _fsync_path(directory, directory=True)
+                except OSError:
+                    pass  # Directories cannot be opened for fsync on Windows
+
+    def _run(self):
+        while True:
+            op, target, data = self.queue.get()
+            try:
+                if op == "call":
+                    self._publish()  # Callbacks see every file written so far under its final name
+                    target()
+                elif op == "publish":
+                    for path in data:
+                        pending = self.staged.pop(path, None)
+                        if pending is not None:
+                            self.ready[path] = pending
+                elif op == "discard":
+                    self._abandon(target)
+                elif op == "discard_staged":
+                    for path in data:
+                        pending = self.staged.get(path)
+                        if pending is not None:
+                            self._abandon(pending)
+                elif target.error is None:
+                    if op == "open":
+                        target.handle = open(target.temp_path, "wb")
+                    elif op == "write":
+                        target.handle.write(data)
+                    elif op == "close":
+                        target.handle.close()
+                        target.handle = None
+                        (self.staged if target.deferred else self.ready)[target.path] = target
+                    elif op == "png_text":
+                        pending = self.staged.get(target.path) or self.ready.get(target.path)
+                        add_png_text(pending.temp_path if pending else target.path, *data)
+            except Exception as e:
+                if op == "call":
+                    print(f"Error in write callback: {e}")
+                elif target is not None:
+                    # A failed text chunk leaves the image itself as it is
+                    self._fail(target, e, abandon=(op != "png_text"))
+            finally:
+                try:
+                    if len(self.ready) >= self.fsync_batch or (self.ready and self.queue.empty()):
+                        self._publish()
+                finally:
+                    self.queue.task_done()
+
+def part_path(path):
+    """Return the temporary path a file is written to before being renamed to path."""
+    return path + PART_SUFFIX
+
+def _fsync_path(path, directory=False):
+    fd = os.open(path, os.O_RDONLY if directory else os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def reserve_path(directory, stem, ext=".png"):
+    """
+    Return a new, unused file path stem + ext in directory (stem_1 + ext, stem_2 + ext, ... if it
+    is taken) and reserve it by creating its temporary file (see part_path), so concurrent
+    threads and processes never pick the same name. The reservation ends when a file written to
+    the path is renamed into place, or with release_path().
+    """
+    os.makedirs(directory, exist_ok=True)
+    suffix = 0
+    while True:
+        path = os.path.join(directory, f"{stem}_{suffix}{ext}" if suffix else stem + ext)
+        suffix += 1
+        try:
+            fd = os.open(part_path(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        # A file renamed into place no longer has its temporary file, so check the name itself too
+        if os.path.exists(path):
+            os.remove(part_path(path))
+            continue
+        return path
+
+def release_path(path):
+    """End the reservation of a path that was not written (see reserve_path)."""
+    try:
+        os.remove(part_path(path))
+    except OSError:
+        pass
+
+def png_text_chunk(keyword, text):
+    """Return a compressed iTXt chunk (keyword: Latin-1, up to 79 characters; text: any Unicode)."""
+    data = (keyword.encode("latin-1") + b"\0" + b"\1\0" + b"\0" + b"\0"
+            + zlib.compress(text.encode("utf-8")))
+    return struct.pack(">I", len(data)) + b"iTXt" + data + struct.pack(">I", zlib.crc32(b"iTXt" + data))
+
+def add_png_text(path, keyword, text):
+    """
+    Add an iTXt chunk to a PNG file in place, just before its IEND chunk (only the end of the
+    file is rewritten). Raises ValueError if the file does not end with an IEND chunk.
+    """
+    with open(path, "r+b") as f:
+        f.seek(-len(_IEND_CHUNK), 2)
+        if f.read(len(_IEND_CHUNK)) != _IEND_CHUNK:
+            raise ValueError(f"Not a complete PNG file: {path}")
+        f.seek(-len(_IEND_CHUNK), 2)
+        f.write(png_text_chunk(keyword, text) + _IEND_CHUNK)
+
+def read_png_text(path, keyword=None):
+    """
+    Return {keyword: text} of the text chunks (tEXt, zTXt, iTXt) of a PNG file, or only the
+    given keyword. Image data is skipped without being read. Raises ValueError for non-PNG files.
+    """
+    texts = {}
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError(f"Not a PNG file: {path}")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            if kind == b"IEND":
+                break
+            if kind not in (b"tEXt", b"zTXt", b"iTXt"):
+                f.seek(length + 4, 1)
+                continue
+            data = f.read(length)
+            f.seek(4, 1)
+            name, _, rest = data.partition(b"\0")
+            name = name.decode("latin-1")
+            if keyword is not None and name != keyword:
+                continue
+            try:
+                if kind == b"tEXt":
+                    texts[name] = rest.decode("latin-1")
+                elif kind == b"zTXt":
+                    texts[name] = zlib.decompress(rest[1:]).decode("latin-1")
+                else:
+                    compressed = rest[0] == 1
+                    _, _, rest = rest[2:].partition(b"\0")  # language tag
+                    _, _, rest = rest.partition(b"\0")  # translated keyword
+                    texts[name] = (zlib.decompress(rest) if compressed else rest).decode("utf-8")
+            except (zlib.error, UnicodeDecodeError, IndexError):
+                continue
+    return texts
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Return the shared background writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+def save_txt2img_response(response, path_for_image, writer=None, publish=True, on_image=None):
+    """
+    Stream a txt2img response to disk.
+    Args:
+        response (requests.Response): Response of a txt2img POST made with stream=True.
+        path_for_image (callable): Returns the file path for an image index, or None to skip that image.
+        writer (BackgroundWriter): Writer to use (default: the shared background writer).
+        publish (bool): Rename the images into place once written. If False, the caller adds
+            their metadata and then calls writer.publish() with their paths.
+        on_image (callable): Called as on_image(path, data) with the decoded bytes of each saved
+            image once it is complete (e.g. to post-process it without reading it back).
+    Returns:
+        tuple: (result dict without image data, list of (index, path) of the images queued for writing).
+    If reading the response fails, the images of the response are discarded and the error is raised.
+    """
+    writer = writer or get_writer()
+    files = {}
+    opened = []
+    saved = []
+    buffers = {}  # index -> decoded chunks, kept only for on_image
+
+    def on_start(index):
+        path = path_for_image(index)
+        if path:
+            files[index] = writer.open(path, deferred=not publish)
+            opened.append(files[index])
+            saved.append((index, path))
+            if on_image:
+                buffers[index] = []
+
+    def on_data(index, data):
+        if index in files:
+            files[index].write(data)
+            if index in buffers:
+                buffers[index].append(data)
+
+    def on_end(index):
+        if index in files:
+            pending = files.pop(index)
+            pending.close()
+            if index in buffers:
+                on_image(pending.path, b"".join(buffers.pop(index)))
+
+    decoder = Txt2ImgStreamDecoder(on_start, on_data, on_end)
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            decoder.feed(chunk)
+        return decoder.finish(), saved
+    except BaseException:
+        for pending in opened:
+            writer.discard(pending)
+        raise
@@ -1,72 +1,90 @@
 # image_task_batch_runner.py
 # Batch runner for image generation tasks from a queue file.
-# Reads each line from the queue file, runs the image generation command,
+# Reads each line from the queue file, runs the image generation task,
 # logs output, moves successful tasks to the done file, and leaves failed tasks in the queue.
+# Tasks are grouped by model so each checkpoint is loaded once per run instead of once per task,
+# and run in this process by batch_engine.py (use --subprocess for one process per task).
+# With several --backend URLs, tasks are spread over the servers with model affinity.
+# Tasks that differ only in seed are merged into batched txt2img requests (see --max-batch).
+# Fixed-seed tasks already generated with the same settings are served from a result cache.
+# With --store, the queue file is moved into a SQLite task store (task_store.py, run by store_runner.py)
+# and tasks are claimed with leases, so overlapping runs never process the same task twice.
+# Before the run, every task is checked against the server's checkpoints, samplers and schedulers
+# (cached, see webui_capabilities.py); tasks that cannot run are rejected without any GPU work.
+# With --postprocess, web-sized copies of every image are encoded on a process pool (postprocess.py).
+# With --draft, cheap low-step, reduced-size drafts of the queue's tasks are rendered instead (the
+# queue file is not changed); --refine then renders only the approved drafts at full quality, with
+# the drafts' seeds (see draft_refine.py).
+# Task durations are estimated from earlier runs (task_cost.py) for the queue's ETA and, with
+# --order sjf, to run the shortest tasks of a model and priority level first.
 
 import argparse
-import subprocess
 import os
-import sys
-from datetime import datetime
+
+import batch_engine
+import draft_refine
+import postprocess
+import result_cache
+import store_runner
+import task_priority
 
 # Parse command-line arguments for queue and done files
 parser = argparse.ArgumentParser(description="Batch runner for image generation tasks.")
-parser.add_argument('--queue', required=True, help='Path to the queue file (tasks to run)')
-parser.add_argument('--done', required=True, help='Path to the done file (completed tasks)')
+parser.add_argument('--queue', help='Path to the queue file (tasks to run)')
+parser.add_argument('--done', help='Path to the done file (completed tasks)')
+parser.add_argument('--store', help='SQLite task store to run from; the queue file (if any) is imported into it first')
+parser.add_argument('--claim-size', type=int, default=store_runner.STORE_CLAIM_SIZE, help=f'Tasks claimed at a time from the store (default: {store_runner.STORE_CLAIM_SIZE})')
+parser.add_argument('--backend', action='append', help='WebUI base URL to use; repeat for several servers (default: WEBUI_URL)')
+parser.add_argument('--max-batch', type=int, default=batch_engine.MAX_BATCH_TASKS, help=f'Maximum number of compatible tasks merged into one request; 1 disables batching (default: {batch_engine.MAX_BATCH_TASKS})')
+parser.add_argument('--subprocess', action='store_true', help='Run each task in its own run_image_generation.py process')
+parser.add_argument('--no-cache', action='store_true', help='Always generate, without using the result cache')
+parser.add_argument('--cache-dir', default=result_cache.DEFAULT_CACHE_DIR, help='Result cache directory (default: .result_cache next to the scripts)')
+parser.add_argument('--postprocess', action='append', metavar='TRANSFORM', help='Also write a converted copy of every image, e.g. webp:1024@80 or jpeg:256 (FORMAT[:MAX_SIZE][@QUALITY], needs Pillow); repeatable')
+parser.add_argument('--postprocess-workers', type=int, help='Processes encoding the post-processed copies (default: all cores but one)')
+parser.add_argument('--draft', metavar='DIR', help='Render low-step, reduced-size drafts of the queue tasks into DIR, with a contact sheet (the queue file is not changed)')
+parser.add_argument('--draft-steps', type=int, default=draft_refine.DRAFT_STEPS, help=f'Maximum steps of a draft (default: {draft_refine.DRAFT_STEPS})')
+parser.add_argument('--draft-scale', type=float, default=draft_refine.DRAFT_SCALE, help=f'Draft size as a fraction of the task size; 1 keeps the composition (default: {draft_refine.DRAFT_SCALE})')
+parser.add_argument('--refine', metavar='DIR', help='Render the approved drafts of DIR at full quality with their seeds (needs --approve and/or --score)')
+parser.add_argument('--approve', metavar='FILE', help='Approved drafts for --refine, one per line: draft number, cell (e.g. row-000/col-3) or image path')
+parser.add_argument('--score', metavar='MODULE:FUNCTION', help='Scoring hook for --refine: function(image_path, entry) returning a number')
+parser.add_argument('--min-score', type=float, default=draft_refine.DEFAULT_MIN_SCORE, help=f'Minimum score of drafts approved by --score (default: {draft_refine.DEFAULT_MIN_SCORE})')
+parser.add_argument('--order', choices=task_priority.ORDERS, default='priority', help='Order of the tasks of a model and priority level: queue order, or shortest estimated duration first (sjf)')
+parser.add_argument('--no-preflight', action='store_true', help='Do not check the tasks against the server before the run')
+parser.add_argument('--cache-max-gb', type=float, default=result_cache.DEFAULT_MAX_BYTES / 2 ** 30, help='Result cache size limit in GiB (default: %(default)s)')
 args = parser.parse_args()
-
-queue_file = args.queue
-done_file = args.done
-
-# Exit if the queue file does not exist
-if not os.path.exists(queue_file):
-    print(f"No queue file found: {queue_file}")
-    sys.exit(0)
-
-# Read all non-empty, non-comment lines from the queue file
-with open(queue_file, 'r', encoding='utf-8') as f:
-    tasks = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
-
-if not tasks:
-    print("No tasks to process.")
-    sys.exit(0)
-
-# Create a directory for per-task logs
-log_dir = os.path.join(os.path.dirname(done_file), "task_logs")
-os.makedirs(log_dir, exist_ok=True)
-
-remaining_tasks = []  # Will hold any failed tasks to retry next run
-for idx, task in enumerate(tasks, 1):
-    print(f"\n[Task {idx}/{len(tasks)}] Running: {task}")
-    # Log file for this task, timestamped for uniqueness
-    log_file = os.path.join(log_dir, f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{idx}.log")
+if args.draft or args.refine:
+    if args.store or args.subprocess or (args.draft and args.refine):
+        parser.error('--draft and --refine run in-process from a queue file, one at a time')
+    if args.draft and not args.queue:
+        parser.error('--draft needs --queue')
+    if args.refine and not (args.done and (args.approve or args.score)):
+        parser.error('--refine needs --done, and --approve and/or --score')
+elif not args.store and not (args.queue and args.done):
+    parser.error('--queue and --done are required without --store')
+if args.postprocess:
+    if args.subprocess:
+        parser.error('--postprocess needs in-process runs (not --subprocess)')
     try:
-        # Run the image generation command as a subprocess
-        # The task line should be the arguments for run_image_generation.py
-        result = subprocess.run(f"python run_image_generation.py {task}", shell=True, capture_output=True, text=True, cwd=os.path.dirname(__file__))
-        # Write stdout and stderr to the log file
-        with open(log_file, 'w', encoding='utf-8') as lf:
-            lf.write(f"COMMAND: python run_image_generation.py {task}\n\n")
-            lf.write(f"STDOUT:\n{result.stdout}\n\nSTDERR:\n{result.stderr}\n")
-        if result.returncode == 0:
-            print(f"Task succeeded. Log: {log_file}")
-            # Append the successful task to the done file
-            with open(done_file, 'a', encoding='utf-8') as df:
-                df.write(task + '\n')
-        else:
-            print(f"Task failed (see log). Will keep in queue. Log: {log_file}")
-            remaining_tasks.append(task)
-    except Exception as e:
-        print(f"Exception running task: {e}")
-        remaining_tasks.append(task)
+        postprocess.check_transforms(args.postprocess)
+    except (ImportError, ValueError) as e:
+        parser.error(str(e))
 
-# Rewrite the queue file with any failed tasks for the next run
-if remaining_tasks:
-    with open(queue_file, 'w', encoding='utf-8') as f:
-        for t in remaining_tasks:
-            f.write(t + '\n')
-    print(f"{len(remaining_tasks)} task(s) left in queue for next run.")
+options = dict(in_process=not args.subprocess, backends=args.backend, max_batch=args.max_batch,
+               result_cache_dir=None if args.no_cache else args.cache_dir,
+               result_cache_max_bytes=int(args.cache_max_gb * 2 ** 30), check=not args.no_preflight,
+               postprocess=args.postprocess, postprocess_workers=args.postprocess_workers, order=args.order)
+if args.draft:
+    draft_refine.run_drafts(args.queue, args.draft, args.draft_steps, args.draft_scale, **options)
+elif args.refine:
+    try:
+        score = draft_refine.load_hook(args.score) if args.score else None
+        draft_refine.read_manifest(args.refine)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.approve and not os.path.exists(args.approve):
+        parser.error(f'Approval list not found: {args.approve}')
+    draft_refine.run_refine(args.refine, args.done, args.approve, score, args.min_score, **options)
+elif args.store:
+    store_runner.run_store(args.store, args.queue, args.done, claim_size=args.claim_size, **options)
 else:
-    # If all tasks succeeded, remove the queue file
-    os.remove(queue_file)
-    print("All tasks completed and queue file removed.")
+    batch_engine.run_queue(args.queue, args.done, **options)
@@ -0,0 +1,354 @@
+# image_task_daemon.py
+#
+# Long-running task runner: one process that keeps its backend workers, HTTP sessions and
+# loaded models warm and starts tasks as soon as they are submitted, instead of waiting for
+# image_task_scheduler.bat to start a new image_task_batch_runner.py run.
+# Tasks are kept in the SQLite task store (task_store.py), so they survive a restart and the
+# store can still be shared with `image_task_batch_runner.py --store`. Tasks are submitted:
+#   - over HTTP on 127.0.0.1: POST /tasks with queue lines as text, or JSON {"tasks": [...]}
+#     (invalid lines are rejected with status 400 and nothing is queued)
+#   - by saving queue files matching --watch (moved into the store within --poll seconds)
+#   - with `python image_task_daemon.py --submit '<queue line>'`
+# GET /status returns the number of tasks in each state, the model loaded on each backend and the
+# estimated seconds until the waiting tasks are done (see task_cost.py).
+# Tasks run with the batch engine (model grouping, priorities, batching, result cache, timings).
+# Submitted, watched and stored tasks are checked against the servers first (preflight.py):
+# invalid submissions are rejected with status 400, other invalid tasks are marked as failed.
+#
+# Ctrl+C, SIGTERM or POST /shutdown (`--stop`) stop the daemon gracefully: running tasks finish
+# and their files are written, claimed tasks that did not start yet go back to the store.
+# A second Ctrl+C exits immediately.
+#
+# Usage:
+#   python image_task_daemon.py --store image_tasks.db --watch "image_tasks_new_*.txt" [--port 7870 --backend URL]
+#   python image_task_daemon.py --submit 'flux --prompt "a cat" --priority 10'
+#   curl --data-binary @tasks.txt http://127.0.0.1:7870/tasks
+
+import argparse
+import glob
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import batch_engine
+import image_io
+import postprocess
+import preflight
+import result_cache
+import store_runner
+import sweep
+import task_cost
+import task_dispatch
+import task_priority
+import task_store
+import task_timing
+
+# Port of the submission API (on 127.0.0.1)
+DEFAULT_PORT = 7870
+
+# Seconds between checks of the watched queue files (and of tasks added to the store by others)
+POLL_SECONDS = 1.0
+
+class TaskDaemon:
+    """
+    Runs the tasks of a task store until stopped, claiming new tasks as they arrive.
+    Args:
+        store_path (str): Task database.
+        watch (list): Glob patterns of queue files to move into the store.
+        done_file (str): Text file successful tasks are also appended to (optional).
+        claim_size (int): Claimed tasks kept waiting in memory, for model grouping and batching.
+        poll (float): Seconds between checks of the watched files and the store.
+        check (bool): Check tasks with preflight.preflight() before they are queued or run.
+        Other arguments: see batch_engine.run_queue().
+    """
+
+    def __init__(self, store_path, watch=(), done_file=None, in_process=True, backends=None,
+                 max_batch=batch_engine.MAX_BATCH_TASKS, result_cache_dir=None,
+                 result_cache_max_bytes=result_cache.DEFAULT_MAX_BYTES, claim_size=store_runner.STORE_CLAIM_SIZE,
+                 poll=POLL_SECONDS, check=True, postprocess=None, postprocess_workers=None, order="priority"):
+        self.store = task_store.TaskStore(store_path)
+        self.watch = list(watch)
+        self.done_file = done_file
+        self.claim_size = claim_size
+        self.poll = poll
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.log_dir = os.path.join(os.path.dirname(os.path.abspath(done_file or store_path)), "task_logs")
+        os.makedirs(self.log_dir, exist_ok=True)
+        clients = batch_engine.setup_run(in_process, backends, result_cache_dir, result_cache_max_bytes, postprocess,
+                                         postprocess_workers)
+        self.clients = clients
+        self.check = check
+        # Changed from the HTTP threads and the run loop, under self.lock (which also guards the
+        # dispatcher's reads of capable, in _claim)
+        self.checked = set()  # Ids of the stored tasks that passed preflight
+        self.capable = {}  # Queue line -> the only backends that can run it (filled by preflight)
+        # Task durations are estimated from the timings of earlier runs (for the ETA and order "sjf")
+        costs = task_cost.CostModel.from_file(os.path.join(self.log_dir, task_timing.TIMINGS_FILE))
+        self.dispatcher = task_dispatch.TaskDispatcher([], max_batch if in_process else 1, keep_open=True, costs=costs,
+                                                      order=order, capable=self.capable)
+        self.workers = batch_engine.make_workers(clients, self.dispatcher, in_process, self.log_dir, self._on_done)
+        self.ids = {}  # dispatcher position -> task id in the store
+        self.lock = threading.Lock()
+        self.submitted = 0  # Tasks submitted since the last claim
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+
+    def submit(self, tasks):
+        """
+        Validate queue lines and add them to the store (all or none); comment and empty lines are skipped.
+        Returns the number of tasks added; raises ValueError naming the first invalid line.
+        """
+        tasks = sweep.expand_tasks([task.strip() for task in tasks if task.strip() and not task.strip().startswith('#')])
+        capable = {}
+        if self.check:
+            errors = preflight.preflight(tasks, self.clients, capable=capable)
+        else:
+            errors = {position: error for position, error in enumerate(map(preflight.check_task, tasks)) if error}
+        if errors:
+            position = min(errors)
+            raise ValueError(f"{errors[position]}: {tasks[position]}")
+        ids = self.store.add(tasks, source="daemon")
+        with self.lock:
+            self.capable.update(capable)
+            if self.check:
+                self.checked.update(ids)
+            self.submitted += len(ids)
+        self.wake.set()
+        return len(ids)
+
+    def status(self):
+        """Return the task counts, the tasks waiting in memory, the model loaded on each backend and the ETA in seconds."""
+        with self.dispatcher.lock:
+            loaded = {worker.name: self.dispatcher.loaded.get(worker.name) for worker in self.workers}
+        seconds = self.dispatcher.remaining_seconds()
+        return {"tasks": self.store.counts(), "waiting": self.dispatcher.pending(), "loaded": loaded,
+                "eta_seconds": round(seconds) if seconds is not None else None, "stopping": self.stopping.is_set()}
+
+    def stop(self):
+        """Ask the daemon to stop after the running tasks (returns immediately)."""
+        self.stopping.set()
+        self.wake.set()
+
+    def run(self):
+        """Run tasks until stop() is called, then finish the running tasks and return the task counts."""
+        for worker in self.workers:
+            worker.start()
+        renew_stop = threading.Event()
+        renewer = threading.Thread(target=store_runner.renew_leases, args=(self.store, self.owner, renew_stop),
+                                   name="lease-renewer", daemon=True)
+        renewer.start()
+        self._check_pending()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    self._import_watched()
+                    self._claim()
+                except Exception as e:
+                    print(f"Could not take new tasks: {e}", flush=True)
+                self.wake.wait(self.poll)
+                self.wake.clear()
+        finally:
+            self._shutdown()
+            renew_stop.set()
+        return self.store.counts()
+
+    def _import_watched(self):
+        for pattern in self.watch:
+            for path in sorted(glob.glob(pattern)):
+                imported = self.store.import_file(path)
+                if imported:
+                    print(f"Imported {imported} task(s) from {path}", flush=True)
+                    self._check_pending()
+
+    def _check_pending(self):
+        """Mark pending tasks of the store that cannot run as failed (each task is checked once)."""
+        if not self.check:
+            return
+        stored = self.store.tasks((task_store.PENDING,))
+        with self.lock:
+            pending = [(task_id, task) for task_id, task in stored if task_id not in self.checked]
+        capable = {}
+        errors = preflight.preflight([task for _, task in pending], self.clients, capable=capable)
+        preflight.report_rejected([task for _, task in pending], errors)
+        self.store.reject([pending[position][0] for position in errors])
+        with self.lock:
+            self.capable.update(capable)
+            self.checked.update(task_id for position, (task_id, _) in enumerate(pending) if position not in errors)
+
+    def _claim(self):
+        """Claim tasks up to claim_size waiting in memory, and always the newly submitted ones."""
+        with self.lock:
+            wanted = max(self.claim_size - self.dispatcher.pending(), self.submitted)
+            self.submitted = 0
+        if wanted <= 0:
+            return
+        claimed = self.store.claim(self.owner, wanted)
+        if claimed:
+            with self.lock:
+                positions = self.dispatcher.add([task for _, task, _ in claimed], [created for _, _, created in claimed])
+                self.ids.update(zip(positions, [task_id for task_id, _, _ in claimed]))
+
+    def _on_done(self, position, task, success):
+        with self.lock:
+            task_id = self.ids.pop(position)
+        if not success:
+            self.store.fail(task_id, self.owner)
+        else:
+            self.store.complete(task_id)
+            if self.done_file:
+                with self.lock:
+                    with open(self.done_file, 'a', encoding='utf-8') as df:
+                        df.write(task + '\n')
+        self.wake.set()  # Room for more tasks (and a failed task may be claimed again)
+
+    def _shutdown(self):
+        """Let the workers finish their running tasks and put the tasks not started back into the store."""
+        print("Stopping: finishing the running tasks...", flush=True)
+        left = self.dispatcher.close()
+        with self.lock:
+            released = [self.ids.pop(position) for position, _ in left]
+        if released:
+            self.store.release(released, self.owner)
+            print(f"{len(released)} task(s) not started were put back into the store.", flush=True)
+        for worker in self.workers:
+            worker.join()
+        try:
+            image_io.get_writer().flush()
+        except OSError:
+            pass
+        batch_engine.close_postprocessing()
+
+def make_server(daemon, port=DEFAULT_PORT):
+    """Return an HTTP server (not started) for the daemon's submission API on 127.0.0.1."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, data, status=200):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_tasks(self):
+            """Return the queue lines of the request body (text lines, or JSON {"tasks": [...]} / {"task": "..."})."""
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8")
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                data = json.loads(body or "{}")
+                return list(data.get("tasks", [])) + ([data["task"]] if "task" in data else [])
+            return body.splitlines()
+
+        def do_GET(self):
+            if self.path.split("?")[0] == "/status":
+                self._send_json(daemon.status())
+            else:
+                self._send_json({"error": "Not Found"}, 404)
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            if path == "/tasks":
+                if daemon.stopping.is_set():
+                    self._send_json({"error": "The daemon is stopping"}, 503)
+                    return
+                try:
+                    tasks = self._read_tasks()
+                except (ValueError, AttributeError, TypeError) as e:
+                    self._send_json({"error": f"Invalid request body: {e}"}, 400)
+                    return
+                try:
+                    self._send_json({"queued": daemon.submit(tasks)}, 202)
+                except ValueError as e:
+                    self._send_json({"error": str(e)}, 400)
+            elif path == "/shutdown":
+                daemon.stop()
+                self._send_json({"stopping": True}, 202)
+            else:
+                self._send_json({"error": "Not Found"}, 404)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+def send(port, path, data=None):
+    """Send a request to a running daemon's API and return the decoded JSON response."""
+    body = json.dumps(data).encode("utf-8") if data is not None else b""
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b"{}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued image generation tasks continuously, with a local submission API.")
+    parser.add_argument('--store', default=task_store.DEFAULT_DB, help='Task database (default: image_tasks.db next to the scripts)')
+    parser.add_argument('--watch', action='append', default=[], help='Glob pattern of queue files to move into the store; repeatable')
+    parser.add_argument('--done', help='Also append completed tasks to this file')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port of the submission API on 127.0.0.1 (default: {DEFAULT_PORT})')
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS, help=f'Seconds between checks of the watched files (default: {POLL_SECONDS})')
+    parser.add_argument('--claim-size', type=int, default=store_runner.STORE_CLAIM_SIZE, help=f'Claimed tasks kept in memory for model grouping (default: {store_runner.STORE_CLAIM_SIZE})')
+    parser.add_argument('--backend', action='append', help='WebUI base URL to use; repeat for several servers (default: WEBUI_URL)')
+    parser.add_argument('--max-batch', type=int, default=batch_engine.MAX_BATCH_TASKS, help=f'Maximum number of compatible tasks merged into one request; 1 disables batching (default: {batch_engine.MAX_BATCH_TASKS})')
+    parser.add_argument('--subprocess', action='store_true', help='Run each task in its own run_image_generation.py process')
+    parser.add_argument('--no-cache', action='store_true', help='Always generate, without using the result cache')
+    parser.add_argument('--cache-dir', default=result_cache.DEFAULT_CACHE_DIR, help='Result cache directory (default: .result_cache next to the scripts)')
+    parser.add_argument('--cache-max-gb', type=float, default=result_cache.DEFAULT_MAX_BYTES / 2 ** 30, help='Result cache size limit in GiB (default: %(default)s)')
+    parser.add_argument('--postprocess', action='append', metavar='TRANSFORM', help='Also write a converted copy of every image, e.g. webp:1024@80 or jpeg:256 (FORMAT[:MAX_SIZE][@QUALITY], needs Pillow); repeatable')
+    parser.add_argument('--postprocess-workers', type=int, help='Processes encoding the post-processed copies (default: all cores but one)')
+    parser.add_argument('--order', choices=task_priority.ORDERS, default='priority', help='Order of the tasks of a model and priority level: queue order, or shortest estimated duration first (sjf)')
+    parser.add_argument('--no-preflight', action='store_true', help='Do not check tasks against the server before queueing them')
+    parser.add_argument('--submit', action='append', metavar='TASK', help='Submit a queue line to the running daemon and exit; repeatable')
+    parser.add_argument('--stop', action='store_true', help='Ask the running daemon to stop gracefully and exit')
+    args = parser.parse_args()
+
+    if args.submit or args.stop:
+        try:
+            if args.submit:
+                print(send(args.port, "/tasks", {"tasks": args.submit}))
+            if args.stop:
+                print(send(args.port, "/shutdown"))
+        except OSError as e:
+            print(f"Could not reach the daemon on port {args.port}: {e}", flush=True)
+            sys.exit(1)
+        sys.exit(0)
+    if args.postprocess:
+        if args.subprocess:
+            parser.error('--postprocess needs in-process runs (not --subprocess)')
+        try:
+            postprocess.check_transforms(args.postprocess)
+        except (ImportError, ValueError) as e:
+            parser.error(str(e))
+
+    daemon = TaskDaemon(args.store, args.watch, args.done, in_process=not args.subprocess, backends=args.backend,
+                        max_batch=args.max_batch, result_cache_dir=None if args.no_cache else args.cache_dir,
+                        result_cache_max_bytes=int(args.cache_max_gb * 2 ** 30), claim_size=args.claim_size,
+                        poll=args.poll, check=not args.no_preflight, postprocess=args.postprocess,
+                        postprocess_workers=args.postprocess_workers, order=args.order)
+    httpd = make_server(daemon, args.port)
+    threading.Thread(target=httpd.serve_forever, name="submission-api", daemon=True).start()
+
+    def request_stop(signum, frame):
+        # A second Ctrl+C raises KeyboardInterrupt and exits immediately
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        daemon.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    print(f"Task daemon running: API on http://127.0.0.1:{args.port}, store {args.store} (Ctrl+C to stop)", flush=True)
+    counts = daemon.run()
+    httpd.shutdown()
+    httpd.server_close()
+    print("Tasks in store: " + ", ".join(f"{count} {state}" for state, count in counts.items()))
@@ -10,10 +10,11 @@ REM -- Define working directories (edit as needed)
 set SCRIPTDIR=D:\Files\Code\Python\WebUI-API
 set QUEUEFILE=%SCRIPTDIR%\image_tasks_new_%today%.txt
 set DONEFILE=%SCRIPTDIR%\image_tasks_done_%today%.txt
+set STOREFILE=%SCRIPTDIR%\image_tasks.db
 
 REM -- Call Python script to process today’s queue file
-REM   (Python script should handle moving lines from new to done)
-"C:\Program Files\Python311\python.exe" "%SCRIPTDIR%\image_task_batch_runner.py" --queue "%QUEUEFILE%" --done "%DONEFILE%"
+REM   (the queue file is moved into the task store, so overlapping runs never process a task twice)
+"C:\Program Files\Python311\python.exe" "%SCRIPTDIR%\image_task_batch_runner.py" --queue "%QUEUEFILE%" --done "%DONEFILE%" --store "%STOREFILE%"
 
 REM -- Optionally, log completion timestamp
 >> "%SCRIPTDIR%\batch_run.log" echo Completed run on %date% at %time%
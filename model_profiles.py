@@ -0,0 +1,227 @@
+# model_profiles.py
+#
+# Declarative model profiles (model_profiles.json): checkpoint, VAE, additional modules,
+# txt2img payload settings and defaults of each model the scripts can use. Adding a checkpoint
+# is a new entry in the JSON file; image_engine.py does the setup and generation for any profile.
+#
+# Profile fields:
+#   checkpoint          checkpoint file name (in MODELS_DIR/Stable-diffusion)
+#   hash                checkpoint hash, part of the title the WebUI reports ("" if unknown)
+#   vae                 VAE path relative to MODELS_DIR (optional)
+#   additional_modules  paths relative to MODELS_DIR loaded with the checkpoint (optional)
+#   negative_prompt     whether the model uses a negative prompt (default: true)
+#   check_files         whether the model files must exist in MODELS_DIR (default: true)
+#   image_prefix        prefix of the saved image file names
+#   defaults            default width/height of the model's own script
+#   payload             txt2img settings; the string "{vae}" is replaced by the VAE path
+#
+# Importing this module is cheap: the .env file is read when MODELS_DIR is first needed, and the
+# model files are only checked when a generation is requested. Successful checks are remembered in
+# .model_files_cache.json, keyed on each model directory's path and mtime, so later runs skip
+# stat'ing files on a (possibly network-mounted) MODELS_DIR until a directory changes.
+#
+# Usage:
+#   import model_profiles
+#   profile = model_profiles.get_profile("flux")
+#   payload = profile.build_payload("a cat", None, 42, 1024, 768, 20)
+
+import copy
+import json
+import os
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Default profiles file (next to the scripts)
+PROFILES_FILE = os.path.join(BASE_DIR, "model_profiles.json")
+
+# Model files found by earlier runs: {directory: {"mtime": ..., "files": [names]}}
+VALIDATION_CACHE_FILE = os.path.join(BASE_DIR, ".model_files_cache.json")
+
+_env_loaded = False
+
+def load_env():
+    """Load environment variables (MODELS_DIR) from the .env file, once per process."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def models_dir():
+    """Return MODELS_DIR (from the environment or .env file)."""
+    load_env()
+    path = os.getenv("MODELS_DIR")
+    if not path:
+        raise EnvironmentError("MODELS_DIR not set in .env file.")
+    return path
+
+class ModelProfile:
+    """One model profile (see the field list at the top of this file)."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.description = data.get("description", name)
+        self.checkpoint = data["checkpoint"]
+        self.hash = data.get("hash", "")
+        self.vae = data.get("vae")
+        self.additional_modules = list(data.get("additional_modules", []))
+        self.negative_prompt = data.get("negative_prompt", True)
+        self.check_files = data.get("check_files", True)
+        self.image_prefix = data.get("image_prefix", f"{name}_image")
+        self.defaults = dict(data.get("defaults", {}))
+        self.payload = data.get("payload", {})
+
+    @property
+    def checkpoint_title(self):
+        """Checkpoint title as reported by the WebUI ('file [hash]', or the file name without a hash)."""
+        return f"{self.checkpoint} [{self.hash}]" if self.hash else self.checkpoint
+
+    def vae_path(self):
+        return os.path.join(models_dir(), self.vae) if self.vae else None
+
+    def options(self):
+        """Return the /sdapi/v1/options settings that load this model."""
+        options = {"sd_model_checkpoint": self.checkpoint_title}
+        if self.vae:
+            options["sd_vae"] = self.vae_path()
+        if self.additional_modules:
+            options["forge_additional_modules"] = [os.path.join(models_dir(), path) for path in self.additional_modules]
+        return options
+
+    def switch_key(self):
+        """
+        Key identifying the model state this profile needs on the server. Profiles with the same
+        key (e.g. the same checkpoint with different payload settings) do not need a model switch.
+        """
+        return json.dumps([self.checkpoint_title, self.vae, self.additional_modules])
+
+    def required_files(self):
+        """Return the model files that must exist in MODELS_DIR (none if check_files is false)."""
+        if not self.check_files:
+            return []
+        files = [os.path.join(models_dir(), "Stable-diffusion", self.checkpoint)]
+        if self.vae:
+            files.append(self.vae_path())
+        files += [os.path.join(models_dir(), path) for path in self.additional_modules]
+        return files
+
+    def build_payload(self, prompt, negative_prompt=None, seed=-1, width=512, height=512, steps=20, cfg_scale=None):
+        """
+        Build the txt2img payload for this model.
+        Args:
+            prompt (str): The text prompt for image generation.
+            negative_prompt (str or None): Negative prompt (ignored if the model does not use one).
+            seed (int): Random seed for reproducibility (-1 for random).
+            width (int): Image width.
+            height (int): Image height.
+            steps (int): Number of inference steps.
+            cfg_scale (float or None): CFG scale (default: the profile's).
+        """
+        payload = {"prompt": prompt, "steps": steps, "seed": seed, "width": width, "height": height}
+        payload.update(_substitute(copy.deepcopy(self.payload), {"{vae}": self.vae_path() if self.vae else None}))
+        if cfg_scale is not None:
+            payload["cfg_scale"] = cfg_scale
+        if negative_prompt and self.negative_prompt:
+            payload["negative_prompt"] = negative_prompt
+        return payload
+
+def _substitute(value, replacements):
+    """Replace placeholder strings in a (nested) payload template."""
+    if isinstance(value, dict):
+        return {key: _substitute(item, replacements) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, replacements) for item in value]
+    if isinstance(value, str) and value in replacements:
+        return replacements[value]
+    return value
+
+_loaded = {}  # path -> (mtime, {name: ModelProfile})
+
+def load_profiles(path=PROFILES_FILE):
+    """Return the profiles of a profiles file by name (reloaded only when the file changes)."""
+    mtime = os.path.getmtime(path)
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        cached = (mtime, {name: ModelProfile(name, entry) for name, entry in data.items()})
+        _loaded[path] = cached
+    return cached[1]
+
+def profile_names():
+    """Return the names of the available profiles."""
+    return list(load_profiles())
+
+def get_profile(name):
+    """Return a profile by name; raises KeyError for unknown names."""
+    profiles = load_profiles()
+    if name not in profiles:
+        raise KeyError(f"Unknown model profile: {name} (available: {', '.join(profiles)})")
+    return profiles[name]
+
+_checked = set()  # (profile name, MODELS_DIR) whose files were found
+_checked_lock = threading.Lock()
+
+def _read_validation_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _write_validation_cache(path, cache):
+    """Write the validation cache atomically (a failed write only costs a re-check next time)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def check_required_files(profile, cache_file=VALIDATION_CACHE_FILE):
+    """
+    Raise FileNotFoundError if a model file of the profile is missing.
+    Checked once per process; between runs, a file found earlier is not stat'ed again while the
+    mtime of its directory is unchanged (removing or renaming a file changes the directory mtime).
+    Args:
+        profile (ModelProfile): Profile whose required_files() are checked.
+        cache_file (str): Validation cache file (None to always check the files).
+    """
+    if not profile.check_files:
+        return
+    key = (profile.name, models_dir())
+    if key in _checked:
+        return
+    with _checked_lock:
+        if key in _checked:
+            return
+        cache = _read_validation_cache(cache_file) if cache_file else {}
+        changed = False
+        directories = {}
+        for path in profile.required_files():
+            directory, name = os.path.split(os.path.abspath(path))
+            if directory not in directories:
+                try:
+                    directories[directory] = os.stat(directory).st_mtime
+                except OSError:
+                    raise FileNotFoundError(f"❌ Missing required file: {path}")
+            mtime = directories[directory]
+            entry = cache.get(directory)
+            if not isinstance(entry, dict) or entry.get("mtime") != mtime:
+                entry = cache[directory] = {"mtime": mtime, "files": []}
+                changed = True
+            if name in entry["files"]:
+                continue
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"❌ Missing required file: {path}")
+            entry["files"].append(name)
+            changed = True
+        if changed and cache_file:
+            _write_validation_cache(cache_file, cache)
+        _checked.add(key)
@@ -0,0 +1,348 @@
+# output_dedupe.py
+#
+# Finds near-duplicate images across the output directories (seed sweeps and re-queued tasks
+# leave many), e.g. the same prompt and seed in output_images_steps25 and output_images_steps50.
+# Every image gets a 64-bit perceptual hash (a difference hash of an 9x8 grayscale thumbnail:
+# one bit per pair of neighbouring pixels), so images that look alike have hashes differing in
+# few bits whatever their size, compression or embedded metadata.
+# Hashes are kept in a compact NumPy index (output_hashes.npz); updates are incremental, so only
+# new or changed images (by modification time and size) are decoded, on a process pool.
+# Near duplicates are found without comparing every pair: a hash within D bits of another matches
+# it exactly in at least one of D + 1 bit blocks (pigeonhole), so only images sharing a block are
+# compared, with vectorized XOR and popcounts. This scales to hundreds of thousands of images.
+# With --link, each duplicate that is byte-identical to the oldest image of its group (same size
+# and SHA-256, so the same pixels and the same embedded generation metadata) is replaced by a hard
+# link to it; its _meta.txt file is kept. Images that only look alike are never linked.
+# Needs NumPy and Pillow (pip install numpy Pillow).
+#
+# Usage:
+#   python output_dedupe.py [output_images output_images_steps25 ...] [--max-distance 4]
+#   python output_dedupe.py --json
+#   python output_dedupe.py --link --max-distance 0
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import output_index
+import postprocess
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Default index location (next to the scripts)
+DEFAULT_INDEX = os.path.join(output_index.BASE_DIR, "output_hashes.npz")
+
+# Default maximum number of differing hash bits for two images to count as duplicates
+DEFAULT_MAX_DISTANCE = 4
+
+# Largest supported distance (the search splits the 64 hash bits into max_distance + 1 blocks)
+MAX_DISTANCE = 31
+
+# Hash pairs compared at a time within one large block bucket (bounds the memory of large buckets)
+COMPARE_CHUNK = 1 << 22
+
+# Block buckets up to this size are compared together, by offset within the sorted hashes
+SMALL_BUCKET = 64
+
+# Set bits per byte value (popcount for NumPy versions without bitwise_count)
+_BYTE_BITS = None if numpy is None else numpy.array([bin(value).count("1") for value in range(256)], dtype=numpy.uint8)
+
+def image_hash(path):
+    """
+    Return the 64-bit difference hash of an image (in a worker process), or None if it cannot be read.
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.draft("L", (64, 64))
+            small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    pixels = numpy.asarray(small, dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(numpy.packbits(bits).view(">u8")[0])
+
+def popcount(values):
+    """Return the number of set bits of each value of a uint64 array."""
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(values)
+    return _BYTE_BITS[values.view(numpy.uint8)].reshape(-1, 8).sum(axis=1, dtype=numpy.int32)
+
+def near_pairs(hashes, max_distance):
+    """
+    Return (first, second) index arrays of the pairs of distinct hashes (first < second) that
+    differ in at most max_distance bits (0 <= max_distance <= MAX_DISTANCE).
+    """
+    count = len(hashes)
+    blocks = max_distance + 1
+    width = 64 // blocks
+    first_found, second_found = [], []
+
+    def collect(first, second):
+        close = popcount(hashes[first] ^ hashes[second]) <= max_distance
+        first_found.append(numpy.minimum(first, second)[close])
+        second_found.append(numpy.maximum(first, second)[close])
+
+    for block in range(blocks):
+        shift = block * width
+        bits = width if block < blocks - 1 else 64 - shift
+        keys = (hashes >> numpy.uint64(shift)) & numpy.uint64((1 << bits) - 1)
+        order = numpy.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        sizes = numpy.diff(numpy.append(starts, count))
+        # Small buckets (contiguous in sorted order): compare each hash with the one offset places
+        # after it, for every offset up to the largest small bucket
+        small = numpy.repeat(sizes <= SMALL_BUCKET, sizes)
+        small_keys, small_order = sorted_keys[small], order[small]
+        largest = int(sizes[sizes <= SMALL_BUCKET].max(initial=0))
+        for offset in range(1, largest):
+            same = small_keys[:-offset] == small_keys[offset:]
+            collect(small_order[:-offset][same], small_order[offset:][same])
+        # Large buckets: compare each member with those after it, a band of rows at a time
+        large = sizes > SMALL_BUCKET
+        for start, size in zip(starts[large].tolist(), sizes[large].tolist()):
+            members = order[start:start + size]
+            rows = max(1, COMPARE_CHUNK // len(members))
+            for row in range(0, len(members) - 1, rows):
+                band = members[row:row + rows]
+                i, j = numpy.triu_indices(len(band), 1, len(members) - row)
+                collect(band[i], members[row:][j])
+    if not first_found:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    # A pair sharing several blocks is found once per block
+    pairs = numpy.unique(numpy.concatenate(first_found).astype(numpy.int64) * count
+                         + numpy.concatenate(second_found))
+    return pairs // count, pairs % count
+
+def walk_images(roots):
+    """Yield (path, stat) of the PNG images below the given directories (hidden and derived directories skipped)."""
+    pending = [os.path.abspath(root) for root in roots if os.path.isdir(root)]
+    seen = set()
+    while pending:
+        directory = pending.pop()
+        if directory in seen:
+            continue
+        seen.add(directory)
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith(".") and entry.name != postprocess.DERIVED_DIR:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith(".png"):
+                    yield entry.path, entry.stat()
+            except OSError:
+                continue
+
+class HashIndex:
+    """
+    Perceptual hashes of the images below one or more output directories.
+    Args:
+        path (str): Index file (created on save).
+    """
+
+    def __init__(self, path=DEFAULT_INDEX):
+        if numpy is None:
+            raise ImportError("Duplicate detection needs NumPy (pip install numpy)")
+        self.path = path
+        self.paths = numpy.zeros(0, dtype=str)
+        self.mtimes = numpy.zeros(0, dtype=numpy.float64)
+        self.sizes = numpy.zeros(0, dtype=numpy.int64)
+        self.hashes = numpy.zeros(0, dtype=numpy.uint64)
+        self.roots = []
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                self.paths, self.mtimes = data["paths"], data["mtimes"]
+                self.sizes, self.hashes = data["sizes"], data["hashes"]
+                self.roots = data["roots"].tolist()
+        except (OSError, KeyError, ValueError):
+            pass
+
+    def save(self):
+        """Write the index atomically."""
+        buffer = io.BytesIO()
+        numpy.savez(buffer, paths=self.paths, mtimes=self.mtimes, sizes=self.sizes, hashes=self.hashes,
+                    roots=numpy.array(self.roots, dtype=str))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def update(self, roots, workers=None):
+        """
+        Bring the index up to date for the images below the given directories: hash new and
+        changed images, and drop images that no longer exist. Returns (images hashed, images removed).
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        self.roots = sorted(set(self.roots) | set(roots))
+        known = {path: index for index, path in enumerate(self.paths.tolist())}
+        keep, stale = [], []
+        for path, stat in walk_images(self.roots):
+            index = known.pop(path, None)
+            if (index is not None and self.mtimes[index] == stat.st_mtime
+                    and self.sizes[index] == stat.st_size):
+                keep.append(index)
+            else:
+                stale.append((path, stat.st_mtime, stat.st_size))
+        removed = len(known)
+        hashed = []
+        if stale:
+            if importlib.util.find_spec("PIL") is None:
+                raise ImportError("Duplicate detection needs Pillow (pip install Pillow)")
+            print(f"Hashing {len(stale)} image(s)...", flush=True)
+            start = time.time()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for count, ((path, mtime, size), value) in enumerate(
+                        zip(stale, pool.map(image_hash, [path for path, _, _ in stale], chunksize=16)), 1):
+                    if value is None:
+                        print(f"Could not read {path}", flush=True)
+                    else:
+                        hashed.append((path, mtime, size, value))
+                    if count % 1000 == 0:
+                        print(f"  {count}/{len(stale)} ({count / (time.time() - start):.0f} images/s)", flush=True)
+        keep = numpy.array(keep, dtype=numpy.int64)
+        self.paths = numpy.concatenate((self.paths[keep].astype(str), numpy.array([h[0] for h in hashed], dtype=str)))
+        self.mtimes = numpy.concatenate((self.mtimes[keep], numpy.array([h[1] for h in hashed], dtype=numpy.float64)))
+        self.sizes = numpy.concatenate((self.sizes[keep], numpy.array([h[2] for h in hashed], dtype=numpy.int64)))
+        self.hashes = numpy.concatenate((self.hashes[keep], numpy.array([h[3] for h in hashed], dtype=numpy.uint64)))
+        return len(hashed), removed
+
+    def duplicates(self, max_distance=DEFAULT_MAX_DISTANCE, roots=None):
+        """
+        Return the groups of near-duplicate images, largest first. Each group is a list of
+        (path, distance to the first image) with the oldest image first.
+        Args:
+            max_distance (int): Maximum number of differing hash bits between linked images.
+            roots (list): Only consider images below these directories (default: all indexed).
+        """
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE}")
+        selected = numpy.arange(len(self.paths))
+        if roots:
+            prefixes = tuple(os.path.abspath(root).rstrip(os.sep) + os.sep for root in roots)
+            selected = numpy.array([i for i, path in enumerate(self.paths.tolist()) if path.startswith(prefixes)],
+                                   dtype=numpy.int64)
+        # Identical hashes are grouped first, so only distinct hashes are compared
+        unique, inverse = numpy.unique(self.hashes[selected], return_inverse=True)
+        parent = list(range(len(unique)))
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        if max_distance > 0:
+            for a, b in zip(*(side.tolist() for side in near_pairs(unique, max_distance))):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+        groups = {}
+        for position, hash_index in enumerate(inverse.ravel().tolist()):
+            groups.setdefault(find(hash_index), []).append(int(selected[position]))
+        result = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda i: (self.mtimes[i], self.paths[i]))
+            distances = popcount(self.hashes[members] ^ self.hashes[members[0]])
+            result.append([(str(self.paths[i]), int(d)) for i, d in zip(members, distances)])
+        result.sort(key=lambda group: (-len(group), group[0][0]))
+        return result
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_duplicates(groups):
+    """
+    Replace each duplicate that is byte-identical to its group's first image (same size and
+    SHA-256) by a hard link to that image; duplicates that differ in any byte (pixels or embedded
+    metadata) are left alone. Returns (files linked, bytes freed).
+    """
+    linked = freed = 0
+    for group in groups:
+        keeper = group[0][0]
+        keeper_digest = None
+        for path, _ in group[1:]:
+            tmp_path = f"{path}.{os.getpid()}.link.tmp"
+            try:
+                if os.path.samefile(keeper, path):
+                    continue
+                size = os.stat(path).st_size
+                if size != os.stat(keeper).st_size:
+                    continue
+                if keeper_digest is None:
+                    keeper_digest = file_digest(keeper)
+                if file_digest(path) != keeper_digest:
+                    continue
+                os.link(keeper, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Could not link {path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                continue
+            linked += 1
+            freed += size
+    return linked, freed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate images in the output directories.")
+    parser.add_argument('roots', nargs='*', help=f'Output directories (default: those indexed before and {output_index.DEFAULT_ROOTS})')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='Hash index file (default: output_hashes.npz next to the scripts)')
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE, help=f'Maximum differing hash bits (0-{MAX_DISTANCE}, 0 for identical-looking images; default: {DEFAULT_MAX_DISTANCE})')
+    parser.add_argument('--workers', type=int, help='Processes hashing new images (default: one per core)')
+    parser.add_argument('--link', action='store_true', help='Replace each byte-identical duplicate with a hard link to the oldest image of its group')
+    parser.add_argument('--json', action='store_true', help='Print the duplicate groups as JSON')
+    args = parser.parse_args()
+    if not 0 <= args.max_distance <= MAX_DISTANCE:
+        parser.error(f'--max-distance must be between 0 and {MAX_DISTANCE}')
+
+    try:
+        index = HashIndex(args.index)
+        roots = args.roots or list(dict.fromkeys(index.roots + output_index.default_roots()))
+        hashed, removed = index.update(roots, args.workers)
+    except ImportError as e:
+        raise SystemExit(str(e))
+    index.save()
+    groups = index.duplicates(args.max_distance, args.roots or None)
+    if args.json:
+        print(json.dumps([[{"path": path, "distance": distance} for path, distance in group] for group in groups],
+                         indent=2))
+    else:
+        for group in groups:
+            print(group[0][0])
+            for path, distance in group[1:]:
+                print(f"    {distance:2d} bits: {path}")
+        duplicates = sum(len(group) - 1 for group in groups)
+        print(f"{len(index.paths)} image(s) indexed ({hashed} hashed, {removed} removed), "
+              f"{duplicates} duplicate(s) in {len(groups)} group(s)")
+    if args.link:
+        linked, freed = link_duplicates(groups)
+        print(f"Linked {linked} duplicate(s), {freed / 2 ** 20:.1f} MiB freed")
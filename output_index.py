@@ -0,0 +1,275 @@
+# output_index.py
+#
+# SQLite index of the generated images in the output directories, for fast lookups such as
+# "all Flux images with seed 333" without opening thousands of metadata files.
+# Each image's metadata is read from the structured record embedded in the PNG (see
+# image_engine.metadata_record), or parsed from its _meta.txt file for images saved before
+# records were embedded. Updates are incremental: a directory is listed once and only new or
+# changed images (by modification time and size) are read; deleted images are removed.
+# Indexed directories are remembered, so `update` without arguments refreshes all of them.
+#
+# Usage:
+#   python output_index.py update [output_images output_images_flux ...]
+#   python output_index.py query --model flux --seed 333
+#   python output_index.py query --prompt lighthouse --size 1024x768 --since 2025-06-01 --update
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import image_io
+import postprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Default index location (next to the scripts)
+DEFAULT_DB = os.path.join(BASE_DIR, "output_index.db")
+
+# Output directories indexed by default (relative to the scripts)
+DEFAULT_ROOTS = "output_images*"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    source TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    profile TEXT,
+    seed INTEGER,
+    width INTEGER,
+    height INTEGER,
+    steps INTEGER,
+    cfg_scale REAL,
+    sampler TEXT,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE INDEX IF NOT EXISTS images_seed ON images (seed);
+CREATE INDEX IF NOT EXISTS images_date ON images (date);
+CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY);
+"""
+
+# Columns filled from the metadata, in table order
+FIELDS = ["prompt", "negative_prompt", "model", "profile", "seed", "width", "height", "steps", "cfg_scale", "sampler", "date"]
+
+# _meta.txt line names -> record fields
+_META_FIELDS = {"Prompt": "prompt", "Negative Prompt": "negative_prompt", "Seed": "seed", "Width": "width",
+                "Height": "height", "Steps": "steps", "CFG Scale": "cfg_scale", "Sampler": "sampler",
+                "Model": "model", "Date": "date"}
+_INTEGERS = {"seed", "width", "height", "steps"}
+
+def parse_meta_text(text):
+    """Parse the text of a _meta.txt file into a record dict (the actual seed is taken from the API info)."""
+    record = {}
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        if line.startswith("[API Info/Metadata]"):
+            try:
+                info = json.loads("\n".join(lines[index + 1:]))
+                if isinstance(info, dict) and isinstance(info.get("seed"), int):
+                    record["seed"] = info["seed"]
+            except ValueError:
+                pass
+            break
+        name, sep, value = line.partition(": ")
+        field = _META_FIELDS.get(name)
+        if not sep or field is None or field in record:
+            continue
+        try:
+            record[field] = int(value) if field in _INTEGERS else float(value) if field == "cfg_scale" else value
+        except ValueError:
+            pass
+    return record
+
+def read_metadata(path):
+    """Return (source, record) of an image: its embedded record, else its _meta.txt, else (None, {})."""
+    try:
+        text = image_io.read_png_text(path, image_io.METADATA_KEYWORD).get(image_io.METADATA_KEYWORD)
+        if text:
+            return "png", json.loads(text)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.splitext(path)[0] + "_meta.txt", "r", encoding="utf-8") as f:
+            return "meta.txt", parse_meta_text(f.read())
+    except OSError:
+        return None, {}
+
+class OutputIndex:
+    """
+    Index of the images below one or more output directories.
+    Args:
+        path (str): Index database (created if needed).
+    """
+
+    def __init__(self, path=DEFAULT_DB):
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def roots(self):
+        """Return the directories indexed so far."""
+        return [row[0] for row in self.db.execute("SELECT path FROM roots ORDER BY path")]
+
+    def update(self, roots):
+        """
+        Bring the index up to date for the images below the given directories (hidden directories,
+        such as the result cache, and post-processed copies are skipped). Returns (images added or updated, images removed).
+        """
+        changed = removed = 0
+        for root in roots:
+            root = os.path.abspath(root)
+            if not os.path.isdir(root):
+                continue
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)", (root,))
+            visited = set()
+            pending = [root]
+            while pending:
+                directory = pending.pop()
+                visited.add(directory)
+                subdirs, c, r = self._update_directory(directory)
+                pending.extend(subdirs)
+                changed += c
+                removed += r
+            # Directories that no longer exist
+            prefix = root.rstrip(os.sep) + os.sep
+            known = [row[0] for row in self.db.execute(
+                "SELECT DISTINCT directory FROM images WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                (root, len(prefix), prefix))]
+            with self.db:
+                for directory in set(known) - visited:
+                    removed += self.db.execute("DELETE FROM images WHERE directory = ?", (directory,)).rowcount
+        return changed, removed
+
+    def _update_directory(self, directory):
+        """Index the images of one directory; return (subdirectories, images changed, images removed)."""
+        indexed = {path: (mtime, size) for path, mtime, size in self.db.execute(
+            "SELECT path, mtime, size FROM images WHERE directory = ?", (directory,))}
+        subdirs = []
+        rows = []
+        seen = set()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith(".") and entry.name != postprocess.DERIVED_DIR:
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.name.lower().endswith(".png"):
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            seen.add(entry.path)
+            if indexed.get(entry.path) == (stat.st_mtime, stat.st_size):
+                continue
+            source, record = read_metadata(entry.path)
+            if not record.get("date"):
+                record["date"] = datetime.fromtimestamp(stat.st_mtime).isoformat()
+            rows.append((entry.path, directory, stat.st_mtime, stat.st_size, source)
+                        + tuple(record.get(field) for field in FIELDS))
+        gone = [(path,) for path in indexed if path not in seen]
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO images (path, directory, mtime, size, source, {', '.join(FIELDS)}) "
+                                f"VALUES ({', '.join('?' * (5 + len(FIELDS)))})", rows)
+            self.db.executemany("DELETE FROM images WHERE path = ?", gone)
+        return subdirs, len(rows), len(gone)
+
+    def query(self, prompt=None, model=None, seed=None, width=None, height=None, since=None, until=None, limit=None):
+        """
+        Return the matching images as dicts (newest first).
+        Args:
+            prompt (str): Substring of the prompt (case-insensitive for ASCII letters).
+            model (str): Substring of the checkpoint title or profile name.
+            seed (int): Exact seed.
+            width (int), height (int): Exact image size.
+            since (str), until (str): ISO date/time bounds of the generation date (until is inclusive
+                of the whole day when only a date is given).
+            limit (int): Maximum number of results.
+        """
+        where, params = [], []
+        if prompt:
+            where.append("prompt LIKE ?")
+            params.append(f"%{prompt}%")
+        if model:
+            where.append("(model LIKE ? OR profile LIKE ?)")
+            params += [f"%{model}%"] * 2
+        for column, value in (("seed", seed), ("width", width), ("height", height)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            where.append("date >= ?")
+            params.append(since)
+        if until:
+            where.append("date <= ?")
+            params.append(until + "T99" if "T" not in until else until)
+        sql = "SELECT path, source, " + ", ".join(FIELDS) + " FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        columns = ["path", "source"] + FIELDS
+        return [dict(zip(columns, row)) for row in self.db.execute(sql, params)]
+
+def default_roots():
+    """Return the output_images* directories next to the scripts."""
+    return [path for path in sorted(glob.glob(os.path.join(BASE_DIR, DEFAULT_ROOTS))) if os.path.isdir(path)]
+
+def parse_size(text):
+    width, height = (int(value) for value in text.lower().split("x"))
+    return width, height
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and search the generated images.")
+    parser.add_argument('--db', default=DEFAULT_DB, help='Index database (default: output_index.db next to the scripts)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    update_parser = commands.add_parser('update', help='Index new and changed images')
+    update_parser.add_argument('roots', nargs='*', help=f'Output directories (default: those indexed before and {DEFAULT_ROOTS})')
+    query_parser = commands.add_parser('query', help='Search the index')
+    query_parser.add_argument('--prompt', help='Substring of the prompt')
+    query_parser.add_argument('--model', help='Substring of the checkpoint or profile name (e.g. flux)')
+    query_parser.add_argument('--seed', type=int, help='Seed')
+    query_parser.add_argument('--size', type=parse_size, help='Image size WIDTHxHEIGHT')
+    query_parser.add_argument('--since', help='Generated on or after this date/time (YYYY-MM-DD[THH:MM])')
+    query_parser.add_argument('--until', help='Generated on or before this date/time (YYYY-MM-DD[THH:MM])')
+    query_parser.add_argument('--limit', type=int, default=100, help='Maximum number of results (default: 100, 0 for all)')
+    query_parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    query_parser.add_argument('--update', action='store_true', help='Update the index before searching')
+    args = parser.parse_args()
+
+    index = OutputIndex(args.db)
+    try:
+        if args.command == 'update' or args.update:
+            roots = getattr(args, 'roots', None) or list(dict.fromkeys(index.roots() + default_roots()))
+            changed, removed = index.update(roots)
+            if args.command == 'update':
+                print(f"Indexed {changed} new or changed image(s), removed {removed}, in {len(roots)} director(ies)")
+        if args.command == 'query':
+            width, height = args.size or (None, None)
+            results = index.query(args.prompt, args.model, args.seed, width, height, args.since, args.until, args.limit)
+            if args.json:
+                print(json.dumps(results, indent=2))
+            else:
+                for r in results:
+                    print(f"{r['path']}\n    seed {r['seed']}, {r['width']}x{r['height']}, {r['steps']} steps, "
+                          f"{r['profile'] or r['model']}, {r['date']}: {(r['prompt'] or '')[:80]}")
+                print(f"{len(results)} image(s)")
+    finally:
+        index.close()
@@ -0,0 +1,176 @@
+# postprocess.py
+#
+# Optional post-processing stage for generated images: web-sized copies and thumbnails (WebP,
+# AVIF, JPEG or PNG, optionally downscaled), encoded on a process pool from the image bytes
+# already in memory, so CPU-bound encoding runs on spare cores while the GPU works on the next
+# generation. At most max_pending images wait for or are in encoding; submitting more blocks
+# the generation (backpressure), so a slow encoder cannot make memory grow without bound.
+# Needs Pillow (pip install Pillow); AVIF needs a Pillow build with AVIF support.
+#
+# A transform is written FORMAT[:MAX_SIZE][@QUALITY], e.g.
+#   webp:1024@80   WebP, longest side at most 1024 pixels, quality 80
+#   jpeg:256       JPEG thumbnail, longest side at most 256 pixels
+#   avif           AVIF at full size
+# Its output goes to a "derived" directory next to the image: derived/<image name>_1024.webp.
+#
+# Usage:
+#   import postprocess
+#   processor = postprocess.PostProcessor(["webp:1024@80", "jpeg:256"])
+#   processor.submit("out/flux_image_20250621_180000.png", png_bytes)
+#   processor.wait()
+
+import importlib.util
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Directory (next to the images) the transformed copies are written to
+DERIVED_DIR = "derived"
+
+# Output formats: name -> (Pillow format, file extension)
+FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+    "png": ("PNG", ".png"),
+}
+
+class Transform:
+    """
+    One output of the post-processing stage (see the top of this file).
+    Args:
+        format (str): Output format (a key of FORMATS).
+        max_size (int or None): Maximum width and height; larger images are downscaled.
+        quality (int or None): Encoder quality (lossy formats), or None for Pillow's default.
+    """
+
+    def __init__(self, format, max_size=None, quality=None):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown post-processing format: {format} (use {', '.join(FORMATS)})")
+        self.format = format
+        self.max_size = max_size
+        self.quality = quality
+
+    def output_path(self, image_path):
+        """Return the path of this transform's copy of an image."""
+        directory, name = os.path.split(image_path)
+        stem = os.path.splitext(name)[0]
+        suffix = f"_{self.max_size or 'full'}" + (f"_q{self.quality}" if self.quality is not None else "")
+        return os.path.join(directory, DERIVED_DIR, stem + suffix + FORMATS[self.format][1])
+
+    def __repr__(self):
+        return (self.format + (f":{self.max_size}" if self.max_size else "")
+                + (f"@{self.quality}" if self.quality is not None else ""))
+
+def parse_transform(text):
+    """Parse a transform (FORMAT[:MAX_SIZE][@QUALITY]); raises ValueError."""
+    text = text.strip().lower()
+    text, _, quality = text.partition("@")
+    format, _, max_size = text.partition(":")
+    try:
+        max_size = int(max_size) if max_size else None
+        quality = int(quality) if quality else None
+    except ValueError:
+        raise ValueError(f"Invalid post-processing transform (use FORMAT[:MAX_SIZE][@QUALITY]): {text}")
+    return Transform(format, max_size, quality)
+
+def check_transforms(transforms):
+    """
+    Parse transforms (Transform objects or strings) and check that Pillow is installed.
+    Returns the list of Transform objects; raises ValueError or ImportError.
+    """
+    transforms = [parse_transform(t) if isinstance(t, str) else t for t in transforms]
+    if importlib.util.find_spec("PIL") is None:
+        raise ImportError("Post-processing needs Pillow (pip install Pillow)")
+    return transforms
+
+def apply_transforms(image_path, data, transforms):
+    """
+    Decode an image from its bytes and write each transform's copy (in a worker process).
+    Each copy is written to a temporary file and renamed into place. Returns the written paths.
+    """
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    written = []
+    for transform in transforms:
+        output = image
+        if transform.max_size and max(image.size) > transform.max_size:
+            output = image.copy()
+            output.thumbnail((transform.max_size, transform.max_size), Image.LANCZOS)
+        pil_format = FORMATS[transform.format][0]
+        if pil_format == "JPEG" and output.mode not in ("RGB", "L"):
+            output = output.convert("RGB")
+        path = transform.output_path(image_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        options = {} if transform.quality is None else {"quality": transform.quality}
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            output.save(temp_path, format=pil_format, **options)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        written.append(path)
+    return written
+
+class PostProcessor:
+    """
+    Runs transforms on generated images in a process pool (see the top of this file).
+    Args:
+        transforms (list): Transforms, as Transform objects or strings (see parse_transform).
+        workers (int): Worker processes (default: all cores but one).
+        max_pending (int): Images submitted but not finished before submit() blocks (default: 2 per worker).
+    """
+
+    def __init__(self, transforms, workers=None, max_pending=None):
+        self.transforms = check_transforms(transforms)
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.slots = threading.Semaphore(max_pending or 2 * self.workers)
+        self.pending = 0
+        self.done = threading.Condition()
+        self.failed = 0
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, image_path, data):
+        """Queue an image (path it is saved under, and its encoded bytes); blocks while max_pending are queued."""
+        self.slots.acquire()
+        with self.done:
+            self.pending += 1
+        try:
+            future = self.pool.submit(apply_transforms, image_path, data, self.transforms)
+        except BaseException:
+            self._finished()
+            raise
+        future.add_done_callback(lambda future: self._on_result(image_path, future))
+
+    def _on_result(self, image_path, future):
+        try:
+            future.result()
+        except Exception as e:
+            with self.done:
+                self.failed += 1
+            print(f"Post-processing failed for {image_path}: {e}", flush=True)
+        finally:
+            self._finished()
+
+    def _finished(self):
+        self.slots.release()
+        with self.done:
+            self.pending -= 1
+            self.done.notify_all()
+
+    def wait(self):
+        """Wait until every submitted image is processed."""
+        with self.done:
+            self.done.wait_for(lambda: self.pending == 0)
+
+    def close(self):
+        """Wait for the submitted images and stop the worker processes."""
+        self.wait()
+        self.pool.shutdown()
@@ -0,0 +1,105 @@
+# preflight.py
+#
+# Checks queued tasks before any work starts, without generating: their arguments, model profile
+# and model files, and the checkpoints, samplers, schedulers and VAE/modules of each server (from
+# a cached snapshot, see webui_capabilities.py). The batch engine, the store runner and the daemon
+# reject the tasks that no server can run up front, instead of paying a model switch and a failed
+# generation for each; tasks that only some servers can run are dispatched to those servers only
+# (see task_dispatch.TaskDispatcher).
+#
+# Usage:
+#   import preflight
+#   capable = {}
+#   errors = preflight.preflight(tasks, clients, capable=capable)
+#   preflight.report_rejected(tasks, errors)
+
+import model_profiles
+import run_image_generation
+import task_output
+import webui_capabilities
+import webui_client
+
+def check_task(task):
+    """Return None if a queue line is valid, or the argument parser's error message."""
+    errors = []
+
+    def parse():
+        try:
+            run_image_generation.parse_task(task)
+        except ValueError as e:
+            errors.append(str(e))
+
+    _, _, stderr = task_output.run_captured(parse)
+    if not errors:
+        return None
+    # Prefer the usage error argparse printed ("argument --seed: invalid int value: 'x'")
+    usage_errors = [line.split(": error: ", 1)[1] for line in stderr.splitlines() if ": error: " in line]
+    return (usage_errors or errors)[-1]
+
+def preflight(tasks, clients=None, snapshots=None, capable=None):
+    """
+    Check queue lines before a run, without generating (see the top of this file).
+    Tasks with the same model and sampler settings are checked against the servers once.
+    A snapshot loaded from the cache that rejects a task is refreshed once, in case the server
+    gained the missing checkpoint or sampler since; if the server cannot be reached for that, a
+    warning is printed and the task is allowed on it.
+    Args:
+        tasks (list): Queue lines.
+        clients (list): Clients of the servers the tasks may run on (default: the shared client).
+        snapshots (list): Capability snapshots of those servers (default: loaded for the clients).
+        capable (dict): If given, filled with {queue line: base URLs of the servers that can run it}
+            for the tasks only some of the servers can run (see task_dispatch.TaskDispatcher).
+    Returns:
+        dict: {position in tasks: error message} of the tasks that no server can run.
+    """
+    clients = clients or [webui_client.get_client()]
+    if snapshots is None:
+        snapshots = [webui_capabilities.load_snapshot(client) for client in clients]
+    errors = {}
+    checked = {}  # (profile, sampler, scheduler) -> (server problems, indexes of the servers that can run it)
+    refreshed = set()  # Indexes of the servers whose cached snapshot was refreshed (or could not be)
+    for position, task in enumerate(tasks):
+        error = check_task(task)
+        if error:
+            errors[position] = error
+            continue
+        args = run_image_generation.parse_task(task)
+        try:
+            profile = model_profiles.get_profile(args.script)
+            model_profiles.check_required_files(profile)
+        except (KeyError, FileNotFoundError) as e:
+            errors[position] = str(e).strip("'\"")
+            continue
+        payload = profile.build_payload(args.prompt, args.negative, args.seed, args.width, args.height, args.steps,
+                                        args.cfg)
+        key = (args.script, payload.get("sampler_name"), payload.get("scheduler"))
+        if key not in checked:
+            problems = []
+            able = []
+            for index, snapshot in enumerate(snapshots):
+                found = snapshot.check_payload(profile, payload) if snapshot is not None else []
+                if found and snapshot.from_cache and index not in refreshed:
+                    refreshed.add(index)
+                    snapshots[index] = snapshot = webui_capabilities.load_snapshot(clients[index], refresh=True) or snapshot
+                    found = snapshot.check_payload(profile, payload)
+                if found and snapshot.from_cache:
+                    # Only an old snapshot says so: let the server try rather than reject the task
+                    task_output.report(f"Warning: could not refresh the capabilities of {snapshot.url}; the cached snapshot "
+                            f"reports {'; '.join(found)}")
+                    found = []
+                if found:
+                    problems += [f"{problem} ({snapshot.url})" for problem in found]
+                else:
+                    able.append(index)
+            checked[key] = problems, able
+        problems, able = checked[key]
+        if not able:
+            errors[position] = "; ".join(problems)
+        elif len(able) < len(clients) and capable is not None:
+            capable[task] = {clients[index].base_url for index in able}
+    return errors
+
+def report_rejected(tasks, errors):
+    """Print the tasks rejected by preflight()."""
+    for position in sorted(errors):
+        task_output.report(f"Task rejected before the run: {errors[position]}: {tasks[position]}")
@@ -0,0 +1,130 @@
+# result_cache.py
+#
+# Content-addressed cache of generated images, used by the batch engine to skip regenerating
+# deterministic tasks (fixed seed) that were already rendered, e.g. when a queue is re-run after
+# a partial failure. The key is a hash of the full txt2img payload plus the model checkpoint.
+# Each entry is stored as <key>.png and <key>.json (API info); images are copied into the cache and
+# out of it into the requested output directory on a hit, so output images never share a file
+# (or its modification time, which the output indexes rely on) with a cache entry. The least
+# recently used entries (by the modification time of the cache's own files) are evicted when the
+# cache grows beyond its size limit. Tasks with seed -1 bypass the cache.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# Default cache location and size limit
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_cache")
+DEFAULT_MAX_BYTES = 5 * 2 ** 30
+
+def cache_key(payload, checkpoint):
+    """Return the cache key of a single-image txt2img payload generated with the given checkpoint."""
+    data = json.dumps({"payload": payload, "checkpoint": checkpoint}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def is_cacheable(payload):
+    """Only deterministic single-image requests (fixed seed) can be served from the cache."""
+    return payload.get("seed", -1) != -1 and payload.get("batch_size", 1) == 1 and payload.get("n_iter", 1) == 1
+
+def is_complete_png(path):
+    """Return True if the file ends with a PNG IEND chunk (i.e. it was written completely)."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(-12, os.SEEK_END)
+            return f.read(12) == b"\x00\x00\x00\x00IEND\xaeB`\x82"
+    except OSError:
+        return False
+
+def _temp_path(path):
+    """Return a temporary path next to path, unique to the calling process and thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+class ResultCache:
+    """
+    Cache of generated images in a directory, with size-based LRU eviction.
+    Args:
+        cache_dir (str): Directory holding the cache entries.
+        max_bytes (int): Size limit; least recently used entries are evicted beyond it.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".png", base + ".json"
+
+    def lookup(self, key):
+        """Return (image_path, info) for a cached key, or None. Marks the entry as recently used."""
+        image_path, info_path = self._paths(key)
+        try:
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)["info"]
+            os.utime(image_path)
+            os.utime(info_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return image_path, info
+
+    def restore(self, key, destination):
+        """
+        Place a copy of the cached image of a key at destination (written under a temporary name,
+        then renamed into place); return its info, or None on a miss.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        image_path, info = entry
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        temp_path = _temp_path(destination)
+        shutil.copyfile(image_path, temp_path)
+        os.replace(temp_path, destination)
+        return info
+
+    def store(self, key, source, info):
+        """
+        Add a generated image (and its API info) to the cache, then evict old entries if needed.
+        Incomplete images (e.g. a failed write) are not stored.
+        """
+        if not is_complete_png(source):
+            return
+        image_path, info_path = self._paths(key)
+        with self.lock:
+            if not os.path.exists(image_path):
+                temp_path = _temp_path(image_path)
+                shutil.copyfile(source, temp_path)
+                os.replace(temp_path, image_path)
+            temp_path = _temp_path(info_path)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"info": info}, f)
+            os.replace(temp_path, info_path)
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".png"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for stale in (path, os.path.splitext(path)[0] + ".json"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
@@ -1,56 +1,100 @@
 # run_image_generation.py
 #
-# This script allows you to call any of the image generation scripts (Flux or Realistic Photo)
-# from the command line or a batch file, passing the prompt and other parameters as arguments.
+# This script allows you to generate an image with any model profile (Flux, Realistic Photo,
+# JuggernautXL, or any other entry of model_profiles.json) from the command line or a batch file,
+# passing the prompt and other parameters as arguments.
 #
 # Usage example (PowerShell or CMD):
 #   python run_image_generation.py flux "a beautiful landscape" --seed 123 --width 1024 --height 768
 #   python run_image_generation.py realistic "a cat on a windowsill" --negative "blurry, low quality" --seed 42
+#   python run_image_generation.py flux --prompt "a lighthouse" --steps 10,25,50 --seed 1000..1003 --output sweeps/lighthouse
+#
+# --width, --height, --cfg, --steps and --seed accept sweep values (lists and ranges, see sweep.py):
+# the command runs every combination with one model setup, batching consecutive seeds, and
+# writes a grid of output directories with an index.html contact sheet.
+# In queue files, --priority and --deadline set when the batch runner runs a task (see task_priority.py).
 
+import shlex
 import sys
-import subprocess
 import argparse
 
-# Map script types to their corresponding Python files
-SCRIPT_MAP = {
-    'flux': 'flux.py',
-    'realistic': 'realistic_photo.py',
-    'jugger': 'jugger.py',
-}
+import model_profiles
+import sweep
+import task_priority
+
+def deadline_arg(text):
+    """argparse type of --deadline: the deadline as a Unix timestamp."""
+    try:
+        return task_priority.parse_deadline(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-def main():
+def build_parser(defaults=None):
+    """
+    Build the argument parser shared by this CLI, the model scripts and the batch engine (queue
+    lines use the same grammar). defaults overrides argument defaults (e.g. a model's width/height).
+    """
     parser = argparse.ArgumentParser(description="Run image generation scripts with custom prompts and parameters.")
-    parser.add_argument('script', choices=SCRIPT_MAP.keys(), help="Which script to run: 'flux' or 'realistic'")
+    parser.add_argument('script', choices=model_profiles.profile_names(), help="Which model profile to use (see model_profiles.json)")
     parser.add_argument('--prompt', required=True, help="Prompt for image generation (named argument)")
-    parser.add_argument('--negative', help="Negative prompt (named argument, only for realistic)")
-    parser.add_argument('--seed', type=int, default=-1, help="Seed value (default: -1 for random)")
-    parser.add_argument('--width', type=int, default=896, help="Image width (default: 896)")
-    parser.add_argument('--height', type=int, default=1152, help="Image height (default: 1152)")
-    parser.add_argument('--steps', type=int, default=20, help="Number of inference steps (default: 20)")
+    parser.add_argument('--negative', help="Negative prompt (named argument, ignored by models without one, e.g. flux)")
+    parser.add_argument('--seed', type=int, default=-1, help="Seed value (default: -1 for random; sweep: e.g. 1000..1007)")
+    parser.add_argument('--width', type=int, default=896, help="Image width (default: %(default)s; sweep: e.g. 768,1024)")
+    parser.add_argument('--height', type=int, default=1152, help="Image height (default: %(default)s; sweep: e.g. 768,1024)")
+    parser.add_argument('--steps', type=int, default=20, help="Number of inference steps (default: 20; sweep: e.g. 10,25,50)")
+    parser.add_argument('--cfg', type=float, help="CFG scale (default: the model profile's; sweep: e.g. 3.5,7)")
     parser.add_argument('--output', default=".", help="Output directory (default: current directory)")
-    args = parser.parse_args()
-
-    script_file = SCRIPT_MAP[args.script]
-
-    prompt = args.prompt
-    negative = args.negative
-
-    # Build the command to call the target script with the right parameters
-    if args.script == 'flux':
-        cmd = [sys.executable, script_file, '--prompt', prompt, '--seed', str(args.seed), '--width', str(args.width), '--height', str(args.height), '--steps', str(args.steps), '--output', args.output]
-    elif args.script == 'jugger':
-        cmd = [sys.executable, script_file, '--prompt', prompt]
-        if negative:
-            cmd += ['--negative', negative]
-        cmd += ['--seed', str(args.seed), '--width', str(args.width), '--height', str(args.height), '--steps', str(args.steps), '--output', args.output]
-    else:
-        cmd = [sys.executable, script_file, '--prompt', prompt]
-        if negative:
-            cmd += ['--negative', negative]
-        cmd += ['--seed', str(args.seed), '--width', str(args.width), '--height', str(args.height), '--steps', str(args.steps), '--output', args.output]
-
-    print(f"Running: {' '.join(cmd)}")
-    subprocess.run(cmd)
+    parser.add_argument('--skip-setup', action='store_true', help="Skip the model setup (the model is already loaded)")
+    parser.add_argument('--sweep-root', help="Root directory of the sweep this task belongs to (set by sweep expansion)")
+    parser.add_argument('--priority', type=int, default=task_priority.DEFAULT_PRIORITY, help="Queue priority lane, higher runs first (batch runner only, default: 0)")
+    parser.add_argument('--deadline', type=deadline_arg, help="When the image is needed, YYYY-MM-DDTHH:MM or HH:MM today (batch runner only)")
+    if defaults:
+        parser.set_defaults(**defaults)
+    return parser
+
+def parse_task(task):
+    """
+    Parse a queue line (the arguments of this script, e.g. 'flux --prompt "..." --seed 1') into an args namespace.
+    Raises ValueError if the line is not valid.
+    """
+    try:
+        argv = shlex.split(task)
+    except ValueError as e:
+        raise ValueError(f"Cannot parse task line: {e}")
+    try:
+        return build_parser().parse_args(argv)
+    except SystemExit:
+        # argparse already printed the usage error
+        raise ValueError(f"Invalid task arguments: {task}")
+
+def main(argv=None, defaults=None):
+    """Parse the command line (argv, default sys.argv[1:]) and generate the image(s) in this process."""
+    parser = build_parser(defaults)
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        expanded = sweep.expand_argv(argv)
+    except ValueError as e:
+        parser.error(str(e))
+    # Parse first: --help and usage errors do not need the engine (or its imports)
+    args_list = [parser.parse_args(item) for item in expanded]
+    if len(expanded) > 1:
+        import batch_engine
+        print(f"Sweep of {len(args_list)} images")
+        failed = batch_engine.run_sweep(args_list)
+        if failed:
+            sys.exit(f"{failed} of {len(args_list)} images failed")
+        return
+    args = args_list[0]
+    import image_engine
+    import image_io
+    import task_timing
+
+    # Report phase timings to the batch runner when it started this script
+    task_timing.start_from_env()
+    image_engine.generate_from_args(args)
+    # Wait for the background writer to finish writing the files
+    with task_timing.phase("write"):
+        image_io.get_writer().flush()
 
 if __name__ == "__main__":
     main()
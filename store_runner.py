@@ -0,0 +1,105 @@
+# store_runner.py
+#
+# Runs the tasks of a SQLite task store (task_store.py) with the batch engine, instead of a text
+# queue file: tasks are claimed in chunks with leases that are renewed while they run and recorded
+# as done one by one, so a crashed or overlapping run never repeats finished tasks or runs a task
+# twice. Claimed tasks an interrupted run never started go back to the store.
+#
+# Usage:
+#   import store_runner
+#   store_runner.run_store("image_tasks.db", queue_file="image_tasks_new_20250621.txt")
+
+import os
+import socket
+import threading
+
+import batch_engine
+import preflight
+import result_cache
+import task_output
+import task_store
+
+# Number of tasks a runner claims at a time from a task store
+STORE_CLAIM_SIZE = 32
+
+def renew_leases(store, owner, stop):
+    """Renew the leases of a runner's claimed tasks until stop (a threading.Event) is set; run it in a thread."""
+    while not stop.wait(task_store.LEASE_SECONDS / 3):
+        try:
+            store.renew(owner)
+        except Exception as e:
+            task_output.report(f"Could not renew task leases: {e}")
+
+def run_store(store_path, queue_file=None, done_file=None, in_process=True, backends=None,
+              max_batch=batch_engine.MAX_BATCH_TASKS, result_cache_dir=None,
+              result_cache_max_bytes=result_cache.DEFAULT_MAX_BYTES, claim_size=STORE_CLAIM_SIZE, check=True,
+              postprocess=None, postprocess_workers=None, order="priority"):
+    """
+    Run the tasks of a SQLite task store (see task_store.py) until none are left to claim.
+    Tasks are claimed in chunks with a lease that is renewed while they run, so several runners
+    can share one store; each task is marked done or failed (retried up to the store's attempt
+    limit) as soon as its files are written.
+    Args:
+        store_path (str): Task database.
+        queue_file (str): Text queue file whose tasks are first moved into the store (optional).
+        done_file (str): Text file successful tasks are also appended to (optional).
+        claim_size (int): Number of tasks claimed at a time.
+        check (bool): Check all pending tasks with preflight.preflight() first; tasks no backend can run are marked as failed.
+        Other arguments: see batch_engine.run_queue().
+    Returns:
+        dict: Number of tasks in each state afterwards.
+    """
+    store = task_store.TaskStore(store_path)
+    if queue_file:
+        imported = store.import_file(queue_file)
+        if imported:
+            print(f"Imported {imported} task(s) from {queue_file}")
+
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(done_file or store_path)), "task_logs")
+    os.makedirs(log_dir, exist_ok=True)
+    clients = batch_engine.setup_run(in_process, backends, result_cache_dir, result_cache_max_bytes, postprocess, postprocess_workers)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    capable = {}
+    if check:
+        pending = store.tasks((task_store.PENDING,))
+        rejected = preflight.preflight([task for _, task in pending], clients, capable=capable)
+        preflight.report_rejected([task for _, task in pending], rejected)
+        store.reject([pending[position][0] for position in rejected])
+
+    # Keep the leases of the claimed tasks alive while they run
+    stop = threading.Event()
+    renewer = threading.Thread(target=renew_leases, args=(store, owner, stop), name="lease-renewer", daemon=True)
+    renewer.start()
+    done_lock = threading.Lock()
+    try:
+        while True:
+            claimed = store.claim(owner, claim_size)
+            if not claimed:
+                break
+            ids = [task_id for task_id, _, _ in claimed]
+
+            def on_done(position, task, success, ids=ids):
+                if not success:
+                    store.fail(ids[position], owner)
+                    return
+                store.complete(ids[position])
+                if done_file:
+                    with done_lock:
+                        with open(done_file, 'a', encoding='utf-8') as df:
+                            df.write(task + '\n')
+
+            def on_interrupt(positions, ids=ids):
+                # Tasks that never started go back to pending without using up an attempt
+                store.release([ids[position] for position in positions], owner)
+                if positions:
+                    task_output.report(f"{len(positions)} claimed task(s) not started were put back into the store.")
+
+            batch_engine.run_workers([task for _, task, _ in claimed], clients, in_process, max_batch, log_dir, on_done,
+                                     order, capable, [created for _, _, created in claimed], on_interrupt)
+    finally:
+        stop.set()
+        batch_engine.close_postprocessing()
+
+    counts = store.counts()
+    print("Tasks in store: " + ", ".join(f"{count} {state}" for state, count in counts.items()))
+    return counts
@@ -0,0 +1,224 @@
+# stub_forge_server.py
+#
+# Local fake of the Forge WebUI API endpoints used by this project (options, txt2img, progress,
+# sd-models, samplers, schedulers), for benchmarks and trying the scripts without a GPU. txt2img returns a
+# valid noise PNG of the requested size, or of a fixed size to control the payload size (random
+# pixels do not compress, so the payload size is close to a real render's). Changing the
+# checkpoint keeps the server busy for a configurable model-switch time.
+#
+# Usage:
+#   python stub_forge_server.py --port 7860 --latency 0.5 --switch-latency 5
+#
+#   import stub_forge_server
+#   with stub_forge_server.StubForgeServer(latency=0.1) as server:
+#       print(server.url)
+
+import argparse
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Checkpoints listed by /sdapi/v1/sd-models (the ones the model scripts use)
+MODELS = [
+    {"title": "flux1-schnell-bnb-nf4.safetensors [7d3d1873]", "model_name": "flux1-schnell-bnb-nf4",
+     "hash": "7d3d1873", "filename": "flux1-schnell-bnb-nf4.safetensors"},
+    {"title": "juggernautXL_v8Rundiffusion.safetensors", "model_name": "juggernautXL_v8Rundiffusion",
+     "hash": None, "filename": "juggernautXL_v8Rundiffusion.safetensors"},
+    {"title": "realisticStockPhoto_v20.safetensors [ac300751f3]", "model_name": "realisticStockPhoto_v20",
+     "hash": "ac300751f3", "filename": "realisticStockPhoto_v20.safetensors"},
+]
+
+# Samplers listed by /sdapi/v1/samplers
+SAMPLERS = ["Euler", "Euler a", "DPM++ 2M", "DPM++ 2M SDE", "DPM++ SDE", "DDIM", "UniPC"]
+
+# Schedulers listed by /sdapi/v1/schedulers (name, label)
+SCHEDULERS = [("automatic", "Automatic"), ("uniform", "Uniform"), ("karras", "Karras"), ("exponential", "Exponential"),
+              ("sgm_uniform", "SGM Uniform"), ("simple", "Simple"), ("beta", "Beta")]
+
+def make_png(width, height, seed=0):
+    """Return the bytes of an RGB noise PNG of the given size."""
+    rng = random.Random(seed)
+    row_size = width * 3
+    raw = b"".join(b"\x00" + rng.getrandbits(row_size * 8).to_bytes(row_size, "little") for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1))
+            + chunk(b"IEND", b""))
+
+class StubForgeServer:
+    """
+    Fake Forge WebUI server running in a background thread.
+    Args:
+        port (int): Port to listen on (0 picks a free port).
+        latency (float): Seconds each txt2img image takes to "generate".
+        switch_latency (float): Seconds the server stays busy after the checkpoint changes.
+        image_size (tuple): (width, height) of the returned images, instead of the requested size.
+        gpu_slots (int): Number of generations run at once, like Forge's queue (0: no limit).
+    """
+
+    def __init__(self, port=0, latency=0.0, switch_latency=0.0, image_size=None, gpu_slots=0):
+        self.latency = latency
+        self.gpu_slots = threading.Semaphore(gpu_slots) if gpu_slots else None
+        self.switch_latency = switch_latency
+        self.image_size = image_size
+        self.loaded_until = 0.0  # time.monotonic() at which the current model switch is done
+        self.model_switches = 0
+        self.options = {"sd_model_checkpoint": "", "sd_vae": "Automatic", "forge_additional_modules": []}
+        self.job_count = 0
+        self.requests = []  # (method, path) of every request received
+        self.lock = threading.Lock()
+        self._png_cache = {}
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def png_base64(self, width, height):
+        """Return (and cache) the base64 noise PNG for a size."""
+        key = (width, height)
+        if key not in self._png_cache:
+            self._png_cache[key] = base64.b64encode(make_png(width, height)).decode("ascii")
+        return self._png_cache[key]
+
+    def txt2img(self, payload):
+        """Build the txt2img response for a payload."""
+        count = max(1, int(payload.get("batch_size", 1))) * max(1, int(payload.get("n_iter", 1)))
+        seed = int(payload.get("seed", -1))
+        if seed == -1:
+            seed = random.randrange(2 ** 32)
+        seeds = [seed + i for i in range(count)]
+        if self.gpu_slots:
+            self.gpu_slots.acquire()
+        with self.lock:
+            self.job_count += 1
+        try:
+            # Wait for a model switch in progress, then "generate"
+            time.sleep(max(0.0, self.loaded_until - time.monotonic()) + self.latency * count)
+        finally:
+            with self.lock:
+                self.job_count -= 1
+            if self.gpu_slots:
+                self.gpu_slots.release()
+        width, height = self.image_size or (int(payload.get("width", 512)), int(payload.get("height", 512)))
+        image = self.png_base64(width, height)
+        info = {
+            "prompt": payload.get("prompt", ""),
+            "seed": seed,
+            "all_seeds": seeds,
+            "width": payload.get("width", 512),
+            "height": payload.get("height", 512),
+            "sd_model_name": self.options.get("sd_model_checkpoint"),
+            "infotexts": [f"{payload.get('prompt', '')}\nSteps: {payload.get('steps', 20)}, Seed: {s}" for s in seeds],
+        }
+        return {"images": [image] * count, "parameters": payload, "info": json.dumps(info)}
+
+    def set_options(self, options):
+        """Apply posted options; a checkpoint change keeps the server busy for switch_latency seconds."""
+        with self.lock:
+            checkpoint = options.get("sd_model_checkpoint")
+            if checkpoint is not None and checkpoint != self.options.get("sd_model_checkpoint"):
+                self.model_switches += 1
+                self.loaded_until = time.monotonic() + self.switch_latency
+            self.options.update(options)
+
+    def busy(self):
+        """Return the number of running jobs (a model switch in progress counts as one)."""
+        return self.job_count + (1 if time.monotonic() < self.loaded_until else 0)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                with server.lock:
+                    server.requests.append(("GET", path))
+                if path == "/sdapi/v1/options":
+                    self._send_json(server.options)
+                elif path == "/sdapi/v1/progress":
+                    busy = server.busy()
+                    self._send_json({"progress": 0.5 if busy else 0.0, "eta_relative": 0.0,
+                                     "state": {"job_count": busy}, "current_image": None})
+                elif path == "/sdapi/v1/sd-models":
+                    self._send_json(MODELS)
+                elif path == "/sdapi/v1/samplers":
+                    self._send_json([{"name": name, "aliases": [], "options": {}} for name in SAMPLERS])
+                elif path == "/sdapi/v1/schedulers":
+                    self._send_json([{"name": name, "label": label, "aliases": None} for name, label in SCHEDULERS])
+                else:
+                    self._send_json({"detail": "Not Found"}, 404)
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                with server.lock:
+                    server.requests.append(("POST", path))
+                payload = self._read_json()
+                if path == "/sdapi/v1/options":
+                    server.set_options(payload)
+                    self._send_json(None)
+                elif path == "/sdapi/v1/txt2img":
+                    self._send_json(server.txt2img(payload))
+                else:
+                    self._send_json({"detail": "Not Found"}, 404)
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Forge WebUI API server (no GPU needed).")
+    parser.add_argument('--port', type=int, default=7860, help="Port to listen on (default: 7860)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per generated image (default: 0)")
+    parser.add_argument('--switch-latency', type=float, default=0.0, help="Seconds a checkpoint change takes (default: 0)")
+    parser.add_argument('--image-size', help="Return images of this size (WIDTHxHEIGHT) instead of the requested size")
+    parser.add_argument('--gpu-slots', type=int, default=0,
+                        help="Generations run at once, later requests wait like in Forge's queue (default: no limit)")
+    args = parser.parse_args()
+    image_size = tuple(int(value) for value in args.image_size.lower().split("x")) if args.image_size else None
+    stub = StubForgeServer(args.port, args.latency, args.switch_latency, image_size, args.gpu_slots)
+    print(f"Stub Forge WebUI listening on {stub.url} (Ctrl+C to stop)")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        stub.httpd.server_close()
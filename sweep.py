@@ -0,0 +1,200 @@
+# sweep.py
+#
+# Parameter sweeps in queue lines and on the run_image_generation.py command line. A sweep value
+# lists several values for --width, --height, --steps, --cfg or --seed, as comma-separated values
+# and/or inclusive integer ranges:
+#   flux --prompt "a lighthouse" --steps 10,25,50,100 --seed 1000..1003 --output sweeps/lighthouse
+# A line is expanded into one task per combination (16 here). Each task writes to its own cell
+# of a directory grid below the line's --output, one level per swept option in the order
+# width, height, cfg, steps, seed (e.g. sweeps/lighthouse/steps-25/seed-1002), and carries
+# --sweep-root so an index.html contact sheet of the whole sweep is refreshed as images finish.
+# A sweep line without --output gets its own directory below sweeps/, named after a hash of the
+# line (so expanding the same line again reuses it).
+# Seeds vary fastest, so consecutive seeds land next to each other and are batched into one
+# request by the batch engine; all tasks of a sweep share one model setup.
+#
+# Usage:
+#   import sweep
+#   tasks = sweep.expand_task('flux --prompt "a cat" --seed 1..4 --output out')
+#   sweep.write_contact_sheet("out")
+
+import hashlib
+import html
+import itertools
+import os
+import shlex
+import threading
+
+# Options that accept sweep values, in grid directory order (outermost first), with their value type
+SWEEP_OPTIONS = [("--width", int), ("--height", int), ("--cfg", float), ("--steps", int), ("--seed", int)]
+
+# Name of the contact sheet written in the sweep's root directory
+CONTACT_SHEET = "index.html"
+
+# Directory of the sweeps that do not set --output
+DEFAULT_SWEEP_DIR = "sweeps"
+
+# Characters that require quoting when a task line is written back
+_SPECIAL = set(" \t\"'\\#")
+
+def parse_values(text, kind=int):
+    """
+    Parse a sweep value ("10,25,50", "1000..1007", "1..4,10") into a list of values.
+    Raises ValueError for invalid values, empty ranges and ranges of non-integers.
+    """
+    values = []
+    for item in text.split(","):
+        item = item.strip()
+        if ".." in item:
+            if kind is not int:
+                raise ValueError(f"Ranges are only supported for integer options: {text}")
+            start, _, end = item.partition("..")
+            start, end = int(start), int(end)
+            if end < start:
+                raise ValueError(f"Empty range: {item}")
+            values.extend(range(start, end + 1))
+        else:
+            values.append(kind(item))
+    return values
+
+def is_sweep_value(text):
+    return "," in text or ".." in text
+
+def quote(arg):
+    """Quote an argument for a queue line (parsed back with shlex.split)."""
+    if arg and not (_SPECIAL & set(arg)):
+        return arg
+    return '"' + arg.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _format(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+def default_root(argv):
+    """Return the sweep directory of an argument list without --output (see the top of this file)."""
+    digest = hashlib.sha1("\0".join(argv).encode("utf-8")).hexdigest()
+    return os.path.join(DEFAULT_SWEEP_DIR, digest[:10])
+
+def expand_argv(argv):
+    """
+    Expand a run_image_generation.py argument list with sweep values into one argument list per
+    combination (see the top of this file). Lists without sweep values are returned unchanged,
+    as the only item. Raises ValueError for invalid sweep values.
+    """
+    found = {}  # option -> (index of its value in argv, values)
+    for index, arg in enumerate(argv[:-1]):
+        for option, kind in SWEEP_OPTIONS:
+            if arg == option and is_sweep_value(argv[index + 1]):
+                found[option] = (index + 1, parse_values(argv[index + 1], kind))
+    if not found:
+        return [list(argv)]
+    axes = [option for option, _ in SWEEP_OPTIONS if option in found]
+    try:
+        output_index = len(argv) - 1 - argv[::-1].index("--output")
+        root = argv[output_index + 1]
+    except (ValueError, IndexError):
+        output_index, root = None, default_root(argv)
+    expanded = []
+    for combination in itertools.product(*(found[option][1] for option in axes)):
+        args = list(argv)
+        cell = []
+        for option, value in zip(axes, combination):
+            args[found[option][0]] = _format(value)
+            cell.append(f"{option[2:]}-{_format(value)}")
+        output = os.path.join(root, *cell)
+        if output_index is None:
+            args += ["--output", output]
+        else:
+            args[output_index + 1] = output
+        expanded.append(args + ["--sweep-root", root])
+    return expanded
+
+def expand_task(task):
+    """
+    Expand a queue line with sweep values into one queue line per combination.
+    Lines without sweep values (or that cannot be split) are returned unchanged, as the only item.
+    Raises ValueError for invalid sweep values.
+    """
+    try:
+        argv = shlex.split(task)
+    except ValueError:
+        return [task]
+    expanded = expand_argv(argv)
+    if len(expanded) == 1 and expanded[0] == argv:
+        return [task]
+    return [" ".join(quote(arg) for arg in args) for args in expanded]
+
+def expand_tasks(tasks):
+    """Expand the sweep lines of a list of queue lines; lines with invalid sweep values are kept as they are."""
+    expanded = []
+    for task in tasks:
+        try:
+            expanded.extend(expand_task(task))
+        except ValueError:
+            expanded.append(task)
+    return expanded
+
+def sweep_root(task):
+    """Return the --sweep-root of a queue line, or None."""
+    try:
+        argv = shlex.split(task)
+    except ValueError:
+        return None
+    if "--sweep-root" in argv[:-1]:
+        return argv[argv.index("--sweep-root") + 1]
+    return None
+
+def _cells(root):
+    """Return {cell path relative to root (tuple of directory names): newest image in it}."""
+    cells = {}
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        images = sorted((name for name in files if name.endswith(".png")),
+                        key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+        relative = os.path.relpath(directory, root)
+        parts = () if relative == "." else tuple(relative.split(os.sep))
+        if images and parts and all("-" in part for part in parts):
+            cells[parts] = images[-1]
+    return cells
+
+def _sort_key(part):
+    """Sort grid directory names ('steps-25') by their numeric value."""
+    name, _, value = part.partition("-")
+    try:
+        return (name, float(value), "")
+    except ValueError:
+        return (name, float("inf"), value)
+
+def write_contact_sheet(root):
+    """
+    Write (or refresh) the contact sheet of a sweep: an HTML table in root/index.html with one row
+    per combination of the outer options and one column per value of the innermost swept option.
+    Returns the path of the contact sheet, or None if the sweep has no images yet.
+    """
+    cells = _cells(root)
+    if not cells:
+        return None
+    rows = sorted({cell[:-1] for cell in cells}, key=lambda row: [_sort_key(part) for part in row])
+    columns = sorted({cell[-1] for cell in cells}, key=_sort_key)
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\">",
+             f"<title>Sweep {html.escape(os.path.basename(os.path.abspath(root)))}</title>",
+             "<style>body{font-family:sans-serif} td,th{padding:4px;text-align:center;vertical-align:top}"
+             " img{max-width:256px;max-height:256px}</style></head><body>",
+             f"<h1>{html.escape(os.path.abspath(root))}</h1>", "<table>",
+             "<tr><th></th>" + "".join(f"<th>{html.escape(column)}</th>" for column in columns) + "</tr>"]
+    for row in rows:
+        lines.append(f"<tr><th>{html.escape(' / '.join(row))}</th>")
+        for column in columns:
+            image = cells.get(row + (column,))
+            if image is None:
+                lines.append("<td>-</td>")
+                continue
+            link = html.escape("/".join(row + (column, image)))
+            lines.append(f"<td><a href=\"{link}\"><img src=\"{link}\" loading=\"lazy\"></a></td>")
+        lines.append("</tr>")
+    lines += ["</table>", "</body></html>"]
+    path = os.path.join(root, CONTACT_SHEET)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+    return path
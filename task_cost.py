@@ -0,0 +1,243 @@
+# task_cost.py
+#
+# Duration estimates of queued tasks, learned from the batch runner's timing records
+# (task_logs/timings.jsonl, see task_timing.py), for scheduling and for the ETA of a queue.
+# The generation time of a request (the generate and decode phases) grows with its work: steps x
+# width x height x images, in megapixel-steps. For each model profile, a line
+#   seconds = per-request overhead + seconds per megapixel-step x work
+# is fitted to its recent successful requests (least squares; through the origin when the
+# records do not spread enough). Profiles with too few records use the fit of all profiles, and
+# without any history the defaults below are used. The cost of loading a model is estimated
+# separately, as the average setup phase of the profile's records that waited for a model switch.
+#
+# The batch engine uses the estimates to order tasks shortest-first within a priority level
+# (--order sjf), to decide when sharing a model with another backend is worth a model switch,
+# and to print the ETA of a queue (see task_dispatch.TaskDispatcher).
+#
+# Usage:
+#   python task_cost.py [task_logs/timings.jsonl] [--queue image_tasks_new.txt] [--backends 2] [--max-batch 4]
+#
+#   import task_cost
+#   costs = task_cost.CostModel.from_file("task_logs/timings.jsonl")
+#   seconds = costs.estimate_task('flux --prompt "a cat" --steps 25 --width 1024 --height 768')
+#
+# A batched request (compatible tasks merged by the batch engine) pays the per-request overhead
+# once for all its images, so the dispatcher and queue_estimate() estimate the batches the queue
+# will actually run (see task_dispatch.planned_batches).
+
+import argparse
+import os
+import shlex
+import time
+from datetime import datetime
+
+import task_timing
+
+# Estimates without history: seconds per megapixel-step, per-request overhead and model switch
+DEFAULT_SECONDS_PER_WORK = 0.5
+DEFAULT_REQUEST_SECONDS = 2.0
+DEFAULT_SWITCH_SECONDS = 30.0
+
+# Profiles with fewer successful records use the fit of all profiles
+MIN_RECORDS = 3
+
+# Only the most recent records are used (hardware and server settings change)
+MAX_RECORDS = 5000
+
+# Key of the fit of all profiles
+ALL_MODELS = "*"
+
+def task_work(steps, width, height, images=1):
+    """Return the work of a request in megapixel-steps."""
+    return steps * width * height * images / 1e6
+
+def fit_line(points):
+    """
+    Fit seconds = intercept + slope x work to (work, seconds) points by least squares.
+    Returns (intercept, slope), both non-negative; falls back to a line through the origin when
+    the work values do not spread enough. Returns None without points.
+    """
+    points = [(x, y) for x, y in points if x > 0]
+    if not points:
+        return None
+    n = len(points)
+    sx = sum(x for x, _ in points)
+    sy = sum(y for _, y in points)
+    sxx = sum(x * x for x, _ in points)
+    sxy = sum(x * y for x, y in points)
+    denominator = n * sxx - sx * sx
+    if n >= 2 and denominator > 1e-9 * sxx * n:
+        slope = (n * sxy - sx * sy) / denominator
+        intercept = (sy - slope * sx) / n
+        if slope > 0 and intercept >= 0:
+            return intercept, slope
+    return 0.0, sy / sx
+
+def _generation_seconds(record):
+    """Return the generation time of a timing record (generate and decode phases), or None."""
+    phases = record.get("phases") or {}
+    if "generate" not in phases:
+        return None
+    return phases["generate"] + phases.get("decode", 0.0)
+
+class CostModel:
+    """
+    Duration estimates per model profile (see the top of this file).
+    Args:
+        fits (dict): Profile name (or ALL_MODELS) -> (per-request seconds, seconds per megapixel-step).
+        switch (dict): Profile name (or ALL_MODELS) -> seconds to load the model.
+        samples (dict): Profile name -> number of records its fit is based on.
+    """
+
+    def __init__(self, fits=None, switch=None, samples=None):
+        self.fits = fits or {}
+        self.switch = switch or {}
+        self.samples = samples or {}
+
+    @classmethod
+    def from_records(cls, records):
+        """Fit a cost model to timing records (see task_timing.py)."""
+        points = {}
+        setups = {}
+        for record in records[-MAX_RECORDS:]:
+            if not record.get("success") or record.get("mode") == "cache":
+                continue
+            model = record.get("model")
+            phases = record.get("phases") or {}
+            # Setups without a model_wait phase found the model already loaded
+            if "setup" in phases and "model_wait" in phases:
+                setups.setdefault(model, []).append(phases["setup"])
+                setups.setdefault(ALL_MODELS, []).append(phases["setup"])
+            seconds = _generation_seconds(record)
+            try:
+                work = task_work(record["steps"], record["width"], record["height"], record.get("images", 1))
+            except (KeyError, TypeError):
+                continue
+            if seconds is None:
+                continue
+            points.setdefault(model, []).append((work, seconds))
+            points.setdefault(ALL_MODELS, []).append((work, seconds))
+        fits = {}
+        for model, model_points in points.items():
+            if len(model_points) >= MIN_RECORDS or model == ALL_MODELS:
+                fit = fit_line(model_points)
+                if fit is not None:
+                    fits[model] = fit
+        switch = {model: sum(values) / len(values) for model, values in setups.items()}
+        return cls(fits, switch, {model: len(model_points) for model, model_points in points.items()})
+
+    @classmethod
+    def from_file(cls, path):
+        """Fit a cost model to a timings file; a missing file gives the defaults."""
+        try:
+            return cls.from_records(task_timing.read_records(path))
+        except OSError:
+            return cls()
+
+    def fit(self, model):
+        """Return (per-request seconds, seconds per megapixel-step) of a profile."""
+        return self.fits.get(model) or self.fits.get(ALL_MODELS) or (DEFAULT_REQUEST_SECONDS, DEFAULT_SECONDS_PER_WORK)
+
+    def estimate(self, model, steps, width, height, images=1):
+        """Return the estimated generation seconds of a request."""
+        intercept, slope = self.fit(model)
+        return intercept + slope * task_work(steps, width, height, images)
+
+    def estimate_task(self, task, images=1):
+        """
+        Return the estimated generation seconds of a queue line run as one request of `images`
+        images (the defaults' estimate if it does not parse).
+        """
+        import run_image_generation
+        try:
+            args = run_image_generation.parse_task(task)
+        except ValueError:
+            return DEFAULT_REQUEST_SECONDS
+        return self.estimate(args.script, args.steps, args.width, args.height, images)
+
+    def switch_seconds(self, model):
+        """Return the estimated seconds to load a profile's model."""
+        return self.switch.get(model, self.switch.get(ALL_MODELS, DEFAULT_SWITCH_SECONDS))
+
+def task_profile(task):
+    """Return the profile name of a queue line (its first argument)."""
+    try:
+        parts = shlex.split(task)
+    except ValueError:
+        parts = task.split()
+    return parts[0] if parts else ""
+
+def format_duration(seconds):
+    """Format a duration as '1 h 05 min', '12 min' or '40 s'."""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+    if seconds >= 60:
+        return f"{seconds // 60} min"
+    return f"{seconds} s"
+
+def format_eta(seconds, now=None):
+    """Format the time of day a duration from now ends, e.g. '14:05 (in 1 h 05 min)'."""
+    end = datetime.fromtimestamp((time.time() if now is None else now) + seconds)
+    return f"{end.strftime('%H:%M')} (in {format_duration(seconds)})"
+
+def queue_estimate(costs, tasks, backends=1, max_batch=1):
+    """
+    Return (generation seconds, model switch seconds, wall seconds) of a list of queue lines run
+    on `backends` servers with up to max_batch compatible tasks per request, assuming one load
+    per model and work spread evenly over the servers.
+    """
+    import run_image_generation
+    import task_dispatch
+    generation = 0.0
+    parsed = []
+    for task in tasks:
+        try:
+            parsed.append(run_image_generation.parse_task(task))
+        except ValueError:
+            generation += DEFAULT_REQUEST_SECONDS
+    for batch in task_dispatch.planned_batches(parsed, max_batch):
+        args = parsed[batch[0]]
+        generation += costs.estimate(args.script, args.steps, args.width, args.height, len(batch))
+    switches = sum(costs.switch_seconds(model) for model in {task_profile(task) for task in tasks})
+    return generation, switches, (generation + switches) / max(1, backends)
+
+if __name__ == "__main__":
+    import batch_engine
+
+    parser = argparse.ArgumentParser(description="Show the task duration model fitted to the batch runner's timings.")
+    parser.add_argument('file', nargs='?', default=os.path.join("task_logs", task_timing.TIMINGS_FILE),
+                        help=f"Timings file (default: task_logs/{task_timing.TIMINGS_FILE})")
+    parser.add_argument('--queue', help='Also estimate the duration of this queue file')
+    parser.add_argument('--backends', type=int, default=1, help='Servers the queue runs on (default: 1)')
+    parser.add_argument('--max-batch', type=int, default=batch_engine.MAX_BATCH_TASKS,
+                        help=f'Compatible tasks merged into one request, as in the batch runner (default: {batch_engine.MAX_BATCH_TASKS})')
+    args = parser.parse_args()
+
+    costs = CostModel.from_file(args.file)
+    try:
+        records = task_timing.read_records(args.file)
+    except OSError:
+        records = []
+    print(f"{'model':<12} {'records':>8} {'s/request':>10} {'s/MP-step':>10} {'switch s':>9}")
+    for model in sorted(set(costs.samples) | set(costs.fits), key=lambda name: (name == ALL_MODELS, name)):
+        intercept, slope = costs.fit(model)
+        fitted = "" if model in costs.fits else " (uses the fit of all models)"
+        print(f"{model:<12} {costs.samples.get(model, 0):>8} {intercept:>10.2f} {slope:>10.3f} "
+              f"{costs.switch_seconds(model):>9.1f}{fitted}")
+    if not costs.fits:
+        print("No timing records yet: using the default estimates.")
+    # Accuracy of the estimates made when the tasks ran
+    errors = []
+    for record in records:
+        seconds = _generation_seconds(record)
+        if record.get("success") and record.get("estimate") is not None and seconds:
+            errors.append(abs(record["estimate"] - seconds) / seconds)
+    if errors:
+        print(f"Estimates made during runs: median error {task_timing.percentile(errors, 50):.0%} "
+              f"over {len(errors)} request(s)")
+    if args.queue:
+        tasks = batch_engine.read_queue(args.queue)
+        generation, switches, wall = queue_estimate(costs, tasks, args.backends, args.max_batch)
+        print(f"\n{len(tasks)} task(s): {format_duration(generation)} of generation and {format_duration(switches)} "
+              f"of model loading on {args.backends} backend(s); ETA {format_eta(wall)}")
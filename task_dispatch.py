@@ -0,0 +1,524 @@
+# task_dispatch.py
+#
+# Dispatching of queued tasks to the backend workers of the batch engine (see batch_engine.py).
+# Each WebUI server gets a worker thread that remembers which model it has loaded, and tasks are
+# dispatched with model affinity: a worker keeps taking tasks for its loaded model, and idle
+# workers pick models no other worker has loaded. Profiles that need the same model state on the
+# server (see ModelProfile.switch_key) count as one model.
+# Urgent tasks (see task_priority.py) interrupt a long sweep of another model at the next task,
+# a model is only loaded on a second server when its remaining work is worth the switch (see
+# task_cost.py), and compatible tasks (same settings, consecutive or random seeds) are handed out
+# together to run as one batched request.
+#
+# Usage:
+#   import task_dispatch
+#   dispatcher = task_dispatch.TaskDispatcher(tasks, max_batch=4)
+#   workers = batch_engine.make_workers(clients, dispatcher, True, "task_logs", on_done)
+
+import os
+import shlex
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import image_io
+import model_profiles
+import run_image_generation
+import sweep
+import task_cost
+import task_output
+import task_priority
+import task_timing
+
+# Directory of the scripts; relative sweep directories are resolved against it
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def task_model(task):
+    """
+    Return the model key of a queue line: the model state its profile needs on the server
+    (profiles with the same checkpoint, VAE and modules share it), or the first argument of
+    lines with an unknown profile.
+    """
+    try:
+        parts = shlex.split(task)
+    except ValueError:
+        parts = task.split()
+    name = parts[0] if parts else ""
+    try:
+        return model_profiles.get_profile(name).switch_key()
+    except KeyError:
+        return name
+
+def group_tasks_by_model(tasks):
+    """
+    Reorder tasks so that all tasks for the same model run back to back.
+    Groups keep the order in which their model first appears in the queue,
+    and tasks keep their queue order inside each group.
+    Returns a list of (queue_position, task) pairs.
+    """
+    groups = {}
+    for position, task in enumerate(tasks):
+        groups.setdefault(task_model(task), []).append((position, task))
+    return [item for group in groups.values() for item in group]
+
+def batch_key(args):
+    """Return the key of the settings that must be equal for tasks to share a txt2img request."""
+    return (args.script, args.prompt, args.negative or "", args.width, args.height, args.steps, args.cfg)
+
+def can_join_batch(batch, args):
+    """
+    Return True if a task can be added to a batch of parsed tasks.
+    The API gives the images of a batch the seeds seed, seed+1, ..., so tasks must either all use
+    a random seed (-1) or have consecutive seeds in batch order.
+    """
+    first = batch[0]
+    if batch_key(args) != batch_key(first):
+        return False
+    if first.seed == -1:
+        return args.seed == -1
+    return args.seed == first.seed + len(batch)
+
+def planned_batches(args_list, max_batch):
+    """
+    Return how parsed tasks would be merged into batched requests, as lists of indexes into
+    args_list: compatible tasks with consecutive (or random) seeds, up to max_batch per request
+    (see can_join_batch). Used to estimate durations (see task_cost.py).
+    """
+    groups = {}
+    for index, args in enumerate(args_list):
+        groups.setdefault((batch_key(args), args.seed == -1), []).append(index)
+    batches = []
+    for (_, random_seed), indexes in groups.items():
+        if not random_seed:
+            indexes.sort(key=lambda index: args_list[index].seed)
+        batch = []
+        for index in indexes:
+            if batch and (len(batch) >= max_batch
+                          or not random_seed and args_list[index].seed != args_list[batch[-1]].seed + 1):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        batches.append(batch)
+    return batches
+
+def is_batch(items):
+    """Return True if (task_number, position, task) items can still run as one batch, in this order."""
+    try:
+        parsed = [run_image_generation.parse_task(task) for _, _, task in items]
+    except ValueError:
+        return False
+    return all(can_join_batch(parsed[:index], args) for index, args in enumerate(parsed) if index)
+
+def update_contact_sheets(tasks):
+    """Refresh the contact sheets of the sweeps the tasks belong to."""
+    for root in {sweep.sweep_root(task) for task in tasks} - {None}:
+        try:
+            sweep.write_contact_sheet(root if os.path.isabs(root) else os.path.join(BASE_DIR, root))
+        except OSError as e:
+            task_output.report(f"Could not write the contact sheet of {root}: {e}")
+
+class TaskDispatcher:
+    """
+    Hands out queued tasks to backend workers by priority, with model affinity.
+    A worker first gets more tasks for the model it already has loaded, unless another model has
+    a task at least task_priority.SWITCH_MARGIN levels more urgent (priority lane, waiting time
+    and deadline, see task_priority.py); otherwise it gets the most urgent model that no other
+    worker has loaded, so each model is loaded on as few servers as possible. A model already
+    loaded elsewhere is shared only if it still has at least as many pending tasks as there are
+    workers serving it plus one and, with a cost model, an estimated share of its remaining work
+    per worker longer than loading the model takes. Within a model, the most urgent task runs
+    first; with order "sjf", the shortest of the most urgent priority level (see task_priority.py).
+    A worker is only given the tasks its server can run (see preflight.py).
+    With keep_open, tasks can be added while the workers run (see image_task_daemon.py).
+    Args:
+        costs (task_cost.CostModel): Duration estimates, for the ETA, model sharing and "sjf" (optional).
+        order (str): Order within a model (see task_priority.ORDERS).
+        capable (dict): Queue line -> names of the only workers (server base URLs) that can run it, as
+            filled by preflight.preflight(); other tasks run on any worker. Looked up when a task is added.
+    """
+
+    def __init__(self, tasks, max_batch=1, enqueued=None, keep_open=False, costs=None, order="priority",
+                 capable=None):
+        self.lock = threading.Condition()
+        self.max_batch = max_batch
+        self.keep_open = keep_open  # Workers wait for added tasks instead of stopping (until close())
+        self.groups = {}  # model -> deque of (queue_position, task), in first-appearance order
+        self.schedule = {}  # queue_position -> (priority, deadline, enqueued time)
+        self.parsed = {}  # queue_position -> parsed arguments (only needed for batching and estimates)
+        self.costs = costs
+        self.order = order
+        self.capable = capable if capable is not None else {}
+        self.only = {}  # queue_position -> workers that can run the task (absent: any worker)
+        self.estimates = {}  # queue_position -> estimated generation seconds (with a cost model)
+        self.switch_costs = {}  # model -> estimated seconds to load it (with a cost model)
+        self.running = {}  # queue_position -> (start time, estimated seconds) of the tasks handed out and not finished
+        self.loaded = {}  # worker name -> model loaded on that worker (None if unknown)
+        self.total = 0
+        self.started = 0
+        self.add(tasks, enqueued)
+
+    def add(self, tasks, enqueued=None):
+        """
+        Queue tasks after the existing ones and wake waiting workers.
+        Args:
+            tasks (list): Queue lines.
+            enqueued (list): Timestamps the tasks were queued, for priority aging (default: now).
+        Returns:
+            list: Queue positions of the tasks.
+        """
+        now = time.time()
+        with self.lock:
+            positions = []
+            for index, task in enumerate(tasks):
+                position = self.total
+                self.total += 1
+                self.groups.setdefault(task_model(task), deque()).append((position, task))
+                self.schedule[position] = task_priority.task_schedule(task) + (enqueued[index] if enqueued else now,)
+                if task in self.capable:
+                    self.only[position] = self.capable[task]
+                if self.max_batch > 1 or self.costs is not None:
+                    try:
+                        self.parsed[position] = run_image_generation.parse_task(task)
+                    except ValueError:
+                        pass
+                if self.costs is not None:
+                    self.switch_costs.setdefault(task_model(task), self.costs.switch_seconds(task_cost.task_profile(task)))
+                positions.append(position)
+            if self.costs is not None:
+                self._update_estimates()
+            self.lock.notify_all()
+            return positions
+
+    def _update_estimates(self):
+        """
+        Estimate the tasks not handed out yet, with compatible tasks merged into batched requests as
+        they will run (see planned_batches): the tasks of a batch share its estimate.
+        """
+        waiting = [position for group in self.groups.values() for position, _ in group]
+        parsed = [position for position in waiting if position in self.parsed]
+        for position in waiting:
+            if position not in self.parsed:
+                self.estimates[position] = task_cost.DEFAULT_REQUEST_SECONDS
+        for batch in planned_batches([self.parsed[position] for position in parsed], self.max_batch):
+            args = self.parsed[parsed[batch[0]]]
+            seconds = self.costs.estimate(args.script, args.steps, args.width, args.height, len(batch))
+            for index in batch:
+                self.estimates[parsed[index]] = seconds / len(batch)
+
+    def pending(self):
+        """Return the number of tasks not handed out yet."""
+        with self.lock:
+            return sum(len(group) for group in self.groups.values())
+
+    def remaining_seconds(self):
+        """
+        Return the estimated seconds until the queued tasks are done: the generation time of the
+        tasks not handed out yet and the rest of the running ones, plus loading the models no worker
+        has loaded, spread over the workers (None without a cost model).
+        """
+        with self.lock:
+            if self.costs is None:
+                return None
+            now = time.time()
+            loaded = set(self.loaded.values())
+            seconds = sum(self.estimates.get(position, 0.0) for group in self.groups.values() for position, _ in group)
+            seconds += sum(max(0.0, estimate - (now - started)) for started, estimate in self.running.values())
+            seconds += sum(self.switch_costs.get(model, 0.0) for model, group in self.groups.items()
+                           if group and model not in loaded)
+            return seconds / max(1, len(self.loaded))
+
+    def eta_note(self):
+        """Return ', queue ETA ...' for progress messages, or '' without a cost model."""
+        seconds = self.remaining_seconds()
+        return "" if seconds is None else f", queue ETA {task_cost.format_eta(seconds)}"
+
+    def finished(self, positions):
+        """Record that the tasks at the given queue positions are no longer running."""
+        with self.lock:
+            for position in positions:
+                self.running.pop(position, None)
+
+    def close(self):
+        """Stop handing out tasks (waiting workers stop); return the (position, task) pairs never started."""
+        with self.lock:
+            self.keep_open = False
+            left = sorted(item for group in self.groups.values() for item in group)
+            self.groups.clear()
+            self.lock.notify_all()
+            return left
+
+    def next_tasks(self, worker):
+        """
+        Return the next tasks for the worker as a list of (task_number, position, task):
+        one task, or several compatible tasks to run as one batched request.
+        Returns an empty list when the worker should stop (with keep_open, waits for tasks until close()).
+        """
+        with self.lock:
+            while True:
+                now = time.time()
+                model = self._choose_model(worker, now)
+                if model is not None:
+                    break
+                if not self.keep_open:
+                    self.loaded.pop(worker, None)
+                    return []
+                self.lock.wait()
+            group = self.groups[model]
+            first = min((item for item in group if self._can_run(worker, item[0])),
+                        key=lambda item: self._key(item[0], now))
+            group.remove(first)
+            items = [first]
+            batch = [self.parsed[first[0]]] if first[0] in self.parsed else None
+            while batch and len(items) < self.max_batch:
+                match = next((item for item in group if item[0] in self.parsed and self._can_run(worker, item[0])
+                              and can_join_batch(batch, self.parsed[item[0]])), None)
+                if match is None:
+                    break
+                group.remove(match)
+                items.append(match)
+                batch.append(self.parsed[match[0]])
+            numbered = []
+            for position, task in items:
+                self.started += 1
+                numbered.append((self.started, position, task))
+                if self.costs is not None:
+                    self.running[position] = (now, self.estimates.get(position, 0.0))
+                self.only.pop(position, None)
+            return numbered
+
+    def _can_run(self, worker, position):
+        only = self.only.get(position)
+        return only is None or worker in only
+
+    def _key(self, position, now):
+        priority, deadline, enqueued = self.schedule[position]
+        if self.order == "sjf":
+            return task_priority.shortest_first_key(priority, deadline, enqueued, now, position,
+                                                    self.estimates.get(position, 0.0))
+        return task_priority.sort_key(priority, deadline, enqueued, now, position)
+
+    def _worth_sharing(self, model, serving):
+        """Return True if another worker should also load a model that `serving` workers have loaded."""
+        group = self.groups[model]
+        if len(group) <= serving:
+            return False
+        if self.costs is None:
+            return True
+        work = sum(self.estimates.get(position, 0.0) for position, _ in group)
+        return work / (serving + 1) > self.switch_costs.get(model, 0.0)
+
+    def _choose_model(self, worker, now):
+        """Pick the model a worker runs next (see the class docstring); None when nothing is left."""
+        # Most urgent task of each model with pending tasks this worker can run
+        tops = {}
+        for model, group in self.groups.items():
+            keys = [self._key(position, now) for position, _ in group if self._can_run(worker, position)]
+            if keys:
+                tops[model] = min(keys)
+        if not tops:
+            return None
+        ranked = sorted(tops, key=tops.get)
+        loaded = self.loaded.get(worker)
+        if loaded in tops:
+            # tops hold negated effective priorities: stay unless another model is SWITCH_MARGIN more urgent
+            ranked = [model for model in ranked if tops[loaded][0] - tops[model][0] >= task_priority.SWITCH_MARGIN]
+            if not ranked:
+                return loaded
+        serving = {}
+        for name, model in self.loaded.items():
+            if name != worker and model is not None:
+                serving[model] = serving.get(model, 0) + 1
+        for model in ranked:
+            if model not in serving:
+                return model
+        for model in ranked:
+            if self._worth_sharing(model, serving[model]):
+                return model
+        return loaded if loaded in tops else None
+
+    def set_loaded(self, worker, model):
+        """Record which model a worker has loaded (None when unknown after a failure)."""
+        with self.lock:
+            self.loaded[worker] = model
+            self.lock.notify_all()  # Waiting workers may now share a model this worker left
+
+class BackendWorker(threading.Thread):
+    """
+    Worker thread running queued tasks against one WebUI server.
+    Args:
+        client (webui_client.WebUIClient): Client of the server.
+        dispatcher (TaskDispatcher): Hands out the tasks.
+        run_task (callable): Runs one queue line: run_task(task, skip_setup, client) -> (success, stdout, stderr).
+        log_dir (str): Directory of the task logs and timings.
+        on_done (callable): Called as on_done(position, task, success) once a task's files are written.
+        run_tasks (callable): Runs compatible queue lines as one request in this process, like run_task with
+            a list of tasks (None when tasks run in subprocesses, which are never batched).
+        restore (callable): Serves a task (parsed arguments) from the result cache; returns True on a hit
+            (None without a result cache).
+    """
+
+    def __init__(self, client, dispatcher, run_task, log_dir, on_done, run_tasks=None, restore=None):
+        super().__init__(name=client.base_url, daemon=True)
+        self.client = client
+        self.dispatcher = dispatcher
+        self.run_task = run_task
+        self.run_tasks = run_tasks
+        self.restore = restore
+        self.log_dir = log_dir
+        self.on_done = on_done
+        self.loaded_model = None  # Model known to be loaded after the last successful task
+        self.dispatcher.set_loaded(self.name, None)
+
+    def run(self):
+        while True:
+            items = self.dispatcher.next_tasks(self.name)
+            if not items:
+                return
+            results = {}  # queue_position -> success
+            self.timers = []
+            writer = image_io.get_writer()
+            writer.take_opened_files()
+            try:
+                pending = self.serve_from_cache(items, results)
+                if self.run_tasks is not None and len(pending) > 1 and is_batch(pending):
+                    results.update(self.run_batch(pending))
+                else:
+                    for idx, position, task in pending:
+                        results[position] = self.run_one(idx, task)
+            finally:
+                # Always account for the tasks, so they are never dropped from the queue.
+                # Their files are still being written in the background, so the tasks are only
+                # recorded as done once they have been written without errors.
+                self.dispatcher.finished([position for _, position, _ in items])
+                self.dispatcher.set_loaded(self.name, self.loaded_model)
+                files = writer.take_opened_files()
+
+                def finish(items=items, results=results, files=files, timers=self.timers):
+                    written = self._files_written(files)
+                    self._write_timings(timers, written)
+                    for idx, position, task in items:
+                        self.on_done(position, task, results.get(position, False) and written)
+                    update_contact_sheets([task for _, position, task in items if results.get(position)])
+
+                writer.when_written(finish)
+
+    def serve_from_cache(self, items, results):
+        """Complete the tasks whose results are cached (recorded in results); return the other items."""
+        if self.restore is None:
+            return items
+        pending = []
+        for idx, position, task in items:
+            hits = []
+            timer = self._start_timer(task, mode="cache")
+            with task_timing.phase("cache"):
+                success, stdout, stderr = task_output.run_captured(
+                    lambda: hits.append(self.restore(run_image_generation.parse_task(task))))
+            hit = success and hits[0]
+            self._stop_timer(timer, hit)
+            if hit:
+                log_file = os.path.join(self.log_dir, f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{idx}.log")
+                task_output.write_task_log(log_file, task, stdout, stderr)
+                task_output.report(f"\n[Task {idx}/{self.dispatcher.total}] Served from cache: {task}\nLog: {log_file}")
+                results[position] = True
+            else:
+                self.timers.remove(timer)  # A miss is timed as part of its generation
+                pending.append((idx, position, task))
+        return pending
+
+    def _start_timer(self, task, **fields):
+        """Start timing a task (or batch) on this thread, with its model and size when the line parses."""
+        parsed = []
+        # Parse with the output captured, so invalid lines do not print their usage error twice
+        task_output.run_captured(lambda: parsed.append(run_image_generation.parse_task(task)))
+        if parsed:
+            args = parsed[0]
+            fields = dict(model=args.script, width=args.width, height=args.height, steps=args.steps,
+                          priority=args.priority, **fields)
+            if args.deadline is not None:
+                fields["deadline"] = datetime.fromtimestamp(args.deadline).isoformat()
+            if self.dispatcher.costs is not None and fields.get("mode") != "cache":
+                # Recorded to check the estimates against the measured generation time (see task_cost.py)
+                fields["estimate"] = round(self.dispatcher.costs.estimate(args.script, args.steps, args.width, args.height,
+                                                                          fields.get("tasks", 1)), 2)
+        else:
+            fields = dict(model=task_model(task), **fields)
+        fields.setdefault("task", task)
+        fields.setdefault("tasks", 1)
+        fields.setdefault("images", fields["tasks"])
+        timer = task_timing.start(backend=self.name, **fields)
+        self.timers.append(timer)
+        return timer
+
+    def _stop_timer(self, timer, success):
+        fields = {"success": success}
+        if "deadline" in timer.fields:
+            fields["late"] = datetime.now() > datetime.fromisoformat(timer.fields["deadline"])
+            if fields["late"] and success:
+                task_output.report(f"Task finished after its deadline ({timer.fields['deadline']}): {timer.fields['task']}")
+        timer.stop(**fields)
+        task_timing.clear()
+
+    def _write_timings(self, timers, written):
+        """Write the timing records of finished tasks, with the time spent waiting for their files."""
+        path = os.path.join(self.log_dir, task_timing.TIMINGS_FILE)
+        for timer in timers:
+            if timer.end is not None:
+                timer.add("write", time.perf_counter() - timer.end)
+            try:
+                task_timing.write_record(path, timer.record(success=timer.fields.get("success", False) and written))
+            except OSError as e:
+                task_output.report(f"Could not write timings: {e}")
+
+    def _files_written(self, files):
+        """Return True if all files were written; report the ones that failed."""
+        failed = [f for f in files if f.error is not None]
+        for f in failed:
+            task_output.report(f"Failed to write {f.path}: {f.error}. Task will stay in queue.")
+        return not failed
+
+    def run_one(self, idx, task):
+        """Run one task on this worker's backend and return True if it succeeded."""
+        model = task_model(task)
+        task_output.report(f"\n[Task {idx}/{self.dispatcher.total}] Running on {self.name}{self.dispatcher.eta_note()}: {task}")
+        # Log file for this task, timestamped for uniqueness
+        log_file = os.path.join(self.log_dir, f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{idx}.log")
+        timer = self._start_timer(task, mode="subprocess" if self.run_tasks is None else "process")
+        try:
+            # Skip the model setup when the previous task already loaded this model
+            success, stdout, stderr = self.run_task(task, skip_setup=(model == self.loaded_model), client=self.client)
+            task_output.write_task_log(log_file, task, stdout, stderr)
+        except Exception as e:
+            task_output.report(f"Exception running task: {e}")
+            success = False
+        self._stop_timer(timer, success)
+        if success:
+            task_output.report(f"Task succeeded. Log: {log_file}")
+            self.loaded_model = model
+        else:
+            task_output.report(f"Task failed (see log). Will keep in queue. Log: {log_file}")
+            self.loaded_model = None  # The server state is unknown after a failure
+        return success
+
+    def run_batch(self, items):
+        """
+        Run compatible tasks as one batched request on this worker's backend.
+        If the batch fails, its tasks are run one by one. Returns {queue_position: success}.
+        """
+        tasks = [task for _, _, task in items]
+        model = task_model(tasks[0])
+        first_idx = items[0][0]
+        task_output.report(f"\n[Tasks {first_idx}-{items[-1][0]}/{self.dispatcher.total}] "
+                f"Running {len(items)} tasks as one batch on {self.name}{self.dispatcher.eta_note()}: {tasks[0]}")
+        log_file = os.path.join(self.log_dir, f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{first_idx}_batch.log")
+        timer = self._start_timer(tasks[0], tasks=len(tasks), mode="batch")
+        success, stdout, stderr = self.run_tasks(tasks, skip_setup=(model == self.loaded_model), client=self.client)
+        self._stop_timer(timer, success)
+        task_output.write_task_log(log_file, "\n".join(tasks), stdout, stderr)
+        if success:
+            task_output.report(f"Batch succeeded. Log: {log_file}")
+            self.loaded_model = model
+            return {position: True for _, position, _ in items}
+        task_output.report(f"Batch failed (see log); running its tasks one by one. Log: {log_file}")
+        self.loaded_model = None
+        return {position: self.run_one(idx, task) for idx, position, task in items}
@@ -0,0 +1,83 @@
+# task_output.py
+#
+# Console output of tasks run by the batch engine's worker threads. While a task runs, everything
+# it prints goes to a buffer of its own thread (run_captured), so tasks running in parallel get
+# separate task_logs/ files (write_task_log); progress messages for the console go through
+# report(), which never interleaves them with other threads.
+#
+# Usage:
+#   import task_output
+#   success, stdout, stderr = task_output.run_captured(lambda: print("hello"))
+#   task_output.report("Task succeeded.")
+
+import io
+import sys
+import threading
+import traceback
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout/sys.stderr that sends writes to a per-thread buffer while a task
+    is being captured on that thread, and to the original stream otherwise.
+    This keeps the output of tasks running in parallel worker threads in separate logs.
+    Limits: it is installed process-wide (once, see _install_thread_output) and never removed, so
+    an embedding application that replaces sys.stdout afterwards bypasses the capture, and output
+    written through the original stream objects or file descriptors (C extensions, subprocesses,
+    logging handlers created before the run) is not captured. Progress messages meant for the
+    console go through report() while no task is captured on the calling thread.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+_capture_lock = threading.Lock()
+
+def _install_thread_output():
+    """Replace sys.stdout/sys.stderr with per-thread capturing streams (once)."""
+    with _capture_lock:
+        if not isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = _ThreadOutput(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadOutput):
+            sys.stderr = _ThreadOutput(sys.stderr)
+
+def run_captured(func):
+    """Call func() capturing this thread's output; return (success, stdout_text, stderr_text)."""
+    _install_thread_output()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    sys.stdout.local.buffer, sys.stderr.local.buffer = stdout, stderr
+    success = False
+    try:
+        func()
+        success = True
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.local.buffer = sys.stderr.local.buffer = None
+    return success, stdout.getvalue(), stderr.getvalue()
+
+_print_lock = threading.Lock()
+
+def report(message):
+    """Print a progress message without interleaving it with other worker threads."""
+    with _print_lock:
+        print(message, flush=True)
+
+def write_task_log(log_file, task, stdout, stderr):
+    """Write the captured output of a task to its log file."""
+    with open(log_file, 'w', encoding='utf-8') as lf:
+        lf.write(f"TASK: {task}\n\n")
+        lf.write(f"STDOUT:\n{stdout}\n\nSTDERR:\n{stderr}\n")
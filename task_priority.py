@@ -0,0 +1,120 @@
+# task_priority.py
+#
+# Priorities and deadlines of queued tasks, used by the batch engine and the task store to pick
+# the task that runs next. Queue lines can carry two scheduling options (ignored by the
+# generation itself):
+#   --priority N      priority lane; higher runs first (default 0, e.g. 10 for urgent single images)
+#   --deadline TIME   when the image is needed: ISO date/time ("2025-06-21T18:00") or a time
+#                     today ("18:00")
+#
+# The effective priority of a waiting task is its lane, plus one level for every AGING_SECONDS it
+# has waited (so low-priority work is never starved by a stream of urgent tasks), plus up to
+# DEADLINE_BOOST levels as its deadline comes within DEADLINE_LEAD_SECONDS. Tasks are ordered by
+# effective priority, then by deadline (earliest first), then in queue order.
+#
+# A worker keeps taking tasks for the model it has loaded unless another model has a task at
+# least SWITCH_MARGIN levels more urgent, so a higher lane interrupts a long sweep at the next
+# task while tasks of the same lane stay grouped by model (no extra checkpoint reloads).
+#
+# With the "sjf" order (--order sjf), tasks of the same whole priority level run shortest first,
+# by their estimated duration (see task_cost.py), then by deadline: many short tasks finish
+# sooner on average and a long 100-step run no longer holds up quick previews queued after it.
+#
+# Usage:
+#   import task_priority
+#   priority, deadline = task_priority.task_schedule('flux --prompt "a cat" --priority 5 --deadline 18:00')
+#   key = task_priority.sort_key(priority, deadline, enqueued=time.time(), now=time.time(), position=0)
+#   key = task_priority.shortest_first_key(priority, deadline, time.time(), time.time(), 0, seconds=12.5)
+
+import math
+import shlex
+import time
+from datetime import datetime
+
+# Default priority lane of tasks without --priority
+DEFAULT_PRIORITY = 0
+
+# Seconds of waiting that raise a task's effective priority by one level
+AGING_SECONDS = 1800
+
+# Levels added to a task as its deadline approaches (fully reached at the deadline), and the
+# number of seconds before the deadline the boost starts growing
+DEADLINE_BOOST = 2
+DEADLINE_LEAD_SECONDS = 1800
+
+# A worker only switches away from its loaded model for a task this many levels more urgent
+SWITCH_MARGIN = 1
+
+# Task orders within a priority level: queue order ("priority") or shortest estimated duration first ("sjf")
+ORDERS = ("priority", "sjf")
+
+def parse_deadline(text, now=None):
+    """
+    Parse a deadline: an ISO date/time ("2025-06-21T18:00", "2025-06-21 18:00") or a time of
+    day ("18:00", meaning today). Returns the deadline as a Unix timestamp; raises ValueError.
+    """
+    text = text.strip()
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M")
+    except ValueError:
+        raise ValueError(f"Invalid deadline (use YYYY-MM-DDTHH:MM or HH:MM): {text}")
+    today = datetime.fromtimestamp(time.time() if now is None else now)
+    return today.replace(hour=clock.hour, minute=clock.minute, second=clock.second, microsecond=0).timestamp()
+
+def task_schedule(task):
+    """
+    Return (priority, deadline timestamp or None) of a queue line, without parsing the rest of it.
+    Invalid values are treated as unset here; the full argument parser reports them when the task runs.
+    """
+    try:
+        parts = shlex.split(task)
+    except ValueError:
+        parts = task.split()
+    options = {}
+    for index, part in enumerate(parts):
+        name, sep, value = part.partition("=")
+        if name in ("--priority", "--deadline"):
+            if not sep:
+                value = parts[index + 1] if index + 1 < len(parts) else ""
+            options[name] = value
+    try:
+        priority = int(options.get("--priority", DEFAULT_PRIORITY))
+    except ValueError:
+        priority = DEFAULT_PRIORITY
+    try:
+        deadline = parse_deadline(options["--deadline"]) if "--deadline" in options else None
+    except ValueError:
+        deadline = None
+    return priority, deadline
+
+def effective_priority(priority, deadline, enqueued, now):
+    """
+    Return the effective priority of a waiting task (see the top of this file).
+    Args:
+        priority (int): The task's priority lane.
+        deadline (float or None): Deadline timestamp.
+        enqueued (float): Timestamp the task was queued.
+        now (float): Current timestamp.
+    """
+    level = priority + max(0.0, now - enqueued) / AGING_SECONDS
+    if deadline is not None:
+        remaining = deadline - now
+        level += DEADLINE_BOOST * min(1.0, max(0.0, 1.0 - remaining / DEADLINE_LEAD_SECONDS))
+    return level
+
+def sort_key(priority, deadline, enqueued, now, position):
+    """Return the key ordering waiting tasks: most urgent first, then earliest deadline, then queue order."""
+    return (-effective_priority(priority, deadline, enqueued, now),
+            math.inf if deadline is None else deadline, position)
+
+def shortest_first_key(priority, deadline, enqueued, now, position, seconds):
+    """
+    Return the key ordering waiting tasks shortest first: highest whole effective priority level
+    first, then shortest estimated duration (seconds), then earliest deadline, then queue order.
+    """
+    return (-math.floor(effective_priority(priority, deadline, enqueued, now)), seconds,
+            math.inf if deadline is None else deadline, position)
@@ -0,0 +1,260 @@
+# task_store.py
+#
+# Durable SQLite-backed task queue for the batch runner.
+# Each queue line is a row with a state (pending, running, done, failed), an attempt count and,
+# while it runs, a lease (owner and expiry time). Runners claim tasks in a transaction, so two
+# runners sharing the same database never get the same task; a task whose runner crashed is
+# claimed again once its lease expires. Every finished task is recorded as soon as it completes,
+# so an interrupted run only repeats the tasks that were still running.
+# Text queue files (image_tasks_new_YYYYMMDD.txt, one run_image_generation.py argument line per
+# task) can be imported into the store and exported back.
+# Tasks are claimed most urgent first: the --priority and --deadline of each line are stored with
+# it, and tasks gain priority while they wait (see task_priority.py).
+#
+# Usage:
+#   python task_store.py --db image_tasks.db import image_tasks_new_20250621.txt
+#   python task_store.py --db image_tasks.db status
+#   python task_store.py --db image_tasks.db export --state failed remaining.txt
+#   python task_store.py --db image_tasks.db retry
+
+import argparse
+import os
+import sqlite3
+import time
+
+import sweep
+import task_priority
+
+# Default database location (next to the scripts)
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_tasks.db")
+
+# Seconds a claimed task stays reserved for its runner unless the lease is renewed
+LEASE_SECONDS = 300
+
+# Number of attempts before a task is marked as failed
+MAX_ATTEMPTS = 3
+
+# Task states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    source TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    deadline REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+"""
+
+class TaskStore:
+    """
+    Task queue stored in a SQLite database (safe to share between threads and processes).
+    Args:
+        path (str): Database file (created if needed).
+        max_attempts (int): Attempts before a task is marked as failed.
+    """
+
+    def __init__(self, path=DEFAULT_DB, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            self._upgrade(db)
+
+    def _connect(self):
+        """Open a connection in autocommit mode (transactions are started explicitly)."""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.create_function("effective_priority", 4, task_priority.effective_priority)
+        return _Connection(db)
+
+    def _upgrade(self, db):
+        """Add the priority and deadline columns to a database created before they existed."""
+        columns = {row[1] for row in db.execute("PRAGMA table_info(tasks)")}
+        if "priority" in columns:
+            return
+        db.execute("BEGIN IMMEDIATE")
+        columns = {row[1] for row in db.execute("PRAGMA table_info(tasks)")}
+        if "priority" not in columns:  # Another process may have upgraded it meanwhile
+            db.execute("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            db.execute("ALTER TABLE tasks ADD COLUMN deadline REAL")
+            rows = db.execute("SELECT id, task FROM tasks WHERE state IN (?, ?)", (PENDING, RUNNING)).fetchall()
+            db.executemany("UPDATE tasks SET priority = ?, deadline = ? WHERE id = ?",
+                           [task_priority.task_schedule(task) + (task_id,) for task_id, task in rows])
+        db.execute("COMMIT")
+
+    def add(self, tasks, source=None):
+        """
+        Add task lines as pending, with sweep lines expanded (see sweep.py; empty and comment lines
+        are skipped); return the ids of the added tasks, in order.
+        """
+        now = time.time()
+        rows = [(task, source, now, now) + task_priority.task_schedule(task)
+                for task in sweep.expand_tasks([task.strip() for task in tasks
+                                                if task.strip() and not task.strip().startswith('#')])]
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            ids = [db.execute("INSERT INTO tasks (task, source, created, updated, priority, deadline) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", row).lastrowid for row in rows]
+            db.execute("COMMIT")
+        return ids
+
+    def import_file(self, queue_file):
+        """
+        Move the tasks of a text queue file into the store and remove the file.
+        The file is renamed first, so when several runners import the same file only one gets it.
+        Returns the number of tasks imported (0 if the file does not exist).
+        """
+        claimed = f"{queue_file}.importing-{os.getpid()}"
+        try:
+            os.replace(queue_file, claimed)
+        except FileNotFoundError:
+            return 0
+        with open(claimed, 'r', encoding='utf-8') as f:
+            count = len(self.add(f, source=os.path.basename(queue_file)))
+        os.remove(claimed)
+        return count
+
+    def export_file(self, path, states=(PENDING, FAILED)):
+        """Write the tasks in the given states to a text queue file, in queue order; return the count."""
+        tasks = [task for _, task in self.tasks(states)]
+        with open(path, 'w', encoding='utf-8') as f:
+            for task in tasks:
+                f.write(task + '\n')
+        return len(tasks)
+
+    def tasks(self, states=STATES):
+        """Return (id, task) of the tasks in the given states, in queue order."""
+        marks = ",".join("?" * len(states))
+        with self._connect() as db:
+            return db.execute(f"SELECT id, task FROM tasks WHERE state IN ({marks}) ORDER BY id", tuple(states)).fetchall()
+
+    def claim(self, owner, limit=1, lease_seconds=LEASE_SECONDS):
+        """
+        Reserve up to `limit` tasks for a runner: pending tasks, and running tasks whose lease
+        expired (their runner stopped), most urgent first (effective priority, then deadline, then
+        queue order; see task_priority.py). Returns a list of (id, task, created), where created is
+        the time the task was queued (for priority aging in the dispatcher).
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # Tasks that keep losing their runner (e.g. they crash it) are not retried forever
+            db.execute("UPDATE tasks SET state = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+                       "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                       (FAILED, now, RUNNING, now, self.max_attempts))
+            rows = db.execute(
+                "SELECT id, task, created FROM tasks WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY effective_priority(priority, deadline, created, ?) DESC, deadline IS NULL, deadline, id "
+                "LIMIT ?", (PENDING, RUNNING, now, now, limit)).fetchall()
+            db.executemany(
+                "UPDATE tasks SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated = ? "
+                "WHERE id = ?", [(RUNNING, owner, now + lease_seconds, now, task_id) for task_id, _, _ in rows])
+            db.execute("COMMIT")
+        return rows
+
+    def renew(self, owner, lease_seconds=LEASE_SECONDS):
+        """Extend the leases of all tasks a runner is still running."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET lease_expires = ?, updated = ? WHERE state = ? AND lease_owner = ?",
+                       (now + lease_seconds, now, RUNNING, owner))
+
+    def complete(self, task_id):
+        """Mark a task as done (also if its lease expired meanwhile: the work was done)."""
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET state = ?, lease_owner = NULL, lease_expires = NULL, updated = ? WHERE id = ?",
+                       (DONE, time.time(), task_id))
+
+    def fail(self, task_id, owner):
+        """
+        Record a failed attempt: the task goes back to pending, or to failed after max_attempts.
+        Ignored if the task's lease now belongs to another runner.
+        """
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                       "lease_owner = NULL, lease_expires = NULL, updated = ? WHERE id = ? AND lease_owner = ?",
+                       (self.max_attempts, FAILED, PENDING, time.time(), task_id, owner))
+
+    def release(self, task_ids, owner):
+        """Put claimed tasks that were never started back to pending, without counting an attempt."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("UPDATE tasks SET state = ?, attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                           "lease_expires = NULL, updated = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                           [(PENDING, now, task_id, RUNNING, owner) for task_id in task_ids])
+            db.execute("COMMIT")
+
+    def reject(self, task_ids):
+        """Mark pending tasks that can never run (see preflight.py) as failed, without retries."""
+        now = time.time()
+        with self._connect() as db:
+            db.executemany("UPDATE tasks SET state = ?, updated = ? WHERE id = ? AND state = ?",
+                           [(FAILED, now, task_id, PENDING) for task_id in task_ids])
+
+    def retry(self, states=(FAILED,)):
+        """Put tasks in the given states back to pending with a fresh attempt count; return the count."""
+        marks = ",".join("?" * len(states))
+        with self._connect() as db:
+            cursor = db.execute(f"UPDATE tasks SET state = ?, attempts = 0, lease_owner = NULL, lease_expires = NULL, "
+                                f"updated = ? WHERE state IN ({marks})", (PENDING, time.time()) + tuple(states))
+            return cursor.rowcount
+
+    def counts(self):
+        """Return the number of tasks in each state."""
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+class _Connection:
+    """Context manager closing a sqlite3 connection (sqlite3's own only ends the transaction)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None and self.db.in_transaction:
+            self.db.execute("ROLLBACK")
+        self.db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the SQLite task queue used by image_task_batch_runner.py --store.")
+    parser.add_argument('--db', default=DEFAULT_DB, help='Task database (default: image_tasks.db next to the scripts)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='Move the tasks of text queue files into the store')
+    import_parser.add_argument('files', nargs='+', help='Queue files (one task per line)')
+    export_parser = commands.add_parser('export', help='Write tasks to a text queue file')
+    export_parser.add_argument('file', help='Output file')
+    export_parser.add_argument('--state', action='append', choices=STATES, help='States to export; repeatable (default: pending and failed)')
+    commands.add_parser('retry', help='Put failed tasks back to pending')
+    commands.add_parser('status', help='Show the number of tasks in each state')
+    args = parser.parse_args()
+
+    store = TaskStore(args.db)
+    if args.command == 'import':
+        for queue_file in args.files:
+            print(f"Imported {store.import_file(queue_file)} task(s) from {queue_file}")
+    elif args.command == 'export':
+        count = store.export_file(args.file, tuple(args.state or (PENDING, FAILED)))
+        print(f"Exported {count} task(s) to {args.file}")
+    elif args.command == 'retry':
+        print(f"{store.retry()} failed task(s) set back to pending")
+    else:
+        for state, count in store.counts().items():
+            print(f"{state:<8} {count}")
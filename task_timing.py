@@ -0,0 +1,232 @@
+# task_timing.py
+#
+# Per-task phase timings for the batch runner and the model scripts, written as JSON lines
+# (task_logs/timings.jsonl), and a summary report for sizing the GPU fleet.
+# Phases (seconds):
+#   startup     interpreter/process startup (subprocess mode only)
+#   setup       model setup (options check, switch and wait for the model)
+#   model_wait  time spent sleeping while waiting for a model switch (part of setup)
+#   generate    txt2img request until the response starts (server-side generation)
+#   decode      reading and decoding the response body (includes waiting on a full write queue)
+#   write       waiting for the background writer after the task finished
+#   cache       restoring a result from the result cache
+#
+# The model scripts record phases with task_timing.phase(...), which does nothing unless a timer
+# was started on the current thread (by the batch engine, or from the environment when a script
+# runs as a subprocess of the batch runner).
+#
+# Usage:
+#   python task_timing.py task_logs/timings.jsonl
+
+import argparse
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# File name of the timings log inside the task log directory
+TIMINGS_FILE = "timings.jsonl"
+
+# Identifies the runner process in the records (one run per process)
+RUN_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Environment variables used to pass timings from a task subprocess back to the runner
+ENV_FILE = "TASK_TIMING_FILE"
+ENV_START = "TASK_TIMING_START"
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+class TaskTimer:
+    """Phase durations of one task (or one batched request), plus descriptive fields."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.phases = {}
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def stop(self, **fields):
+        """Mark the end of the task (later phases such as 'write' still count towards the total)."""
+        self.fields.update(fields)
+        self.end = time.perf_counter()
+
+    def record(self, **fields):
+        """Return the timing record as a dict."""
+        now = time.perf_counter()
+        record = {"time": datetime.fromtimestamp(self.started).isoformat(), "run": RUN_ID}
+        record.update(self.fields)
+        record.update(fields)
+        record["total"] = round(now - self.start, 3)
+        record["phases"] = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        return record
+
+def start(**fields):
+    """Start a timer for the current thread and return it."""
+    _local.timer = TaskTimer(**fields)
+    return _local.timer
+
+def current():
+    """Return the current thread's timer, or None."""
+    return getattr(_local, "timer", None)
+
+def clear():
+    """Detach the timer from the current thread (it can still be completed and written)."""
+    _local.timer = None
+
+def add(name, seconds):
+    """Add seconds to a phase of the current thread's timer (no-op without a timer)."""
+    timer = current()
+    if timer is not None:
+        timer.add(name, seconds)
+
+@contextmanager
+def phase(name):
+    """Time a block as a phase of the current thread's timer (no-op without a timer)."""
+    timer = current()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(name, time.perf_counter() - start_time)
+
+def write_record(path, record):
+    """Append a record to a JSON lines file."""
+    line = json.dumps(record)
+    with _log_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+def subprocess_env(env, path):
+    """Add the variables that make a task subprocess report its phases to path."""
+    env[ENV_FILE] = path
+    env[ENV_START] = repr(time.time())
+    return env
+
+def start_from_env():
+    """
+    In a script run by the batch runner as a subprocess: start a timer (with the process startup
+    time as a phase) and save its phases to the file named in the environment at exit.
+    """
+    path = os.environ.get(ENV_FILE)
+    if not path:
+        return None
+    timer = start()
+    try:
+        timer.add("startup", max(0.0, time.time() - float(os.environ[ENV_START])))
+    except (KeyError, ValueError):
+        pass
+
+    def save():
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(timer.phases, f)
+
+    atexit.register(save)
+    return timer
+
+def merge_subprocess_phases(path):
+    """Add the phases saved by a task subprocess to the current timer and remove the file."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            phases = json.load(f)
+        os.remove(path)
+    except (OSError, ValueError):
+        return
+    for name, seconds in phases.items():
+        add(name, seconds)
+
+def read_records(path):
+    """Read the records of a timings file (invalid lines are skipped)."""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of a list of numbers, interpolating between ranks."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def summarize(records):
+    """
+    Summarize timing records.
+    Returns a dict with per (model, size) latency statistics of generated tasks, the number of
+    cached and failed tasks, images per hour over the runs' wall time, and model wait totals.
+    """
+    groups = {}
+    runs = {}
+    model_wait = {}
+    cached = failed = images = 0
+    for record in records:
+        started = datetime.fromisoformat(record["time"]).timestamp()
+        span = runs.setdefault(record.get("run"), [started, started])
+        span[0] = min(span[0], started)
+        span[1] = max(span[1], started + record.get("total", 0.0))
+        if not record.get("success"):
+            failed += record.get("tasks", 1)
+            continue
+        images += record.get("images", 1)
+        if record.get("mode") == "cache":
+            cached += record.get("tasks", 1)
+            continue
+        phases = record.get("phases", {})
+        model = record.get("model", "?")
+        model_wait[model] = model_wait.get(model, 0.0) + phases.get("model_wait", 0.0)
+        group = groups.setdefault((model, f"{record.get('width')}x{record.get('height')}"),
+                                  {"latencies": [], "images": 0, "phases": {}})
+        # Every task of a batched request waited for the whole request
+        group["latencies"].extend([record.get("total", 0.0)] * record.get("tasks", 1))
+        group["images"] += record.get("images", 1)
+        for name, seconds in phases.items():
+            group["phases"][name] = group["phases"].get(name, 0.0) + seconds
+    wall = sum(end - begin for begin, end in runs.values())
+    return {
+        "groups": {key: {"tasks": len(g["latencies"]), "images": g["images"],
+                         "p50": percentile(g["latencies"], 50), "p95": percentile(g["latencies"], 95),
+                         "phases": g["phases"]}
+                   for key, g in sorted(groups.items())},
+        "cached": cached,
+        "failed": failed,
+        "images": images,
+        "wall_seconds": wall,
+        "images_per_hour": images * 3600 / wall if wall else 0.0,
+        "model_wait": model_wait,
+    }
+
+def print_summary(summary):
+    """Print a summary returned by summarize()."""
+    print(f"{'model':<10} {'size':<10} {'tasks':>6} {'images':>7} {'p50 s':>8} {'p95 s':>8}  time per phase (s)")
+    for (model, size), group in summary["groups"].items():
+        phases = ", ".join(f"{name} {seconds:.1f}" for name, seconds in sorted(group["phases"].items()))
+        print(f"{model:<10} {size:<10} {group['tasks']:>6} {group['images']:>7} "
+              f"{group['p50']:>8.2f} {group['p95']:>8.2f}  {phases}")
+    print(f"\nImages: {summary['images']} ({summary['cached']} from cache), failed tasks: {summary['failed']}")
+    print(f"Throughput: {summary['images_per_hour']:.1f} images/hour over {summary['wall_seconds'] / 60:.1f} minutes of runs")
+    total_wait = sum(summary["model_wait"].values())
+    per_model = ", ".join(f"{model} {seconds:.1f}s" for model, seconds in sorted(summary["model_wait"].items()))
+    print(f"Time waiting for model switches: {total_wait:.1f}s" + (f" ({per_model})" if per_model else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the per-task timings written by the batch runner.")
+    parser.add_argument('file', nargs='?', default=os.path.join("task_logs", TIMINGS_FILE),
+                        help=f"Timings file (default: task_logs/{TIMINGS_FILE})")
+    args = parser.parse_args()
+    print_summary(summarize(read_records(args.file)))
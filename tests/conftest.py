@@ -0,0 +1,32 @@
+# conftest.py
+#
+# Shared fixtures of the test suite: the project directory on sys.path, a MODELS_DIR with empty
+# model files, and two stub Forge servers (see stub_forge_server.py).
+#
+# Usage:
+#   python -m pytest -q
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_suite
+import stub_forge_server
+
+@pytest.fixture(autouse=True)
+def models_dir(tmp_path_factory, monkeypatch):
+    """Point MODELS_DIR at empty model files, so the model profiles' file checks pass."""
+    path = benchmark_suite.make_models_dir(str(tmp_path_factory.getbasetemp()))
+    monkeypatch.setenv("MODELS_DIR", path)
+    return path
+
+@pytest.fixture
+def servers():
+    """Two stub Forge servers, stopped after the test."""
+    started = [stub_forge_server.StubForgeServer().start() for _ in range(2)]
+    yield started
+    for server in started:
+        server.stop()
@@ -0,0 +1,67 @@
+# test_batch_engine.py
+#
+# Running queue files over several backends (done/queue bookkeeping, failed tasks) and merging
+# seed runs into batched requests, against two stub servers.
+
+import os
+
+import batch_engine
+
+def txt2img_requests(server):
+    return sum(1 for request in server.requests if request == ("POST", "/sdapi/v1/txt2img"))
+
+def write_queue(path, tasks):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(task + "\n" for task in tasks))
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def test_run_queue_spreads_tasks_and_records_them_as_done(tmp_path, servers):
+    output = tmp_path / "out"
+    tasks = [f'{model} --prompt "task {i}" --seed {i * 10} --steps 4 --width 64 --height 64 --output "{output}"'
+             for i, model in enumerate(["flux", "jugger"] * 3)]
+    queue_file, done_file = tmp_path / "queue.txt", tmp_path / "done.txt"
+    write_queue(queue_file, tasks)
+    left = batch_engine.run_queue(str(queue_file), str(done_file), backends=[server.url for server in servers],
+                                  max_batch=1, check=False)
+    assert left == []
+    assert not queue_file.exists()
+    assert sorted(read_lines(done_file)) == sorted(tasks)
+    assert len([name for name in os.listdir(output) if name.endswith(".png")]) == len(tasks)
+    assert all(txt2img_requests(server) > 0 for server in servers)
+    # With model affinity, each server loads one model
+    assert all(server.model_switches == 1 for server in servers)
+
+def test_run_queue_keeps_failed_tasks_in_queue_order(tmp_path, servers):
+    output = tmp_path / "out"
+    good = [f'flux --prompt "good {i}" --steps 4 --width 64 --height 64 --output "{output}"' for i in range(2)]
+    bad = ['flux --prompt "bad" --steps many', 'jugger --prompt "bad" --width wide']
+    tasks = [good[0], bad[0], good[1], bad[1]]
+    queue_file, done_file = tmp_path / "queue.txt", tmp_path / "done.txt"
+    write_queue(queue_file, tasks)
+    left = batch_engine.run_queue(str(queue_file), str(done_file), backends=[server.url for server in servers],
+                                  check=False)
+    assert left == bad
+    assert read_lines(queue_file) == bad
+    assert sorted(read_lines(done_file)) == sorted(good)
+
+def test_split_batch_covers_every_image():
+    for count in range(1, 17):
+        batch_size, n_iter = batch_engine.split_batch(count)
+        assert batch_size * n_iter == count
+        assert batch_size <= batch_engine.MAX_BATCH_SIZE
+
+def test_consecutive_seeds_run_as_one_request(tmp_path, servers):
+    output = tmp_path / "out"
+    tasks = [f'flux --prompt "batch" --seed {seed} --steps 4 --width 64 --height 64 --output "{output}"'
+             for seed in range(100, 104)]
+    queue_file, done_file = tmp_path / "queue.txt", tmp_path / "done.txt"
+    write_queue(queue_file, tasks)
+    left = batch_engine.run_queue(str(queue_file), str(done_file), backends=[servers[0].url], max_batch=4,
+                                  check=False)
+    assert left == []
+    assert txt2img_requests(servers[0]) == 1
+    images = sorted(name for name in os.listdir(output) if name.endswith(".png"))
+    assert [name.rsplit("_seed", 1)[1] for name in images] == [f"{seed}.png" for seed in range(100, 104)]
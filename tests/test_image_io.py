@@ -0,0 +1,179 @@
+# test_image_io.py
+#
+# Unique output names: reserve_path() never hands out the same name twice, across threads and
+# against files already written. Txt2ImgStreamDecoder gives the same images and result whatever
+# the chunking of the body, and save_txt2img_response() leaves no temporary files on errors.
+
+import base64
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import image_io
+import stub_forge_server
+
+def test_reserve_path_skips_taken_names(tmp_path):
+    first = image_io.reserve_path(str(tmp_path), "image")
+    second = image_io.reserve_path(str(tmp_path), "image")
+    assert os.path.basename(first) == "image.png"
+    assert os.path.basename(second) == "image_1.png"
+
+def test_reserve_path_skips_existing_files(tmp_path):
+    (tmp_path / "image.png").write_bytes(b"")
+    assert os.path.basename(image_io.reserve_path(str(tmp_path), "image")) == "image_1.png"
+
+def test_released_path_can_be_reserved_again(tmp_path):
+    path = image_io.reserve_path(str(tmp_path), "image")
+    image_io.release_path(path)
+    assert image_io.reserve_path(str(tmp_path), "image") == path
+
+def test_concurrent_reservations_are_unique(tmp_path):
+    paths = []
+    lock = threading.Lock()
+
+    def reserve():
+        for _ in range(20):
+            path = image_io.reserve_path(str(tmp_path), "image")
+            with lock:
+                paths.append(path)
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(paths) == len(set(paths)) == 160
+
+def test_written_file_ends_the_reservation(tmp_path):
+    path = image_io.reserve_path(str(tmp_path), "image")
+    writer = image_io.BackgroundWriter(fsync=False)
+    writer.write_file(path, b"data")
+    writer.flush()
+    writer.when_written(lambda: None)
+    writer.flush()
+    assert sorted(os.listdir(tmp_path)) == ["image.png"]
+    assert os.path.basename(image_io.reserve_path(str(tmp_path), "image")) == "image_1.png"
+
+def txt2img_body(images, escape_slashes=False):
+    """Return a txt2img response body (as the server sends it) with the given PNG bytes as images."""
+    payload = {"prompt": "a cat/dog", "seed": 1, "steps": 20}
+    info = {"seed": 1, "all_seeds": [1] * len(images), "infotexts": ["a cat/dog\nSteps: 20"]}
+    body = json.dumps({"images": [base64.b64encode(image).decode("ascii") for image in images],
+                       "parameters": payload, "info": json.dumps(info)})
+    if escape_slashes:
+        body = body.replace("/", "\\/")
+    return body.encode("utf-8")
+
+def decode(chunks):
+    """Feed chunks to a decoder; return (result, {index: image bytes}, indexes of completed images)."""
+    images = {}
+    ended = []
+    decoder = image_io.Txt2ImgStreamDecoder(lambda index: images.setdefault(index, bytearray()),
+                                            lambda index, data: images[index].extend(data), ended.append)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.finish(), {index: bytes(data) for index, data in images.items()}, ended
+
+def split(body, sizes):
+    """Split body into chunks whose sizes are drawn from sizes()."""
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        size = sizes()
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+PNGS = [stub_forge_server.make_png(16, 8, seed) for seed in range(3)]
+
+@pytest.mark.parametrize("escape_slashes", [False, True])
+def test_decoder_is_independent_of_chunking(escape_slashes):
+    body = txt2img_body(PNGS, escape_slashes)
+    expected = json.loads(body)
+    expected["images"] = [""] * len(PNGS)
+    rng = random.Random(0)
+    for chunks in ([body], split(body, lambda: 1), split(body, lambda: rng.randint(1, 200)),
+                   split(body, lambda: rng.choice([3, 4, 5]))):
+        result, images, ended = decode(chunks)
+        assert result == expected
+        assert images == dict(enumerate(PNGS))
+        assert ended == [0, 1, 2]
+
+def test_decoder_handles_escaped_slashes_split_across_chunks():
+    body = txt2img_body(PNGS[:1], escape_slashes=True)
+    assert b"\\/" in body
+    backslash = body.index(b"\\/")
+    result, images, _ = decode([body[:backslash + 1], body[backslash + 1:]])
+    assert images == {0: PNGS[0]}
+    assert result["parameters"]["prompt"] == "a cat/dog"
+
+def test_decoder_without_images():
+    result, images, ended = decode(split(txt2img_body([]), lambda: 7))
+    assert result["images"] == []
+    assert result["parameters"]["steps"] == 20
+    assert images == {} and ended == []
+
+def test_decoder_ignores_images_key_in_nested_objects():
+    body = json.dumps({"parameters": {"images": ["bm90IGFuIGltYWdl"]}, "images": [base64.b64encode(PNGS[0]).decode()]})
+    result, images, _ = decode([body.encode()])
+    assert result["parameters"]["images"] == ["bm90IGFuIGltYWdl"]
+    assert images == {0: PNGS[0]}
+
+@pytest.mark.parametrize("cut", [0.3, 0.5, 0.99])
+def test_decoder_rejects_truncated_stream(cut):
+    body = txt2img_body(PNGS)
+    with pytest.raises(ValueError):
+        decode(split(body[:int(len(body) * cut)], lambda: 100))
+
+class FakeResponse:
+    """Streamed response yielding the given chunks, then raising error (if any)."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def iter_content(self, chunk_size):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+def save(tmp_path, response, publish):
+    writer = image_io.BackgroundWriter(fsync=False)
+    try:
+        return image_io.save_txt2img_response(response, lambda index: str(tmp_path / f"image_{index}.png"),
+                                              writer=writer, publish=publish)
+    finally:
+        writer.flush()
+
+@pytest.mark.parametrize("publish", [True, False])
+def test_saved_response_writes_every_image(tmp_path, publish):
+    writer = image_io.BackgroundWriter(fsync=False)
+    result, saved = image_io.save_txt2img_response(
+        FakeResponse(split(txt2img_body(PNGS), lambda: 1000)), lambda index: str(tmp_path / f"image_{index}.png"),
+        writer=writer, publish=publish)
+    if not publish:
+        writer.publish([path for _, path in saved])
+    writer.flush()
+    assert result["images"] == ["", "", ""]
+    assert [index for index, _ in saved] == [0, 1, 2]
+    assert sorted(os.listdir(tmp_path)) == ["image_0.png", "image_1.png", "image_2.png"]
+    assert [(tmp_path / f"image_{index}.png").read_bytes() for index in range(3)] == PNGS
+
+@pytest.mark.parametrize("publish", [True, False])
+def test_truncated_response_leaves_no_files(tmp_path, publish):
+    body = txt2img_body(PNGS)
+    middle_of_second_image = body.index(base64.b64encode(PNGS[1])) + 40
+    with pytest.raises(ValueError):
+        save(tmp_path, FakeResponse(split(body[:middle_of_second_image], lambda: 64)), publish)
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.parametrize("publish", [True, False])
+def test_read_error_leaves_no_files(tmp_path, publish):
+    body = txt2img_body(PNGS)
+    response = FakeResponse(split(body[:len(body) // 2], lambda: 64), error=ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        save(tmp_path, response, publish)
+    assert os.listdir(tmp_path) == []
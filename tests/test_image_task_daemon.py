@@ -0,0 +1,33 @@
+# test_image_task_daemon.py
+#
+# Submitted tasks are checked once: preflight at submission marks them as checked, so the daemon
+# does not check them again when it looks for new tasks in the store.
+
+import pytest
+
+import image_task_daemon
+import preflight
+
+@pytest.fixture
+def daemon(tmp_path, servers):
+    return image_task_daemon.TaskDaemon(str(tmp_path / "tasks.db"), backends=[server.url for server in servers])
+
+def test_submitted_tasks_are_not_checked_again(daemon, monkeypatch):
+    checked = []
+    check = preflight.preflight
+
+    def counting_preflight(tasks, *args, **kwargs):
+        checked.append(list(tasks))
+        return check(tasks, *args, **kwargs)
+
+    monkeypatch.setattr(preflight, "preflight", counting_preflight)
+    assert daemon.submit(['flux --prompt "a cat" --seed 1,2', "# comment"]) == 2
+    assert daemon.checked == {task_id for task_id, _ in daemon.store.tasks()}
+    daemon._check_pending()
+    assert [len(tasks) for tasks in checked] == [2, 0]
+
+def test_invalid_submission_adds_nothing(daemon):
+    with pytest.raises(ValueError):
+        daemon.submit(['flux --prompt "a cat"', 'nosuchmodel --prompt "a dog"'])
+    assert daemon.store.tasks() == []
+    assert daemon.checked == set()
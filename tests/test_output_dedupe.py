@@ -0,0 +1,121 @@
+# test_output_dedupe.py
+#
+# Near-duplicate search: near_pairs() and HashIndex.duplicates() agree with a brute-force Hamming
+# search at every distance (including those where a block is only a few bits wide), and
+# link_duplicates() never links files whose bytes differ.
+
+import os
+import random
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import output_dedupe
+
+def clustered_hashes(seed, count, max_flips):
+    """Return random 64-bit hashes, many of them a few bit flips away from an earlier one."""
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        if values and rng.random() < 0.6:
+            value = rng.choice(values)
+            for _ in range(rng.randint(0, max_flips)):
+                value ^= 1 << rng.randrange(64)
+        else:
+            value = rng.getrandbits(64)
+        values.append(value)
+    return numpy.unique(numpy.array(values, dtype=numpy.uint64))
+
+def brute_force_pairs(hashes, max_distance):
+    values = hashes.tolist()
+    return {(i, j) for i in range(len(values)) for j in range(i + 1, len(values))
+            if bin(values[i] ^ values[j]).count("1") <= max_distance}
+
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 4, 8, 15, 20, 31])
+def test_near_pairs_match_brute_force(max_distance):
+    hashes = clustered_hashes(max_distance, 400, max_distance + 2)
+    first, second = output_dedupe.near_pairs(hashes, max_distance)
+    found = list(zip(first.tolist(), second.tolist()))
+    assert len(found) == len(set(found))
+    assert set(found) == brute_force_pairs(hashes, max_distance)
+
+@pytest.mark.parametrize("max_distance", [2, 31])
+def test_near_pairs_in_large_buckets(monkeypatch, max_distance):
+    # Force the banded comparison of large buckets, with bands of a few rows
+    monkeypatch.setattr(output_dedupe, "SMALL_BUCKET", 2)
+    monkeypatch.setattr(output_dedupe, "COMPARE_CHUNK", 50)
+    hashes = clustered_hashes(100 + max_distance, 300, max_distance + 2)
+    first, second = output_dedupe.near_pairs(hashes, max_distance)
+    assert set(zip(first.tolist(), second.tolist())) == brute_force_pairs(hashes, max_distance)
+
+def make_index(tmp_path, hashes):
+    index = output_dedupe.HashIndex(str(tmp_path / "missing.npz"))
+    index.paths = numpy.array([str(tmp_path / f"{i:04d}.png") for i in range(len(hashes))], dtype=str)
+    index.mtimes = numpy.arange(len(hashes), dtype=numpy.float64)[::-1].copy()
+    index.sizes = numpy.ones(len(hashes), dtype=numpy.int64)
+    index.hashes = numpy.array(hashes, dtype=numpy.uint64)
+    return index
+
+def brute_force_groups(paths, hashes, max_distance):
+    parent = list(range(len(hashes)))
+
+    def find(node):
+        while parent[node] != node:
+            node = parent[node]
+        return node
+
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if bin(hashes[i] ^ hashes[j]).count("1") <= max_distance:
+                parent[find(j)] = find(i)
+    groups = {}
+    for i, path in enumerate(paths):
+        groups.setdefault(find(i), set()).add(path)
+    return {frozenset(group) for group in groups.values() if len(group) > 1}
+
+@pytest.mark.parametrize("max_distance", [0, 2, 6, 31])
+def test_duplicates_match_brute_force(tmp_path, max_distance):
+    rng = random.Random(max_distance)
+    hashes = clustered_hashes(200 + max_distance, 250, max_distance + 2).tolist()
+    hashes += [rng.choice(hashes) for _ in range(50)]  # Identical hashes
+    rng.shuffle(hashes)
+    index = make_index(tmp_path, hashes)
+    groups = index.duplicates(max_distance)
+    paths = index.paths.tolist()
+    assert {frozenset(path for path, _ in group) for group in groups} == brute_force_groups(paths, hashes, max_distance)
+    for group in groups:
+        # Oldest image first, with each member's distance to it
+        members = [paths.index(path) for path, _ in group]
+        assert index.mtimes[members[0]] == index.mtimes[members].min()
+        assert [d for _, d in group] == [bin(hashes[m] ^ hashes[members[0]]).count("1") for m in members]
+
+def test_duplicates_rejects_out_of_range_distance(tmp_path):
+    index = make_index(tmp_path, [1, 2])
+    with pytest.raises(ValueError):
+        index.duplicates(output_dedupe.MAX_DISTANCE + 1)
+
+def test_link_duplicates_only_links_identical_bytes(tmp_path):
+    rng = random.Random(0)
+    keeper_data = bytes(rng.getrandbits(8) for _ in range(4096))
+    files = {
+        "keeper.png": keeper_data,
+        "same.png": keeper_data,
+        "one_byte_off.png": keeper_data[:-1] + bytes([keeper_data[-1] ^ 1]),
+        "other_metadata.png": keeper_data[:2048] + b"x" * 2048,
+        "longer.png": keeper_data + b"\0",
+        "also_same.png": keeper_data,
+    }
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    group = [(str(tmp_path / name), 0) for name in files]
+    linked, freed = output_dedupe.link_duplicates([group])
+    assert (linked, freed) == (2, 2 * len(keeper_data))
+    keeper = str(tmp_path / "keeper.png")
+    for name, data in files.items():
+        path = str(tmp_path / name)
+        assert (tmp_path / name).read_bytes() == data
+        assert os.path.samefile(keeper, path) == (data == keeper_data)
+    # Linking again changes nothing
+    assert output_dedupe.link_duplicates([group]) == (0, 0)
+    assert sorted(os.listdir(tmp_path)) == sorted(files)
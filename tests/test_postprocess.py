@@ -0,0 +1,48 @@
+# test_postprocess.py
+#
+# The post-processing stage only derives copies of images that were published.
+
+import os
+
+import pytest
+
+import batch_engine
+import image_engine
+import image_io
+import run_image_generation
+import webui_client
+
+pytest.importorskip("PIL")
+
+def batch_args(output):
+    return [run_image_generation.parse_task(f'flux --prompt "cat" --seed {seed} --steps 4 --width 64 --height 64 '
+                                            f'--output "{output}"') for seed in (1, 2, 3)]
+
+def run_batch(servers, args_list):
+    batch_engine.setup_run(True, [servers[0].url], None, 0, ["jpeg"], 1)
+    try:
+        batch_engine.generate_batch(args_list, client=webui_client.WebUIClient(servers[0].url))
+    finally:
+        writer = image_io.get_writer()
+        writer.when_written(lambda: None)
+        writer.flush()
+        batch_engine.close_postprocessing()
+
+def test_published_batch_gets_derived_copies(tmp_path, servers):
+    run_batch(servers, batch_args(tmp_path))
+    assert len(os.listdir(tmp_path / "derived")) == 3
+
+def test_discarded_batch_gets_no_derived_copies(tmp_path, servers, monkeypatch):
+    save_metadata = image_engine.save_metadata
+    calls = []
+
+    def failing_save_metadata(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return save_metadata(*args, **kwargs)
+
+    monkeypatch.setattr(image_engine, "save_metadata", failing_save_metadata)
+    with pytest.raises(OSError):
+        run_batch(servers, batch_args(tmp_path))
+    assert os.listdir(tmp_path) == []
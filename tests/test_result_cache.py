@@ -0,0 +1,83 @@
+# test_result_cache.py
+#
+# Result cache: restored images are independent copies of the cache entry, incomplete images are
+# not stored, and the least recently used entries are evicted once the cache outgrows its limit.
+
+import os
+import time
+
+import result_cache
+import stub_forge_server
+
+PNG = stub_forge_server.make_png(32, 32)
+
+def write_png(path, data=PNG):
+    path.write_bytes(data)
+    return str(path)
+
+def age(cache, key, seconds_ago):
+    """Set the last use of an entry to the given number of seconds ago."""
+    when = time.time() - seconds_ago
+    for path in cache._paths(key):
+        os.utime(path, (when, when))
+
+def test_restore_copies_the_cached_image(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    key = result_cache.cache_key({"prompt": "cat", "seed": 1}, "flux")
+    source = write_png(tmp_path / "generated.png")
+    cache.store(key, source, {"seed": 1})
+    os.remove(source)
+    destination = tmp_path / "out" / "sub" / "image.png"
+    assert cache.restore(key, str(destination)) == {"seed": 1}
+    assert destination.read_bytes() == PNG
+    assert not os.path.samefile(destination, cache._paths(key)[0])
+    assert sorted(os.listdir(destination.parent)) == ["image.png"]
+    # Changing the output leaves the entry alone
+    destination.write_bytes(b"edited")
+    assert cache.restore(key, str(tmp_path / "again.png")) == {"seed": 1}
+    assert (tmp_path / "again.png").read_bytes() == PNG
+
+def test_restore_misses(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    assert cache.restore("0" * 64, str(tmp_path / "image.png")) is None
+    assert not (tmp_path / "image.png").exists()
+
+def test_incomplete_images_are_not_stored(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    cache.store("truncated", write_png(tmp_path / "truncated.png", PNG[:-6]), {})
+    cache.store("empty", write_png(tmp_path / "empty.png", b""), {})
+    assert os.listdir(tmp_path / "cache") == []
+    assert cache.lookup("truncated") is None
+
+def test_cache_keys():
+    payload = {"prompt": "cat", "seed": 1, "steps": 20}
+    assert result_cache.cache_key(payload, "flux") == result_cache.cache_key(dict(reversed(payload.items())), "flux")
+    assert result_cache.cache_key(payload, "flux") != result_cache.cache_key(payload, "jugger")
+    assert result_cache.cache_key(payload, "flux") != result_cache.cache_key(dict(payload, seed=2), "flux")
+    assert result_cache.is_cacheable(payload)
+    assert not result_cache.is_cacheable(dict(payload, seed=-1))
+    assert not result_cache.is_cacheable({"prompt": "cat"})
+    assert not result_cache.is_cacheable(dict(payload, batch_size=2))
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"), max_bytes=int(3.5 * len(PNG)))
+    source = write_png(tmp_path / "generated.png")
+    for index, key in enumerate("abc"):
+        cache.store(key, source, {"key": key})
+        age(cache, key, 100 - index)  # a is the oldest, c the newest
+    cache.lookup("a")  # a becomes the most recently used
+    cache.store("d", source, {"key": "d"})
+    assert sorted(os.listdir(tmp_path / "cache")) == ["a.json", "a.png", "c.json", "c.png", "d.json", "d.png"]
+    assert cache.lookup("b") is None
+    assert cache.lookup("a")[1] == {"key": "a"}
+
+def test_eviction_keeps_the_cache_within_its_limit(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"), max_bytes=2 * len(PNG))
+    source = write_png(tmp_path / "generated.png")
+    for index in range(6):
+        cache.store(str(index), source, {})
+        age(cache, str(index), 100 - index)
+    assert sorted(os.listdir(tmp_path / "cache")) == ["4.json", "4.png", "5.json", "5.png"]
+    cache.max_bytes = 0
+    cache.evict()
+    assert os.listdir(tmp_path / "cache") == []
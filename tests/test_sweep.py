@@ -0,0 +1,105 @@
+# test_sweep.py
+#
+# Sweep expansion: combination order (seeds vary fastest), grid cell paths, the directory of
+# sweeps without --output, quoting of expanded lines, invalid values and the contact sheet grid.
+
+import os
+import re
+import shlex
+
+import pytest
+
+import sweep
+
+def option(argv, name):
+    return argv[argv.index(name) + 1]
+
+def test_combinations_vary_seeds_fastest():
+    lines = sweep.expand_task('flux --prompt "a cat" --seed 1..3 --steps 10,20 --width 512,768 --output out')
+    assert len(lines) == 12
+    combinations = [(option(argv, "--width"), option(argv, "--steps"), option(argv, "--seed"))
+                    for argv in map(shlex.split, lines)]
+    assert combinations == [(width, steps, seed) for width in ("512", "768") for steps in ("10", "20")
+                            for seed in ("1", "2", "3")]
+
+def test_cells_follow_the_grid_order():
+    argv = ["flux", "--prompt", "a cat", "--seed", "7,8", "--cfg", "3.5,7", "--output", "sweeps/cat"]
+    expanded = sweep.expand_argv(argv)
+    assert [option(args, "--output") for args in expanded] == [
+        os.path.join("sweeps/cat", f"cfg-{cfg}", f"seed-{seed}") for cfg in ("3.5", "7.0") for seed in (7, 8)]
+    assert all(option(args, "--sweep-root") == "sweeps/cat" for args in expanded)
+    assert all(args.count("--output") == 1 for args in expanded)
+
+def test_sweep_without_output_gets_a_stable_directory():
+    argv = ["flux", "--prompt", "a cat", "--seed", "1..2"]
+    first, second = sweep.expand_argv(argv), sweep.expand_argv(list(argv))
+    assert first == second
+    root = sweep.default_root(argv)
+    assert os.path.dirname(root) == sweep.DEFAULT_SWEEP_DIR
+    assert root != sweep.default_root(argv[:-1] + ["1..3"])
+    assert [option(args, "--output") for args in first] == [os.path.join(root, "seed-1"), os.path.join(root, "seed-2")]
+    assert all(option(args, "--sweep-root") == root for args in first)
+
+def test_lines_without_sweep_values_are_unchanged():
+    task = 'flux --prompt "a cat, a dog" --seed 5 --output out'
+    assert sweep.expand_task(task) == [task]
+    assert sweep.expand_task('flux --prompt "unterminated') == ['flux --prompt "unterminated']
+
+@pytest.mark.parametrize("prompt", ['a "quoted" cat', "it's a cat", "back\\slash", "tab\there", "# not a comment",
+                                    "", "plain"])
+def test_expanded_lines_round_trip_through_shlex(prompt):
+    argv = ["flux", "--prompt", prompt, "--seed", "1,2", "--output", "out dir/it's"]
+    lines = sweep.expand_task(" ".join(sweep.quote(arg) for arg in argv))
+    assert [shlex.split(line) for line in lines] == sweep.expand_argv(argv)
+    assert all(option(shlex.split(line), "--prompt") == prompt for line in lines)
+
+@pytest.mark.parametrize("text, kind, values", [("10,25,50", int, [10, 25, 50]), ("1..4,10", int, [1, 2, 3, 4, 10]),
+                                                ("5..5", int, [5]), ("3.5, 7", float, [3.5, 7.0])])
+def test_parse_values(text, kind, values):
+    assert sweep.parse_values(text, kind) == values
+
+@pytest.mark.parametrize("text, kind", [("5..1", int), ("1..x", int), ("1.5..3", float), ("1,,2", int),
+                                        ("a,b", float)])
+def test_invalid_values_are_rejected(text, kind):
+    with pytest.raises(ValueError):
+        sweep.parse_values(text, kind)
+
+def test_invalid_sweep_lines_are_kept():
+    bad = "flux --prompt cat --seed 9..1"
+    with pytest.raises(ValueError):
+        sweep.expand_task(bad)
+    assert sweep.expand_tasks([bad, "flux --prompt cat --seed 1,2"])[0] == bad
+    assert len(sweep.expand_tasks([bad, "flux --prompt cat --seed 1,2"])) == 3
+
+def test_sweep_root_of_expanded_lines():
+    lines = sweep.expand_task("flux --prompt cat --seed 1,2 --output out")
+    assert [sweep.sweep_root(line) for line in lines] == ["out", "out"]
+    assert sweep.sweep_root("flux --prompt cat") is None
+
+def test_contact_sheet_grid(tmp_path):
+    root = tmp_path / "sweep"
+    for steps in (5, 25, 100):
+        for seed in (1, 2, 10):
+            if (steps, seed) == (25, 2):
+                continue  # Not generated yet
+            cell = root / f"steps-{steps}" / f"seed-{seed}"
+            cell.mkdir(parents=True)
+            (cell / "old.png").write_bytes(b"")
+            os.utime(cell / "old.png", (1, 1))
+            (cell / "new.png").write_bytes(b"")
+    (root / "steps-5" / "notes.txt").write_text("not an image")
+    path = sweep.write_contact_sheet(str(root))
+    assert path == str(root / sweep.CONTACT_SHEET)
+    page = open(path, encoding="utf-8").read()
+    assert re.findall(r"<th>([^<]+)</th>", page) == ["seed-1", "seed-2", "seed-10", "steps-5", "steps-25", "steps-100"]
+    rows = re.findall(r"<tr><th>([^<]+)</th>\n(.*?)\n</tr>", page, re.S)
+    assert [row for row, _ in rows] == ["steps-5", "steps-25", "steps-100"]
+    cells = [re.findall(r'<td>-</td>|src="([^"]+)"', body) for _, body in rows]
+    assert cells[1] == ["steps-25/seed-1/new.png", "", "steps-25/seed-10/new.png"]
+    assert cells[2] == [f"steps-100/seed-{seed}/new.png" for seed in (1, 2, 10)]
+    assert not list(root.glob("*.tmp"))
+
+def test_contact_sheet_without_images(tmp_path):
+    (tmp_path / "steps-5").mkdir()
+    assert sweep.write_contact_sheet(str(tmp_path)) is None
+    assert not (tmp_path / sweep.CONTACT_SHEET).exists()
@@ -0,0 +1,30 @@
+# test_task_cost.py
+#
+# Fitting the duration line of the cost model.
+
+import pytest
+
+import task_cost
+
+def test_fit_line_recovers_an_exact_line():
+    intercept, slope = task_cost.fit_line([(x, 2.0 + 0.5 * x) for x in (1.0, 4.0, 10.0, 20.0)])
+    assert intercept == pytest.approx(2.0)
+    assert slope == pytest.approx(0.5)
+
+def test_fit_line_without_spread_goes_through_the_origin():
+    assert task_cost.fit_line([(5.0, 10.0), (5.0, 12.0)]) == pytest.approx((0.0, 2.2))
+
+def test_fit_line_never_returns_a_negative_intercept():
+    intercept, slope = task_cost.fit_line([(1.0, 0.1), (10.0, 20.0), (20.0, 41.0)])
+    assert intercept >= 0 and slope > 0
+
+def test_fit_line_ignores_points_without_work():
+    assert task_cost.fit_line([]) is None
+    assert task_cost.fit_line([(0.0, 3.0)]) is None
+
+def test_estimates_fall_back_to_the_fit_of_all_models():
+    records = [{"success": True, "model": "flux", "steps": 10, "width": 1000, "height": 1000,
+                "phases": {"generate": 1.0 + 0.2 * 10 * n, "decode": 0.0}, "images": n} for n in (1, 2, 4)]
+    costs = task_cost.CostModel.from_records(records)
+    assert costs.estimate("flux", 10, 1000, 1000) == pytest.approx(3.0)
+    assert costs.estimate("jugger", 10, 1000, 1000, 2) == pytest.approx(5.0)
@@ -0,0 +1,34 @@
+# test_task_dispatch.py
+#
+# Dispatching queued tasks to backend workers (model affinity, tasks only some servers can run)
+# and planning which tasks are merged into batched requests.
+
+import run_image_generation
+import task_dispatch
+
+def test_dispatcher_keeps_each_worker_on_its_model():
+    tasks = ['flux --prompt "a"', 'jugger --prompt "b"', 'flux --prompt "c"', 'jugger --prompt "d"']
+    dispatcher = task_dispatch.TaskDispatcher(tasks)
+    first = dispatcher.next_tasks("gpu1")[0][2]
+    dispatcher.set_loaded("gpu1", task_dispatch.task_model(first))
+    second = dispatcher.next_tasks("gpu2")[0][2]
+    dispatcher.set_loaded("gpu2", task_dispatch.task_model(second))
+    # An idle worker picks the model no other worker has loaded
+    assert {first.split()[0], second.split()[0]} == {"flux", "jugger"}
+    # Each worker then stays on its model
+    assert dispatcher.next_tasks("gpu1")[0][2].split()[0] == first.split()[0]
+    assert dispatcher.next_tasks("gpu2")[0][2].split()[0] == second.split()[0]
+    assert dispatcher.next_tasks("gpu1") == []
+
+def test_dispatcher_only_gives_tasks_to_capable_workers():
+    tasks = ['flux --prompt "a"', 'jugger --prompt "b"']
+    dispatcher = task_dispatch.TaskDispatcher(tasks, capable={tasks[1]: {"gpu1"}})
+    assert [task for _, _, task in dispatcher.next_tasks("gpu2")] == [tasks[0]]
+    assert dispatcher.next_tasks("gpu2") == []
+    assert [task for _, _, task in dispatcher.next_tasks("gpu1")] == [tasks[1]]
+
+def test_planned_batches_follow_seed_runs():
+    tasks = [f'flux --prompt "a" --seed {seed}' for seed in (3, 1, 2, 7, 8)] + ['flux --prompt "a" --seed -1'] * 2
+    args_list = [run_image_generation.parse_task(task) for task in tasks]
+    assert task_dispatch.planned_batches(args_list, 4) == [[1, 2, 0], [3, 4], [5, 6]]
+    assert task_dispatch.planned_batches(args_list, 2) == [[1, 2], [0], [3, 4], [5, 6]]
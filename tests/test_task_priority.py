@@ -0,0 +1,44 @@
+# test_task_priority.py
+#
+# Effective priority of waiting tasks: one level per AGING_SECONDS waited, and up to DEADLINE_BOOST
+# levels as the deadline comes within DEADLINE_LEAD_SECONDS.
+
+import pytest
+
+import task_priority
+from task_priority import AGING_SECONDS, DEADLINE_BOOST, DEADLINE_LEAD_SECONDS, effective_priority
+
+NOW = 1_000_000.0
+
+def test_fresh_task_has_its_lane():
+    assert effective_priority(3, None, NOW, NOW) == 3
+    # A task queued "in the future" (clock skew between processes) does not lose priority
+    assert effective_priority(3, None, NOW + 60, NOW) == 3
+
+@pytest.mark.parametrize("waited, levels", [(AGING_SECONDS / 2, 0.5), (AGING_SECONDS, 1), (5 * AGING_SECONDS, 5)])
+def test_waiting_raises_the_priority(waited, levels):
+    assert effective_priority(0, None, NOW - waited, NOW) == pytest.approx(levels)
+
+def test_old_low_priority_task_overtakes_new_urgent_one():
+    old = effective_priority(0, None, NOW - 11 * AGING_SECONDS, NOW)
+    urgent = effective_priority(10, None, NOW, NOW)
+    assert old > urgent
+
+@pytest.mark.parametrize("remaining, boost", [(2 * DEADLINE_LEAD_SECONDS, 0), (DEADLINE_LEAD_SECONDS, 0),
+                                              (DEADLINE_LEAD_SECONDS / 4, 0.75 * DEADLINE_BOOST),
+                                              (0, DEADLINE_BOOST), (-DEADLINE_LEAD_SECONDS, DEADLINE_BOOST)])
+def test_deadline_boost(remaining, boost):
+    assert effective_priority(2, NOW + remaining, NOW, NOW) == pytest.approx(2 + boost)
+
+def test_boost_grows_as_the_deadline_approaches():
+    deadline = NOW + DEADLINE_LEAD_SECONDS
+    levels = [effective_priority(0, deadline, NOW, NOW + step * DEADLINE_LEAD_SECONDS / 10) for step in range(12)]
+    assert levels == sorted(levels)
+    # Aging adds on top of the boost
+    assert levels[-1] == pytest.approx(DEADLINE_BOOST + 1.1 * DEADLINE_LEAD_SECONDS / AGING_SECONDS)
+
+def test_sort_key_breaks_ties_by_deadline_then_position():
+    keys = [task_priority.sort_key(1, None, NOW, NOW, 0),
+            task_priority.sort_key(1, NOW + 10 * DEADLINE_LEAD_SECONDS, NOW, NOW, 1),
+            task_priority.sort_key(1, None, NOW, NOW, 2)]
+    assert sorted(range(3), key=keys.__getitem__) == [1, 0, 2]
@@ -0,0 +1,95 @@
+# test_task_store.py
+#
+# Leases of the SQLite task store: claiming, expiry after a runner stops, failed attempts, and
+# releasing the claimed tasks an interrupted run never started.
+
+import sqlite3
+import time
+
+import pytest
+
+import store_runner
+import stub_forge_server
+import task_dispatch
+import task_store
+
+def make_store(tmp_path, tasks, max_attempts=task_store.MAX_ATTEMPTS):
+    store = task_store.TaskStore(str(tmp_path / "tasks.db"), max_attempts)
+    store.add(tasks)
+    return store
+
+def test_add_returns_the_new_ids(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"'])
+    ids = store.add(['flux --prompt "b"', "# comment", 'flux --prompt "c" --seed 1,2'])
+    assert len(ids) == 3
+    assert [task_id for task_id, _ in store.tasks((task_store.PENDING,))][1:] == ids
+
+def test_claimed_tasks_are_not_claimed_twice(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"', 'flux --prompt "b"'])
+    first = store.claim("runner1", 1)
+    second = store.claim("runner2", 5)
+    assert [task for _, task, _ in first] == ['flux --prompt "a"']
+    assert [task for _, task, _ in second] == ['flux --prompt "b"']
+    assert store.claim("runner3", 5) == []
+    assert store.counts()[task_store.RUNNING] == 2
+
+def test_claim_returns_the_queue_time(tmp_path):
+    before = time.time()
+    store = make_store(tmp_path, ['flux --prompt "a"'])
+    (_, _, created), = store.claim("runner1")
+    assert before <= created <= time.time()
+
+def test_urgent_tasks_are_claimed_first(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"', 'flux --prompt "b" --priority 5'])
+    assert [task for _, task, _ in store.claim("runner1")] == ['flux --prompt "b" --priority 5']
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"'])
+    (task_id, _, _), = store.claim("runner1", lease_seconds=-1)
+    assert [claimed_id for claimed_id, _, _ in store.claim("runner2")] == [task_id]
+    # The first runner lost the lease: its failure report is ignored, the completion counts
+    store.fail(task_id, "runner1")
+    assert store.counts()[task_store.RUNNING] == 1
+    store.complete(task_id)
+    assert store.counts()[task_store.DONE] == 1
+
+def test_renewed_lease_is_kept(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"'])
+    store.claim("runner1", lease_seconds=-1)
+    store.renew("runner1")
+    assert store.claim("runner2") == []
+
+def test_failed_task_is_retried_up_to_max_attempts(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"'], max_attempts=2)
+    (task_id, _, _), = store.claim("runner1")
+    store.fail(task_id, "runner1")
+    assert store.counts()[task_store.PENDING] == 1
+    (task_id, _, _), = store.claim("runner1")
+    store.fail(task_id, "runner1")
+    assert store.counts()[task_store.FAILED] == 1
+    assert store.claim("runner1") == []
+
+def test_lease_expiring_too_often_fails_the_task(tmp_path):
+    store = make_store(tmp_path, ['flux --prompt "a"'], max_attempts=1)
+    store.claim("runner1", lease_seconds=-1)
+    assert store.claim("runner2") == []
+    assert store.counts()[task_store.FAILED] == 1
+
+def test_interrupted_run_puts_unstarted_tasks_back(tmp_path, monkeypatch):
+    server = stub_forge_server.StubForgeServer(latency=0.5).start()
+    store = make_store(tmp_path, [f'flux --prompt "task {i}" --steps 4 --width 64 --height 64 --output "{tmp_path}"'
+                                  for i in range(3)])
+
+    def interrupted_join(worker, timeout=None):
+        time.sleep(0.2)  # The worker has started its first task
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(task_dispatch.BackendWorker, "join", interrupted_join)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            store_runner.run_store(store.path, backends=[server.url], max_batch=1, claim_size=3, check=False)
+    finally:
+        server.stop()
+    with sqlite3.connect(store.path) as db:
+        rows = db.execute("SELECT state, attempts FROM tasks ORDER BY id").fetchall()
+    assert sorted(rows) == [(task_store.PENDING, 0), (task_store.PENDING, 0), (task_store.RUNNING, 1)]
@@ -0,0 +1,60 @@
+# test_webui_capabilities.py
+#
+# Preflight checks of a payload against a server snapshot: checkpoint titles with and without a
+# hash, sampler names differing only in case, missing VAEs/modules and lists the server lacks.
+
+import pytest
+
+import model_profiles
+import webui_capabilities
+
+def make_snapshot(**lists):
+    data = {
+        "models": [{"title": "flux1-dev-fp8.safetensors [abc123]", "filename": "/models/Stable-diffusion/flux1-dev-fp8.safetensors"},
+                   {"title": "juggernautXL.safetensors", "filename": "/models/Stable-diffusion/juggernautXL.safetensors"}],
+        "samplers": [{"name": "Euler", "aliases": ["k_euler"]}, {"name": "DPM++ 2M", "aliases": []}],
+        "schedulers": [{"name": "karras", "label": "Karras"}],
+        "vaes": [{"model_name": "ae.safetensors", "filename": "/models/VAE/ae.safetensors"}],
+        "modules": [{"model_name": "clip_l.safetensors", "filename": "/models/text_encoder/clip_l.safetensors"}],
+    }
+    data.update(lists)
+    return webui_capabilities.CapabilitySnapshot("http://stub", data, fetched=0)
+
+def make_profile(checkpoint, hash="", vae=None, modules=()):
+    return model_profiles.ModelProfile("test", {"checkpoint": checkpoint, "hash": hash, "vae": vae,
+                                                "additional_modules": list(modules), "check_files": False})
+
+@pytest.mark.parametrize("checkpoint, hash", [("flux1-dev-fp8.safetensors", "abc123"), ("flux1-dev-fp8.safetensors", ""),
+                                              ("juggernautXL.safetensors", "")])
+def test_available_checkpoint(checkpoint, hash):
+    assert make_snapshot().check_payload(make_profile(checkpoint, hash), {}) == []
+
+@pytest.mark.parametrize("checkpoint, hash", [("flux1-dev-fp8.safetensors", "def456"), ("flux1-schnell.safetensors", ""),
+                                              ("juggernautXL.safetensors", "abc123")])
+def test_missing_checkpoint(checkpoint, hash):
+    problems = make_snapshot().check_payload(make_profile(checkpoint, hash), {})
+    assert problems == [f"checkpoint not on the server: {make_profile(checkpoint, hash).checkpoint_title}"]
+
+@pytest.mark.parametrize("payload", [{"sampler_name": "Euler"}, {"sampler_name": "k_euler"},
+                                     {"sampler_name": "DPM++ 2M", "scheduler": "Karras"}, {"scheduler": "karras"}])
+def test_available_sampler_and_scheduler(payload):
+    assert make_snapshot().check_payload(make_profile("juggernautXL.safetensors"), payload) == []
+
+def test_sampler_in_the_wrong_case_gets_a_hint():
+    problems = make_snapshot().check_payload(make_profile("juggernautXL.safetensors"), {"sampler_name": "euler"})
+    assert problems == ["sampler not on the server: 'euler' (did you mean 'Euler'? the name is case-sensitive)"]
+
+def test_unknown_sampler_has_no_hint():
+    problems = make_snapshot().check_payload(make_profile("juggernautXL.safetensors"),
+                                             {"sampler_name": "Heun", "scheduler": "exponential"})
+    assert problems == ["sampler not on the server: 'Heun'", "scheduler not on the server: 'exponential'"]
+
+def test_missing_vae_and_modules():
+    profile = make_profile("juggernautXL.safetensors", vae="VAE/ae.safetensors",
+                           modules=["text_encoder/clip_l.safetensors", "text_encoder/t5xxl.safetensors"])
+    assert make_snapshot().check_payload(profile, {}) == ["VAE/module not on the server: t5xxl.safetensors"]
+
+def test_lists_the_server_does_not_provide_are_not_checked():
+    snapshot = make_snapshot(models=None, samplers=None, schedulers=None, vaes=None, modules=None)
+    profile = make_profile("other.safetensors", "ffff", vae="missing.safetensors")
+    assert snapshot.check_payload(profile, {"sampler_name": "anything", "scheduler": "anything"}) == []
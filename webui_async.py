@@ -0,0 +1,307 @@
+# webui_async.py
+#
+# Asyncio API for submitting txt2img requests to one or more Forge WebUI servers concurrently.
+# Keeps up to N requests in flight per server, polls /sdapi/v1/progress while they run,
+# and overlaps the handling (decode/write) of finished results with the next generations.
+# With adaptive=True, the number of requests in flight on each server is adjusted by a
+# ConcurrencyController from response times, /sdapi/v1/progress and errors, between 1 and N:
+# enough to keep the GPU busy, without piling up requests that wait long enough to time out.
+# The HTTP calls go through the pooled webui_client.WebUIClient and run in a thread pool,
+# so no extra async HTTP library is needed.
+#
+# Usage:
+#   import asyncio, webui_async
+#   async def main():
+#       async with webui_async.AsyncWebUIClient(["http://127.0.0.1:7860"], max_in_flight=4, adaptive=True) as client:
+#           result = await client.generate({"prompt": "a cat", "steps": 20})
+#           images = webui_async.decode_images(result)
+#   asyncio.run(main())
+
+import asyncio
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import webui_client
+import webui_ready
+
+# Tuning of the adaptive in-flight limit (see ConcurrencyController)
+QUEUE_ALLOWANCE = 1  # Requests allowed to wait in a server's queue beyond the ones it is running
+SMOOTHING = 0.2  # Weight of each response in the limit
+BEST_LATENCY_DRIFT = 0.01  # Per response, the best latency drifts up by this fraction (follows a slower server)
+BACKOFF_FACTOR = 0.5  # Limit multiplier after an error or timeout
+TIMEOUT_HEADROOM = 0.5  # Fraction of the read timeout that the queued work of a server may take
+PROGRESS_INTERVAL = 1.0  # Seconds between /sdapi/v1/progress polls of a busy server
+
+def decode_images(result):
+    """Decode the base64 images of a txt2img result into a list of PNG bytes."""
+    return [base64.b64decode(image) for image in result.get("images", [])]
+
+def parse_info(result):
+    """Return the 'info' of a txt2img result as a dict (the API returns it as a JSON string)."""
+    info = result.get("info")
+    if isinstance(info, str):
+        try:
+            return json.loads(info)
+        except ValueError:
+            return {}
+    return info or {}
+
+def payload_work(payload):
+    """Return the amount of work of a txt2img payload, in megapixel-steps (all images of the batch)."""
+    images = max(1, int(payload.get("batch_size", 1))) * max(1, int(payload.get("n_iter", 1)))
+    megapixels = int(payload.get("width", 512)) * int(payload.get("height", 512)) / 1e6
+    return max(1, int(payload.get("steps", 20))) * megapixels * images
+
+class ConcurrencyController:
+    """
+    Adaptive limit of the txt2img requests in flight on one server.
+    Response times are compared per unit of work (payload_work): requests that only wait in the
+    server's queue take longer than the best seen, so the limit moves towards the number of
+    requests the server actually runs at once (limit x best / current) plus QUEUE_ALLOWANCE
+    waiting, which keeps the GPU busy between requests. While responses are not slowed down and
+    the limit is reached, it grows by up to one per response, and by one when /sdapi/v1/progress
+    shows the server idle although the limit is reached. Errors and timeouts multiply it by
+    BACKOFF_FACTOR. A new request is also held back while the queued work would take more than
+    TIMEOUT_HEADROOM of the read timeout at the best rate seen.
+    Args:
+        max_limit (int): Upper bound of the limit.
+        initial (int): Starting limit.
+        timeout (float): Read timeout of the requests, in seconds.
+    """
+
+    def __init__(self, max_limit, initial=1, timeout=webui_client.READ_TIMEOUT):
+        self.max_limit = max(1, max_limit)
+        self.limit = float(min(max(1, initial), self.max_limit))
+        self.timeout = timeout
+        self.best_latency = None  # Seconds per unit of work of the fastest recent responses
+        self.step_rate = None  # Sampling steps per second reported by /sdapi/v1/progress
+        self.server_busy = None  # Whether the last progress poll showed a running job
+        self._last_step = None  # (job timestamp, sampling step, time) of the last progress poll
+
+    def allowed(self):
+        """Return the current number of requests allowed in flight."""
+        return max(1, min(self.max_limit, int(self.limit)))
+
+    def admits(self, in_flight, queued_work):
+        """Return True if another request can start with in_flight requests carrying queued_work units of work."""
+        if in_flight >= self.allowed():
+            return False
+        if in_flight == 0 or self.best_latency is None or not self.timeout:
+            return True
+        return queued_work * self.best_latency <= TIMEOUT_HEADROOM * self.timeout
+
+    def on_success(self, latency, work, in_flight):
+        """Record a response that took latency seconds for work units, with in_flight requests running."""
+        per_work = latency / max(work, 1e-6)
+        if self.best_latency is None:
+            self.best_latency = per_work
+        else:
+            self.best_latency = min(per_work, self.best_latency * (1 + BEST_LATENCY_DRIFT))
+        gradient = max(BACKOFF_FACTOR, min(1.0, self.best_latency / per_work))
+        target = self.limit * gradient + QUEUE_ALLOWANCE
+        if in_flight < self.allowed():
+            target = min(target, self.limit)  # Not limited by the controller: no evidence for more
+        self._set(self.limit + SMOOTHING * (target - self.limit))
+
+    def on_failure(self):
+        """Back off after an error or timeout."""
+        self._set(self.limit * BACKOFF_FACTOR)
+
+    def on_progress(self, progress, in_flight, now=None):
+        """Record a /sdapi/v1/progress response polled while in_flight requests were running."""
+        if not progress:
+            return  # The poll failed
+        now = time.monotonic() if now is None else now
+        state = progress.get("state") or {}
+        self.server_busy = bool(progress.get("progress") or state.get("job") or state.get("job_count"))
+        step, job = state.get("sampling_step"), state.get("job_timestamp")
+        if isinstance(step, int):
+            if self._last_step and self._last_step[0] == job and step > self._last_step[1]:
+                rate = (step - self._last_step[1]) / max(now - self._last_step[2], 1e-6)
+                self.step_rate = rate if self.step_rate is None else self.step_rate + SMOOTHING * (rate - self.step_rate)
+            self._last_step = (job, step, now)
+        if not self.server_busy and in_flight >= self.allowed():
+            # The GPU is idle while all allowed requests are uploading or downloading: allow one more
+            self._set(self.limit + 1)
+
+    def _set(self, limit):
+        self.limit = max(1.0, min(float(self.max_limit), limit))
+
+    def stats(self):
+        """Return the controller state as a dict (for logging)."""
+        return {"limit": self.allowed(), "best_seconds_per_work": self.best_latency, "step_rate": self.step_rate,
+                "server_busy": self.server_busy}
+
+class _Backend:
+    """One server with its client, in-flight limit and the requests currently running."""
+
+    def __init__(self, url, max_in_flight, adaptive):
+        self.client = webui_client.WebUIClient(url, pool_size=max_in_flight + 1)
+        self.controller = ConcurrencyController(max_in_flight, initial=1 if adaptive else max_in_flight,
+                                                timeout=self.client.timeout[1])
+        self.adaptive = adaptive
+        self._changed = None  # Created on first use, inside the running loop
+        self.in_flight = 0  # Requests waiting for a slot or running
+        self.running = 0
+        self.running_work = 0.0
+        self.monitor = None  # Task polling /sdapi/v1/progress while requests run (adaptive only)
+
+    @property
+    def changed(self):
+        """Condition notified when a slot frees up or the limit changes."""
+        # Created lazily: on Python 3.8/3.9 an asyncio.Condition binds to the loop current at creation,
+        # which is not the loop asyncio.run() later starts
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def admits(self, work):
+        if not self.adaptive:
+            return self.running < self.controller.max_limit
+        return self.controller.admits(self.running, self.running_work + work)
+
+class AsyncWebUIClient:
+    """
+    Asyncio client keeping several txt2img requests in flight against one or more servers.
+    Args:
+        urls (list): WebUI base URLs (default: the WEBUI_URL server).
+        max_in_flight (int): Maximum number of concurrent requests per server.
+        handler_workers (int): Threads used to handle finished results (decode/write).
+        adaptive (bool): Adjust the number of concurrent requests of each server between 1 and
+            max_in_flight (see ConcurrencyController) instead of always allowing max_in_flight.
+    """
+
+    def __init__(self, urls=None, max_in_flight=2, handler_workers=2, adaptive=False):
+        self.backends = [_Backend(url, max_in_flight, adaptive) for url in (urls or [webui_client.default_url()])]
+        self.http_pool = ThreadPoolExecutor(max_workers=max_in_flight * len(self.backends) + len(self.backends),
+                                            thread_name_prefix="webui-http")
+        self.handler_pool = ThreadPoolExecutor(max_workers=handler_workers, thread_name_prefix="webui-handler")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Wait for running handlers and close the thread pools and connections."""
+        loop = asyncio.get_running_loop()
+        for backend in self.backends:
+            if backend.monitor:
+                backend.monitor.cancel()
+        await loop.run_in_executor(None, self.handler_pool.shutdown)
+        self.http_pool.shutdown(wait=False)
+        for backend in self.backends:
+            backend.client.close()
+
+    async def _call(self, func, *args):
+        """Run a blocking call in the HTTP thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.http_pool, func, *args)
+
+    def _pick_backend(self):
+        """Pick the server with the most free slots (then the fewest requests in flight)."""
+        return min(self.backends, key=lambda backend: (backend.in_flight - backend.controller.allowed(),
+                                                       backend.in_flight))
+
+    async def setup_model(self, options, timeout=webui_ready.DEFAULT_TIMEOUT):
+        """Load the given model options on every server (see webui_ready.ensure_model_options)."""
+        await asyncio.gather(*(self._call(webui_ready.ensure_model_options, backend.client, options, timeout)
+                               for backend in self.backends))
+
+    async def generate(self, payload, backend=None):
+        """
+        Submit one txt2img request and return the decoded JSON result.
+        Waits for a free slot on the chosen server (default: the least busy one).
+        """
+        backend = backend or self._pick_backend()
+        work = payload_work(payload)
+        backend.in_flight += 1
+        try:
+            async with backend.changed:
+                await backend.changed.wait_for(lambda: backend.admits(work))
+                backend.running += 1
+                backend.running_work += work
+            try:
+                if backend.adaptive and backend.monitor is None:
+                    backend.monitor = asyncio.ensure_future(self._monitor(backend))
+                return await self._post(backend, payload, work)
+            finally:
+                async with backend.changed:
+                    backend.running -= 1
+                    backend.running_work = max(0.0, backend.running_work - work)
+                    backend.changed.notify_all()
+        finally:
+            backend.in_flight -= 1
+
+    async def _post(self, backend, payload, work):
+        """Run a txt2img request on a server and report its outcome to the server's controller."""
+        started = time.monotonic()
+        running = backend.running
+        try:
+            response = await self._call(
+                lambda: backend.client.post("/sdapi/v1/txt2img", json=payload, retry_unavailable=True))
+            response.raise_for_status()
+            result = await self._call(response.json)
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if backend.adaptive and (status is None or status >= 500):  # Timeouts, connection and server errors
+                backend.controller.on_failure()
+            raise
+        if backend.adaptive:
+            backend.controller.on_success(time.monotonic() - started, work, max(running, backend.running))
+        return result
+
+    async def _monitor(self, backend):
+        """Feed a server's progress to its controller while it has requests running."""
+        try:
+            while backend.running:
+                progress = await self.progress(backend)
+                backend.controller.on_progress(progress, backend.running)
+                async with backend.changed:
+                    backend.changed.notify_all()  # The limit may have grown
+                await asyncio.sleep(PROGRESS_INTERVAL)
+        finally:
+            backend.monitor = None
+
+    async def progress(self, backend=None):
+        """Return the /sdapi/v1/progress response of a server (the first one by default)."""
+        backend = backend or self.backends[0]
+        return await self._call(webui_ready.monitor_progress, backend.client)
+
+    async def watch_progress(self, interval=1.0, backend=None):
+        """Async generator yielding the progress of a server every `interval` seconds."""
+        while True:
+            yield await self.progress(backend)
+            await asyncio.sleep(interval)
+
+    async def generate_many(self, payloads, handle_result=None, on_progress=None, progress_interval=1.0):
+        """
+        Generate all payloads, keeping up to max_in_flight requests per server running.
+        Each finished result is passed to handle_result(payload, result) in a handler thread,
+        so decoding and writing overlap with the generations still running.
+        If on_progress is given it is called with each server's progress while work is pending.
+        Returns the list of results (or handler return values) in payload order.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def run_one(payload):
+            result = await self.generate(payload)
+            if handle_result is None:
+                return result
+            return await loop.run_in_executor(self.handler_pool, handle_result, payload, result)
+
+        async def poll_progress():
+            while True:
+                for backend in self.backends:
+                    if backend.in_flight:
+                        on_progress(backend.client.base_url, await self.progress(backend))
+                await asyncio.sleep(progress_interval)
+
+        poller = asyncio.ensure_future(poll_progress()) if on_progress else None
+        try:
+            return await asyncio.gather(*(run_one(payload) for payload in payloads))
+        finally:
+            if poller:
+                poller.cancel()
@@ -0,0 +1,196 @@
+# webui_capabilities.py
+#
+# Snapshot of what a Forge WebUI server offers (checkpoints, samplers, schedulers, VAEs and
+# modules), cached on disk so that queued tasks can be checked against it in milliseconds before
+# a run starts (see preflight.py) instead of failing after a model switch.
+# The snapshot of each server is kept in .webui_capabilities.json for DEFAULT_TTL seconds; after
+# that each list is fetched again, sending the ETag of the cached copy (If-None-Match) so servers
+# that support it answer 304 without resending the data. Lists the server does not provide (e.g.
+# /sdapi/v1/schedulers on older versions) are not checked. If the server cannot be reached, the
+# cached snapshot is used however old it is.
+#
+# Usage:
+#   python webui_capabilities.py [--refresh] [--url http://127.0.0.1:7860]
+#
+#   import webui_capabilities
+#   snapshot = webui_capabilities.load_snapshot(client)
+#   problems = snapshot.check_payload(profile, payload)
+
+import argparse
+import json
+import os
+import threading
+import time
+
+import webui_client
+import webui_ready
+
+# Default cache location and lifetime
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".webui_capabilities.json")
+DEFAULT_TTL = 3600
+
+# Lists in a snapshot and the endpoints they come from
+ENDPOINTS = {
+    "models": "/sdapi/v1/sd-models",
+    "samplers": "/sdapi/v1/samplers",
+    "schedulers": "/sdapi/v1/schedulers",
+    "vaes": "/sdapi/v1/sd-vae",
+    "modules": "/sdapi/v1/sd-modules",
+}
+
+_cache_lock = threading.Lock()
+
+def _file_name(value):
+    """Return the file name of a path or list entry, ignoring the directory."""
+    return os.path.basename(str(value).replace("\\", "/"))
+
+class CapabilitySnapshot:
+    """
+    The lists of one server.
+    Args:
+        url (str): Server base URL.
+        data (dict): List name (see ENDPOINTS) -> the endpoint's JSON list, or None if not provided.
+        fetched (float): Timestamp the lists were last fetched or confirmed.
+        etags (dict): List name -> ETag of the cached list.
+        from_cache (bool): True if the snapshot was loaded from the cache file without contacting the server.
+    """
+
+    def __init__(self, url, data, fetched, etags=None, from_cache=False):
+        self.url = url
+        self.data = data
+        self.fetched = fetched
+        self.etags = etags or {}
+        self.from_cache = from_cache
+
+    def to_json(self):
+        return {"data": self.data, "fetched": self.fetched, "etags": self.etags}
+
+    def _names(self, name, *fields):
+        """Return the values of the given fields of a list's entries, or None if the list is unknown."""
+        entries = self.data.get(name)
+        if not isinstance(entries, list):
+            return None
+        names = []
+        for entry in entries:
+            for field in fields:
+                value = entry.get(field) if isinstance(entry, dict) else None
+                if isinstance(value, list):
+                    names += [str(item) for item in value]
+                elif value:
+                    names.append(str(value))
+        return names
+
+    def check_payload(self, profile, payload):
+        """
+        Check a model profile's server options and a txt2img payload against the snapshot.
+        Returns a list of problems (empty if everything the snapshot knows about is available).
+        """
+        problems = []
+        titles = self._names("models", "title", "filename")
+        if titles is not None and not any(webui_ready.setting_matches(title, profile.checkpoint_title)
+                                          for title in titles):
+            problems.append(f"checkpoint not on the server: {profile.checkpoint_title}")
+        for option, label in (("sampler_name", "sampler"), ("scheduler", "scheduler")):
+            value = payload.get(option)
+            names = self._names(label + "s", "name", "label", "aliases")
+            if value is None or names is None or value in names:
+                continue
+            matches = [name for name in names if name.lower() == str(value).lower()]
+            hint = f" (did you mean {matches[0]!r}? the name is case-sensitive)" if matches else ""
+            problems.append(f"{label} not on the server: {value!r}{hint}")
+        files = self._names("vaes", "model_name", "filename")
+        modules = self._names("modules", "model_name", "filename")
+        if files is not None or modules is not None:
+            available = {_file_name(name) for name in (files or []) + (modules or [])}
+            options = profile.options()
+            wanted = ([options["sd_vae"]] if "sd_vae" in options else []) + options.get("forge_additional_modules", [])
+            for path in wanted:
+                if _file_name(path) not in available:
+                    problems.append(f"VAE/module not on the server: {_file_name(path)}")
+        return problems
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _write_cache(cache_file, url, snapshot):
+    """Store a server's snapshot in the cache file atomically (a failed write only costs a refetch)."""
+    with _cache_lock:
+        cache = _read_cache(cache_file)
+        cache[url] = snapshot.to_json()
+        tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def fetch_snapshot(client, cached=None):
+    """
+    Fetch the lists of a server, revalidating the lists of a cached snapshot by ETag.
+    Raises on connection errors; endpoints the server does not have give None.
+    """
+    data, etags = {}, {}
+    for name, path in ENDPOINTS.items():
+        headers = {}
+        if cached and cached.etags.get(name) and cached.data.get(name) is not None:
+            headers["If-None-Match"] = cached.etags[name]
+        response = client.get(path, headers=headers)
+        if response.status_code == 304:
+            data[name], etags[name] = cached.data[name], cached.etags[name]
+            continue
+        if response.status_code == 404:
+            data[name] = None
+            continue
+        response.raise_for_status()
+        data[name] = response.json()
+        if response.headers.get("ETag"):
+            etags[name] = response.headers["ETag"]
+    return CapabilitySnapshot(client.base_url, data, time.time(), etags)
+
+def load_snapshot(client=None, ttl=DEFAULT_TTL, cache_file=DEFAULT_CACHE_FILE, refresh=False):
+    """
+    Return the capability snapshot of a server (default: the shared client's), from the cache
+    file if it is younger than ttl seconds (unless refresh), else fetched and cached.
+    If the server cannot be reached, returns the cached snapshot whatever its age, or None.
+    """
+    client = client or webui_client.get_client()
+    entry = _read_cache(cache_file).get(client.base_url)
+    cached = None
+    if isinstance(entry, dict) and isinstance(entry.get("data"), dict):
+        cached = CapabilitySnapshot(client.base_url, entry["data"], entry.get("fetched", 0), entry.get("etags"),
+                                    from_cache=True)
+    if cached and not refresh and time.time() - cached.fetched < ttl:
+        return cached
+    try:
+        snapshot = fetch_snapshot(client, cached)
+    except Exception as e:
+        print(f"Could not fetch the capabilities of {client.base_url}: {e}")
+        return cached
+    _write_cache(cache_file, client.base_url, snapshot)
+    return snapshot
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show (and cache) what a Forge WebUI server offers.")
+    parser.add_argument('--url', help='WebUI base URL (default: WEBUI_URL)')
+    parser.add_argument('--refresh', action='store_true', help='Fetch the lists even if the cached snapshot is recent')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help=f'Maximum age of the cached snapshot in seconds (default: {DEFAULT_TTL})')
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(webui_client.WebUIClient(args.url) if args.url else None, args.ttl, refresh=args.refresh)
+    if snapshot is None:
+        raise SystemExit("No capability snapshot available.")
+    age = time.time() - snapshot.fetched
+    print(f"{snapshot.url} (fetched {age:.0f} s ago{', cached' if snapshot.from_cache else ''})")
+    for name, fields in (("models", ("title",)), ("samplers", ("name",)), ("schedulers", ("label",)),
+                         ("vaes", ("model_name",)), ("modules", ("model_name",))):
+        names = snapshot._names(name, *fields)
+        print(f"{name}: " + ("not provided by the server" if names is None else ", ".join(names) or "none"))
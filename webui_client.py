@@ -0,0 +1,154 @@
+# webui_client.py
+#
+# Shared HTTP client for the Forge WebUI API, used by all scripts in this project.
+# Wraps a pooled requests.Session (keep-alive connections are reused between calls),
+# applies connect/read timeouts and retries idempotent requests with exponential backoff
+# on connection errors and transient 502/503/504 responses. Requests that must not run twice
+# (generation) are only retried when they never reached the server: on connection failures
+# and, with retry_unavailable=True, on 502/503/504 - never on a read timeout, as the server may
+# still be generating.
+#
+# The base URL defaults to http://127.0.0.1:7860 and can be changed with the WEBUI_URL
+# environment variable (or in the .env file), e.g. WEBUI_URL=http://192.168.1.100:7860
+#
+# requests is imported when the first request is sent, so creating a client (or importing a
+# script that creates one at module level) does not slow down the scripts' startup or --help.
+#
+# Usage:
+#   import webui_client
+#   client = webui_client.get_client()
+#   response = client.get("/sdapi/v1/options")
+#   response.raise_for_status()
+
+import os
+import threading
+import time
+
+# Default base URL for the Forge WebUI API
+DEFAULT_URL = "http://127.0.0.1:7860"
+
+# Default timeouts (seconds); generation requests can take minutes, so the read timeout is generous
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 900
+
+# Retry settings for transient failures
+RETRIES = 3
+BACKOFF_SECONDS = 1.0
+RETRY_STATUS_CODES = (502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+def default_url():
+    """Return the WebUI base URL from the WEBUI_URL environment variable (or .env), or the default."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("WEBUI_URL", DEFAULT_URL).rstrip("/")
+
+def _not_sent(error):
+    """Return True if a requests exception means the request never reached the server."""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+class WebUIClient:
+    """
+    Client for one WebUI server, holding a pooled requests.Session (created on first use).
+    Args:
+        base_url (str): Base URL of the WebUI API (default: WEBUI_URL or http://127.0.0.1:7860).
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for a response.
+        retries (int): Number of retries for idempotent requests.
+        backoff (float): Initial backoff between retries, doubled after each retry.
+        pool_size (int): Maximum number of pooled connections to the server.
+    """
+
+    def __init__(self, base_url=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF_SECONDS, pool_size=4):
+        self.base_url = (base_url or default_url()).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled requests.Session (importing requests and creating the session on first use)."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, path, idempotent=None, retry_unavailable=False, **kwargs):
+        """
+        Send a request to the server and return the response (call raise_for_status() on it).
+        Idempotent requests (GET by default, or idempotent=True) are retried on connection
+        errors, timeouts and 502/503/504 responses; other requests are only retried when
+        the connection could not be established, and on 502/503/504 with retry_unavailable=True.
+        """
+        import requests
+
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault("timeout", self.timeout)
+        url = f"{self.base_url}{path}"
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not idempotent and not _not_sent(e):
+                    raise
+                error = e
+            else:
+                retry = idempotent or retry_unavailable
+                if not retry or response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                error = f"HTTP {response.status_code}"
+                response.close()
+            if last_attempt:
+                raise error
+            print(f"Request {method} {path} failed ({error}); retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            delay *= 2
+
+    def get(self, path, **kwargs):
+        """Send a GET request (retried on transient failures)."""
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, json=None, idempotent=False, retry_unavailable=False, **kwargs):
+        """
+        Send a POST request with a JSON body; pass idempotent=True if it is safe to repeat, or
+        retry_unavailable=True to retry it on 502/503/504 only (see request).
+        """
+        return self.request("POST", path, idempotent=idempotent, retry_unavailable=retry_unavailable,
+                            json=json, **kwargs)
+
+    def close(self):
+        """Close the pooled connections."""
+        if self._session is not None:
+            self._session.close()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_client():
+    """Return the shared client for the default WebUI server, creating it on first use."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = WebUIClient()
+        return _default_client
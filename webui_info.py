@@ -1,13 +1,13 @@
-import requests
 import json
+import webui_client
 
-# Configuration
-url = "http://127.0.0.1:7860"
+# Configuration: the WebUI base URL comes from WEBUI_URL (default http://127.0.0.1:7860)
+client = webui_client.get_client()
 
 def get_samplers():
     """Get a list of all available samplers"""
     try:
-        response = requests.get(f"{url}/sdapi/v1/samplers")
+        response = client.get("/sdapi/v1/samplers")
         response.raise_for_status()
         samplers = response.json()
         return samplers
@@ -18,7 +18,7 @@ def get_samplers():
 def get_model_info():
     """Get information about the current model settings"""
     try:
-        response = requests.get(f"{url}/sdapi/v1/options")
+        response = client.get("/sdapi/v1/options")
         response.raise_for_status()
         options = response.json()
         
@@ -41,7 +41,7 @@ def get_forge_status():
     """Check if we're using Forge WebUI based on API endpoints"""
     try:
         # Try a Forge-specific endpoint
-        response = requests.get(f"{url}/sdapi/v1/forge/version")
+        response = client.get("/sdapi/v1/forge/version")
         if response.status_code == 200:
             version_info = response.json()
             return f"Forge WebUI detected: {version_info}"
@@ -53,7 +53,7 @@ def get_forge_status():
 def list_available_models():
     """Get a list of all available models from the WebUI API."""
     try:
-        response = requests.get(f"{url}/sdapi/v1/sd-models")
+        response = client.get("/sdapi/v1/sd-models")
         response.raise_for_status()
         models = response.json()
         return models
@@ -63,6 +63,7 @@ def list_available_models():
 
 if __name__ == "__main__":
     print("=== WebUI API Information Tool ===")
+    print(f"Server: {client.base_url}")
     
     # Check if server is running
     try:
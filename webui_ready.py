@@ -0,0 +1,104 @@
+# webui_ready.py
+#
+# Shared helper used by the model scripts to switch the WebUI model and wait until it is loaded.
+# Instead of sleeping a fixed number of seconds after POSTing to /sdapi/v1/options, it polls
+# /sdapi/v1/options and /sdapi/v1/progress (with backoff) until the requested settings are
+# active and the server is idle. The POST is skipped when the settings are already active.
+
+import os
+import time
+
+import task_timing
+
+# Default limits for waiting on a model load (seconds)
+DEFAULT_TIMEOUT = 120
+INITIAL_POLL_DELAY = 0.25
+MAX_POLL_DELAY = 4.0
+
+def _base_name(value):
+    """Return the file name of a path or checkpoint title, ignoring the directory."""
+    return os.path.basename(str(value).replace("\\", "/"))
+
+def _strip_hash(title):
+    """Strip a trailing ' [hash]' from a checkpoint title."""
+    return title.split(" [")[0]
+
+def setting_matches(current, wanted):
+    """
+    Compare a value reported by the server with the requested one.
+    Paths are compared by file name (the server may report VAE and module names
+    without their directory), and a checkpoint requested without a hash matches
+    the same checkpoint reported with one.
+    """
+    if isinstance(wanted, (list, tuple)):
+        if not isinstance(current, (list, tuple)):
+            return False
+        return sorted(_base_name(v) for v in current) == sorted(_base_name(v) for v in wanted)
+    if current is None:
+        return False
+    current_name = _base_name(current)
+    wanted_name = _base_name(wanted)
+    if current_name == wanted_name:
+        return True
+    return " [" not in wanted_name and _strip_hash(current_name) == wanted_name
+
+def options_match(current_options, wanted_options):
+    """Return True if every requested option is already active on the server."""
+    return all(setting_matches(current_options.get(key), value) for key, value in wanted_options.items())
+
+def get_options(client):
+    """Get the current WebUI options."""
+    response = client.get("/sdapi/v1/options")
+    response.raise_for_status()
+    return response.json()
+
+def monitor_progress(client):
+    """Return the /sdapi/v1/progress report of the current generation ({} if the server cannot be read)."""
+    try:
+        response = client.get("/sdapi/v1/progress")
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error getting progress: {str(e)}")
+        return {}
+
+def server_is_idle(client):
+    """Return True if the server reports no running or queued jobs."""
+    response = client.get("/sdapi/v1/progress", params={"skip_current_image": "true"})
+    response.raise_for_status()
+    progress = response.json()
+    state = progress.get("state") or {}
+    return not state.get("job_count") and not progress.get("progress")
+
+def ensure_model_options(client, payload, timeout=DEFAULT_TIMEOUT):
+    """
+    Make sure the WebUI has the given options (model checkpoint, VAE, additional modules) loaded.
+    Skips the POST if the options are already active and the server is idle, otherwise sets them and polls
+    until the server reports them as active and idle.
+    Args:
+        client (webui_client.WebUIClient): Client for the WebUI server.
+        payload (dict): Options to set, as sent to /sdapi/v1/options.
+        timeout (float): Maximum number of seconds to wait for the model to load.
+    Returns:
+        float: Seconds spent waiting for the model (0 when it was already loaded).
+    """
+    start = time.monotonic()
+    if options_match(get_options(client), payload) and server_is_idle(client):
+        print("Requested model is already loaded; skipping model switch.")
+        return 0.0
+
+    response = client.post("/sdapi/v1/options", json=payload, idempotent=True)
+    response.raise_for_status()
+
+    print(f"Waiting for model to load into memory (timeout {timeout} seconds)...")
+    delay = INITIAL_POLL_DELAY
+    while True:
+        if options_match(get_options(client), payload) and server_is_idle(client):
+            waited = time.monotonic() - start
+            print(f"Model ready after {waited:.1f} seconds.")
+            return waited
+        if time.monotonic() - start + delay > timeout:
+            raise TimeoutError(f"Model was not ready after {timeout} seconds: {payload.get('sd_model_checkpoint')}")
+        time.sleep(delay)
+        task_timing.add("model_wait", delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)